@@ -1,5 +1,7 @@
-import json
 import streamlit as st
+import secrets
+import time
+import tempfile
 from datetime import date
 import os
 from dotenv import load_dotenv
@@ -8,44 +10,78 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Internal imports from the new structure
-from src.database import (
-    init_db,
-    add_expense,
-    list_expenses_month,
-    upsert_default_users,
-    upsert_default_categories,
-    get_users,
-    add_settlement,
-    get_settlement,
-    update_expense,
-    delete_expense,
-    update_category,
-    delete_category,
-)
-from src.logic import compute_month_summary
+from src import diagnostics
+from src.database import expense_fingerprint, EXPENSES_PAGE_SIZE, MonthClosedError
+from src.export import export_expenses
+from src.storage import get_storage
+from src.tenancy import DEFAULT_HOUSEHOLD_ID, set_household
+from src.write_queue import get_write_queue, merge_pending_balances, merge_pending_ledger, merge_pending_report
+from src.logic import household_summary, minimum_transfers
+from src.importers import parse_statement, map_statement_lines
 from src.utils.categories import (
     carregar_categorias, 
     adicionar_categoria_personalizada, 
     get_categorias_padrao, 
     salvar_categorias
 )
-from src.ui.common import last_n_months, apply_custom_css
+from src.ui.common import last_n_months, apply_custom_css, columns_for, split_editor
+
+# Unlocks "Nova casa" in Configurações; without it nobody can create households from the app
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 # Page Config
 st.set_page_config(page_title="Casa Split", page_icon="🏠", layout="centered")
 apply_custom_css()
 
-# Initialization
-init_db()
-upsert_default_users(user_a_name="Thiago", user_b_name="Marina")
-upsert_default_categories()
-users = get_users()
-user_a = users[0]
-user_b = users[1]
+# Group this rerun's queries for the diagnostics section in Configurações
+diagnostics.begin_rerun()
+
+# Initialization (migrations + seed run once per process, not on every rerun)
+# Postgres or embedded SQLite, picked from the environment (see src/storage.py)
+storage = get_storage()
+storage.bootstrap(user_a_name="Thiago", user_b_name="Marina")
+# One deployment serves many households: ?casa=<slug> picks this session's (see src/tenancy.py)
+casa = st.query_params.get("casa")
+household = storage.get_household(casa) if casa else None
+if casa and household is None:
+    st.error("Casa não encontrada. Confira o link que você recebeu.")
+    st.stop()
+if household is None and storage.multi_household:
+    # Falling back to HOUSEHOLD_ID would open its data to anyone without a link.
+    st.error("Abra o app pelo link da sua casa (`?casa=<código>`).")
+    st.stop()
+set_household(household["id"] if household else DEFAULT_HOUSEHOLD_ID)
+users = storage.get_users()
+user_names = {u["id"]: u["name"] for u in users}
+# Expenses wait in a local journal when WRITE_QUEUE is on (see src/write_queue.py)
+write_queue = get_write_queue()
 
 # Sidebar
 st.sidebar.title("🏠 Casa Split")
-page = st.sidebar.radio("Menu", ["Adicionar gasto", "Resumo do mês", "Fechamento", "Configurações"])
+if household is not None:
+    st.sidebar.caption(household["name"])
+page = st.sidebar.radio("Menu", ["Adicionar gasto", "Importar extrato", "Resumo do mês", "Resumo do ano", "Fechamento", "Configurações"])
+diagnostics.set_page(page)
+if write_queue is not None:
+    queued = len(write_queue.pending())
+    if queued:
+        st.sidebar.caption(f"⏳ {queued} gasto(s) aguardando gravação")
+    if write_queue.last_error:
+        st.sidebar.caption(f"⚠️ Banco indisponível, tentando de novo: {write_queue.last_error[:80]}")
+    dead = write_queue.dead_letters()
+    if dead:
+        with st.sidebar.expander(f"❌ {len(dead)} gasto(s) não gravado(s)", expanded=True):
+            for d in dead:
+                e = d["expense"]
+                st.write(f"**{e['spent_at']}** R${e['amount_cents'] / 100:.2f} {e['description'][:30]}")
+                st.caption(d["error"][:120])
+                col1, col2 = st.columns(2)
+                if col1.button("Tentar de novo", key=f"retry_{e['key']}"):
+                    write_queue.retry_dead(e["key"])
+                    st.rerun()
+                if col2.button("Descartar", key=f"discard_{e['key']}"):
+                    write_queue.discard_dead(e["key"])
+                    st.rerun()
 
 # Main Pages
 if page == "Adicionar gasto":
@@ -60,9 +96,11 @@ if page == "Adicionar gasto":
     with col2:
         spent_at = st.date_input("📅 Data", value=date.today(), key="spent_at")
 
-    # Default to user_b (Marina) if available
+    # Default to the second user (Marina) if available
     default_payer_idx = 1 if len(users) > 1 and users[1]["name"] == "Marina" else 0
-    payer = st.selectbox("👤 Quem pagou?", [u["name"] for u in users], index=default_payer_idx, key="payer")
+    payer_id = st.selectbox(
+        "👤 Quem pagou?", [u["id"] for u in users], index=default_payer_idx, format_func=user_names.get, key="payer"
+    )
     
     categorias = carregar_categorias()
     if "category" not in st.session_state or st.session_state.category not in categorias:
@@ -83,86 +121,209 @@ if page == "Adicionar gasto":
 
     description = st.text_input("📝 Descrição (opcional)", placeholder="ex: Compra no Angeloni", key="description")
 
-    # Discrete Split Selection
-    custom_split = st.checkbox("Personalizar divisão (padrão 50/50)", key="custom_split_check")
-    
-    if custom_split:
-        if "split_a_pct" not in st.session_state:
-            st.session_state.split_a_pct = 50
-        
-        split_a_pct = st.slider(f"{user_a['name']} (%)", 0, 100, st.session_state.split_a_pct)
-        st.session_state.split_a_pct = split_a_pct
-        split_b_pct = 100 - split_a_pct
-        st.caption(f"{user_b['name']}: {split_b_pct}%")
-        
-        split_a = split_a_pct / 100.0
-        split_b = split_b_pct / 100.0
-    else:
-        split_a = 0.5
-        split_b = 0.5
+    # Equal parts, or a weight per person
+    split_bp = split_editor(users, key="split")
     
     if st.button("✅ Salvar Gasto", use_container_width=True, type="primary"):
         if amount is None or amount <= 0:
             st.error("O valor deve ser maior que zero.")
+        elif storage.get_month_snapshot(spent_at.strftime("%Y-%m")) is not None:
+            # Checked up front: the queue would only find out when flushing.
+            st.error(f"🔒 {MonthClosedError([spent_at.strftime('%Y-%m')])}")
         else:
-            split_json = json.dumps({str(user_a["id"]): split_a, str(user_b["id"]): split_b})
-            payer_id = user_a["id"] if payer == user_a["name"] else user_b["id"]
-            
-            # If custom category, add it to the list
-            if category == "Outro" and categoria_usada != "Outro":
-                adicionar_categoria_personalizada(categoria_usada)
-            
-            add_expense(
-                amount_cents=int(round(amount * 100)),
-                payer_user_id=payer_id,
-                category=categoria_usada,
-                description=description.strip() or categoria_usada,
-                spent_at=str(spent_at),
-                split_json=split_json
+            new_category = category == "Outro" and categoria_usada != "Outro"
+            amount_cents = int(round(amount * 100))
+            final_description = description.strip() or categoria_usada
+            fingerprint = expense_fingerprint(spent_at, amount_cents, payer_id, final_description)
+            saved = True
+            if write_queue is not None:
+                # Acknowledge from the journal; the database may be asleep.
+                already_logged = any(
+                    expense_fingerprint(e["spent_at"], e["amount_cents"], e["payer_user_id"], e["description"]) == fingerprint
+                    for e in write_queue.pending()
+                )
+                write_queue.enqueue_expense(
+                    amount_cents, payer_id, categoria_usada, final_description, str(spent_at), split_bp,
+                    add_category=new_category
+                )
+                st.success("✨ Gasto registrado! Ele será gravado no banco em instantes.")
+            else:
+                # If custom category, add it to the list
+                if new_category:
+                    adicionar_categoria_personalizada(categoria_usada)
+                already_logged = storage.find_duplicates([fingerprint])
+                try:
+                    storage.add_expense(
+                        amount_cents=amount_cents,
+                        payer_user_id=payer_id,
+                        category=categoria_usada,
+                        description=final_description,
+                        spent_at=str(spent_at),
+                        split_bp=split_bp
+                    )
+                except MonthClosedError as e:
+                    # Closed by someone else between the check above and this write.
+                    st.error(f"🔒 {e}")
+                    saved = False
+                else:
+                    st.success("✨ Gasto salvo com sucesso!")
+            if saved and already_logged:
+                st.warning("⚠️ Já existia um gasto com a mesma data, valor, pagador e descrição. Confira em \"Resumo do mês\" se não é duplicado.")
+            elif saved:
+                st.balloons()
+
+elif page == "Importar extrato":
+    st.header("📥 Importar Extrato")
+    uploaded = st.file_uploader("Arquivo do banco (CSV ou OFX)", type=["csv", "ofx", "qfx"])
+
+    col1, col2 = st.columns(2)
+    with col1:
+        import_payer_id = st.selectbox(
+            "👤 Quem pagou?", [u["id"] for u in users], format_func=user_names.get, key="import_payer"
+        )
+    with col2:
+        categorias = carregar_categorias()
+        import_default_cat = st.selectbox(
+            "📁 Categoria padrão", categorias,
+            index=categorias.index("Outro") if "Outro" in categorias else 0, key="import_default_cat"
+        )
+    import_split = split_editor(users, key="import_split")
+    expenses_negative = st.checkbox(
+        "Débitos aparecem com sinal negativo (extrato de conta / OFX)", value=True, key="import_negative"
+    )
+
+    if uploaded is not None:
+        try:
+            lines = parse_statement(uploaded.name, uploaded.getvalue())
+        except ValueError as e:
+            st.error(f"Não foi possível ler o arquivo: {e}")
+            lines = []
+        to_import = map_statement_lines(
+            lines,
+            payer_user_id=import_payer_id,
+            split_bp=import_split,
+            categories=categorias,
+            default_category=import_default_cat,
+            expenses_negative=expenses_negative,
+        )
+
+        # Flag rows already in the database or repeated within the file.
+        fingerprints = [
+            expense_fingerprint(e["spent_at"], e["amount_cents"], e["payer_user_id"], e["description"])
+            for e in to_import
+        ]
+        existing = storage.find_duplicates(fingerprints)
+        seen = set()
+        duplicate_flags = []
+        for fp in fingerprints:
+            if fp in existing:
+                duplicate_flags.append("⚠️ já existe")
+            elif fp in seen:
+                duplicate_flags.append("⚠️ repetido no arquivo")
+            else:
+                duplicate_flags.append("")
+            seen.add(fp)
+        n_duplicates = sum(1 for f in duplicate_flags if f)
+        if n_duplicates:
+            st.warning(f"⚠️ {n_duplicates} lançamento(s) parecem duplicados.")
+            if st.checkbox("Ignorar duplicados", value=True, key="import_skip_duplicates"):
+                to_import = [e for e, flag in zip(to_import, duplicate_flags) if not flag]
+                duplicate_flags = [""] * len(to_import)
+
+        # Dry run: nothing is written until the button below is pressed.
+        total_import = sum(e["amount_cents"] for e in to_import) / 100.0
+        st.info(f"{len(lines)} lançamentos lidos, {len(to_import)} gastos a importar (R$ {total_import:.2f}).")
+        if to_import:
+            st.dataframe(
+                [
+                    {"Data": e["spent_at"], "Valor (R$)": e["amount_cents"] / 100.0,
+                     "Categoria": e["category"], "Descrição": e["description"], "Duplicado": flag}
+                    for e, flag in zip(to_import, duplicate_flags)
+                ],
+                use_container_width=True, hide_index=True
             )
-            st.success("✨ Gasto salvo com sucesso!")
-            st.balloons()
+            if st.button(f"✅ Importar {len(to_import)} gastos", use_container_width=True, type="primary"):
+                started = time.perf_counter()
+                try:
+                    inserted = storage.bulk_add_expenses(to_import)
+                except MonthClosedError as e:
+                    st.error(f"🔒 Nada foi importado. {e}")
+                else:
+                    elapsed = time.perf_counter() - started
+                    st.success(
+                        f"✨ {inserted} gastos importados em {elapsed:.2f}s "
+                        f"({inserted / max(elapsed, 1e-6):,.0f} linhas/s)."
+                    )
 
 elif page == "Resumo do mês":
     st.header("📊 Resumo do Mês")
     month = st.selectbox("📅 Selecione o mês", last_n_months(12), index=0)
-    expenses = list_expenses_month(month)
 
-    summary = compute_month_summary(expenses, user_a, user_b)
-    
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("💰 Total", f"R$ {summary['total']:.2f}")
-    with col2:
-        st.metric(f"💳 {user_a['name']}", f"R$ {summary['paid_a']:.2f}")
-    with col3:
-        st.metric(f"💳 {user_b['name']}", f"R$ {summary['paid_b']:.2f}")
+    # Cursors of the pages visited so far; reset when the month or size changes.
+    page_size = st.session_state.get("expenses_page_size", EXPENSES_PAGE_SIZE)
+    if st.session_state.get("expenses_page_key") != (month, page_size):
+        st.session_state.expenses_page_key = (month, page_size)
+        st.session_state.expenses_cursors = [None]
+    cursors = st.session_state.expenses_cursors
+    page_no = len(cursors) - 1
+
+    # Balances, the expense page, categories and settlement in one concurrent round.
+    view = storage.load_month_view(month, page_size, cursors[-1])
+    totals = view["balances"]
+    pending = write_queue.landing(month) if write_queue is not None else []
+    summary = household_summary(merge_pending_balances(totals, pending), users)
+
+    st.metric("💰 Total", f"R$ {summary['total']:.2f}")
+    for col, u in columns_for(users):
+        col.metric(f"💳 {u['name']}", f"R$ {summary['paid'][u['id']]:.2f}")
 
     st.divider()
     
-    c1, c2 = st.columns(2)
-    with c1:
-        st.info(f"**{user_a['name']}**\n\nSaldo: R$ {summary['bal_a']:.2f}")
-    with c2:
-        st.info(f"**{user_b['name']}**\n\nSaldo: R$ {summary['bal_b']:.2f}")
+    for col, u in columns_for(users):
+        col.info(f"**{u['name']}**\n\nSaldo: R$ {summary['balance'][u['id']]:.2f}")
 
     st.success(f"💡 {summary['suggestion']}")
+    if view["settlements"]:
+        settled = sum(s["amount"] for s in view["settlements"])
+        st.caption(f"✅ Fechamento registrado: {len(view['settlements'])} Pix, R$ {settled:.2f}")
+    if view["closed_at"]:
+        st.info(f"🔒 Mês fechado em {view['closed_at'][:10]}: os gastos abaixo não mudam mais. "
+                "Correções entram como gasto de ajuste num mês em aberto.")
 
     st.subheader("📋 Detalhes dos Gastos")
-    if not expenses:
-        st.info("Nenhum gasto registrado.")
+    if pending:
+        st.caption(f"⏳ Aguardando gravação ({len(pending)}), já incluídos nos totais acima:")
+        for e in pending:
+            st.write(
+                f"⏳ **{e['spent_at'][5:]}** R${e['amount_cents'] / 100:.2f} `{e['category'][:10]}` "
+                f"{e['description'][:30]} · **{user_names.get(e['payer_user_id'], '?')}**"
+            )
+        st.divider()
+    if totals["expense_count"] == 0:
+        if not pending:
+            st.info("Nenhum gasto registrado.")
     else:
+        page_size_options = sorted({10, 20, 50, 100, EXPENSES_PAGE_SIZE})
+        st.selectbox(
+            "Itens por página", page_size_options,
+            index=page_size_options.index(EXPENSES_PAGE_SIZE), key="expenses_page_size"
+        )
+        expense_page = view["page"]
+        expenses = expense_page["rows"]
+
+        first = page_no * page_size + 1
+        st.caption(f"Mostrando {first}–{first + len(expenses) - 1} de {totals['expense_count']} gastos")
+        if any(exp["is_duplicate"] for exp in expenses):
+            st.warning("⚠️ Gastos marcados parecem duplicados (mesma data, valor, pagador e descrição).")
+
         for i, exp in enumerate(expenses):
-            # Split handling
-            try:
-                split = json.loads(exp["split_json"])
-                s_a = float(split.get(str(user_a["id"]), 0.5))
-                s_b = float(split.get(str(user_b["id"]), 0.5))
-            except:
-                s_a = s_b = 0.5
-            p_a = exp["amount"] * s_a
-            p_b = exp["amount"] * s_b
-            payer_full = user_a["name"] if exp["payer_user_id"] == user_a["id"] else user_b["name"]
+            # Split handling (already decoded by the database layer)
+            split = exp["split_bp"]
+            # Each person's part, by initial: "T:12.5 M:12.5"
+            parts = " ".join(
+                f"{u['name'][:1]}:{exp['amount'] * split[u['id']] / 10000:.1f}" for u in users if split.get(u["id"])
+            )
+            payer_full = user_names.get(exp["payer_user_id"], "?")
             date_short = exp['spent_at'][5:]
 
             # --- UNIFIED VIEW ---
@@ -173,23 +334,31 @@ elif page == "Resumo do mês":
             cols[0].write(f"**{date_short}**")
             cols[1].write(f"R${exp['amount']:.2f}")
             cols[2].write(f"`{exp['category'][:10]}`")
-            cols[3].write(f"{exp['description'][:30]}")
+            cols[3].write(f"{'⚠️ ' if exp['is_duplicate'] else ''}{exp['description'][:30]}")
             cols[4].write(f"**{payer_full}**")
-            cols[5].write(f"<small>T:{p_a:.1f} M:{p_b:.1f}</small>", unsafe_allow_html=True)
+            cols[5].write(f"<small>{parts}</small>", unsafe_allow_html=True)
             
             with cols[6]:
-                if st.button("📝", key=f"edit_{exp['id']}"):
+                if not view["closed_at"] and st.button("📝", key=f"edit_{exp['id']}"):
                     st.session_state.editing_id = exp["id"]
                     st.session_state.edit_amount = exp["amount"]
                     st.session_state.edit_date = date.fromisoformat(exp["spent_at"])
                     st.session_state.edit_category = exp["category"]
-                    st.session_state.edit_payer = payer_full
+                    st.session_state.edit_payer = exp["payer_user_id"]
                     st.session_state.edit_description = exp["description"]
                     st.session_state.edit_split = split
                     st.rerun()
             
             st.divider()
 
+        nav_prev, nav_next = st.columns(2)
+        if nav_prev.button("◀ Anterior", disabled=page_no == 0, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+        if nav_next.button("Próxima ▶", disabled=expense_page["next_cursor"] is None, use_container_width=True):
+            cursors.append(expense_page["next_cursor"])
+            st.rerun()
+
         # Modal-like section for editing
         if "editing_id" in st.session_state:
             st.divider()
@@ -197,10 +366,13 @@ elif page == "Resumo do mês":
             with st.form("edit_form"):
                 new_amount = st.number_input("Valor (R$)", value=float(st.session_state.edit_amount) if st.session_state.edit_amount else None, step=0.01)
                 new_date = st.date_input("Data", value=st.session_state.edit_date)
-                new_payer = st.selectbox("Quem pagou?", [u["name"] for u in users], 
-                                        index=0 if st.session_state.edit_payer == user_a["name"] else 1)
+                user_ids = [u["id"] for u in users]
+                payer_id = st.selectbox(
+                    "Quem pagou?", user_ids, format_func=user_names.get,
+                    index=user_ids.index(st.session_state.edit_payer) if st.session_state.edit_payer in user_ids else 0
+                )
                 
-                categorias = carregar_categorias()
+                categorias = view["categories"]
                 cat_index = categorias.index(st.session_state.edit_category) if st.session_state.edit_category in categorias else 0
                 new_category = st.selectbox("Categoria", categorias, index=cat_index, key="edit_category_select")
                 
@@ -213,67 +385,149 @@ elif page == "Resumo do mês":
 
                 new_description = st.text_input("Descrição", value=st.session_state.edit_description)
                 
-                # Split management in edit
-                current_split_a = int(st.session_state.edit_split.get(str(user_a["id"]), 0.5) * 100)
-                custom_split_edit = st.checkbox("Personalizar divisão (padrão 50/50)", value=(current_split_a != 50), key="custom_split_edit_check")
-                
-                if custom_split_edit:
-                    split_a_pct_edit = st.slider(f"{user_a['name']} (%)", 0, 100, current_split_a)
-                else:
-                    split_a_pct_edit = 50
+                # Split management in edit (keyed by expense so each one starts from its own split)
+                split_bp = split_editor(
+                    users, key=f"edit_split_{st.session_state.editing_id}", initial_bp=st.session_state.edit_split
+                )
 
                 col_save, col_del, col_cancel = st.columns([1.5, 1.5, 1])
                 if col_save.form_submit_button("Salvar Alterações", use_container_width=True):
-                    split_json = json.dumps({
-                        str(user_a["id"]): split_a_pct_edit / 100.0,
-                        str(user_b["id"]): (100 - split_a_pct_edit) / 100.0
-                    })
-                    payer_id = user_a["id"] if new_payer == user_a["name"] else user_b["name"]
-                    
                     # Add custom category if needed
                     if new_category == "Outro" and final_category != "Outro":
                         adicionar_categoria_personalizada(final_category)
 
-                    update_expense(
-                        st.session_state.editing_id,
-                        int(round(new_amount * 100)) if new_amount else 0,
-                        payer_id,
-                        final_category,
-                        new_description,
-                        str(new_date),
-                        split_json
-                    )
-                    del st.session_state.editing_id
-                    st.success("Atualizado!")
-                    st.rerun()
+                    try:
+                        storage.update_expense(
+                            st.session_state.editing_id,
+                            int(round(new_amount * 100)) if new_amount else 0,
+                            payer_id,
+                            final_category,
+                            new_description,
+                            str(new_date),
+                            split_bp
+                        )
+                    except MonthClosedError as e:
+                        st.error(f"🔒 {e}")
+                    else:
+                        del st.session_state.editing_id
+                        st.success("Atualizado!")
+                        st.rerun()
                 
                 if col_del.form_submit_button("🗑️ Excluir Gasto", use_container_width=True):
-                    from src.database import delete_expense
-                    delete_expense(st.session_state.editing_id)
-                    del st.session_state.editing_id
-                    st.rerun()
+                    try:
+                        storage.delete_expense(st.session_state.editing_id)
+                    except MonthClosedError as e:
+                        st.error(f"🔒 {e}")
+                    else:
+                        del st.session_state.editing_id
+                        st.rerun()
                 
                 if col_cancel.form_submit_button("Cancelar", use_container_width=True):
                     del st.session_state.editing_id
                     st.rerun()
 
+elif page == "Resumo do ano":
+    st.header("📈 Resumo do Ano")
+    current_year = date.today().year
+    year = st.selectbox("📅 Selecione o ano", list(range(current_year, current_year - 6, -1)), index=0)
+    report = storage.get_range_report(f"{year}-01", f"{year}-12")
+    if write_queue is not None:
+        report = merge_pending_report(report, write_queue.landing())
+    months_report = report["months"]
+
+    year_total = sum(m["total_cents"] for m in months_report) / 100.0
+    st.metric("💰 Total do ano", f"R$ {year_total:.2f}")
+    for col, u in columns_for(users):
+        year_paid = sum(m["paid_cents"].get(u["id"], 0) for m in months_report) / 100.0
+        col.metric(f"💳 {u['name']}", f"R$ {year_paid:.2f}")
+
+    if year_total == 0:
+        st.info("Nenhum gasto registrado neste ano.")
+    else:
+        carry = months_report[-1]["carry_cents"]
+        st.info(
+            "Saldo acumulado no ano (após fechamentos): "
+            + " · ".join(f"**{u['name']}** R$ {carry.get(u['id'], 0) / 100.0:.2f}" for u in users)
+        )
+
+        labels = [m["month"] for m in months_report]
+        st.subheader("📊 Gastos por mês")
+        st.bar_chart({"Mês": labels, "Total (R$)": [m["total_cents"] / 100.0 for m in months_report]}, x="Mês")
+
+        st.subheader("📁 Tendência por categoria")
+        top_categories = sorted(report["category_totals"], key=report["category_totals"].get, reverse=True)
+        chosen = st.multiselect("Categorias", top_categories, default=top_categories[:5])
+        if chosen:
+            trend = {"Mês": labels}
+            for cat in chosen:
+                by_month = report["category_by_month"][cat]
+                trend[cat] = [by_month.get(m, 0) / 100.0 for m in labels]
+            st.line_chart(trend, x="Mês", y=chosen)
+
+        st.subheader("📋 Mês a mês")
+        st.dataframe(
+            [
+                {
+                    "Mês": m["month"],
+                    "Gastos": m["expense_count"],
+                    "Total (R$)": m["total_cents"] / 100.0,
+                    **{f"Saldo {u['name']} (R$)": m["balance_cents"].get(u["id"], 0) / 100.0 for u in users},
+                    **{f"Acumulado {u['name']} (R$)": m["carry_cents"].get(u["id"], 0) / 100.0 for u in users},
+                }
+                for m in months_report
+            ],
+            use_container_width=True, hide_index=True
+        )
+
 elif page == "Fechamento":
     st.header("🔐 Fechamento")
     month = st.selectbox("📅 Selecione o mês", last_n_months(12), index=0)
-    summary = compute_month_summary(list_expenses_month(month), user_a, user_b)
+    # A closed month reads its frozen balances; otherwise let the database do the sum.
+    snapshot = storage.get_month_snapshot(month)
+    totals = snapshot["balances"] if snapshot is not None else storage.get_month_balances(month)
+    if write_queue is not None:
+        totals = merge_pending_balances(totals, write_queue.landing(month))
+    summary = household_summary(totals, users)
     
     st.write(f"### Situação de {month}")
     st.markdown(f"> {summary['suggestion']}")
 
-    existing = get_settlement(month)
-    if existing and existing["paid_at"]:
-        st.success(f"✅ Fechado em {existing['paid_at']}")
+    # Every month at once, read from the ledger (no rescan of the history).
+    open_balances = storage.get_balances()
+    if write_queue is not None:
+        open_balances = merge_pending_ledger(open_balances, write_queue.landing())
+    st.write("### 📒 Saldo em aberto (todos os meses)")
+    for col, u in columns_for(users):
+        col.metric(f"{u['name']}", f"R$ {open_balances.get(u['id'], 0) / 100:.2f}")
+    st.caption("Positivo: a casa deve à pessoa. Negativo: a pessoa deve à casa.")
+
+    existing = storage.get_settlements(month)
+    if snapshot is not None:
+        st.success(f"✅ Fechado em {snapshot['closed_at'][:16]}. Os gastos do mês ficam congelados.")
+        for s in existing:
+            st.write(
+                f"💸 R$ {s['amount']:.2f} de **{user_names.get(s['from_user_id'], '?')}** "
+                f"para **{user_names.get(s['to_user_id'], '?')}**"
+            )
     else:
+        transfers = summary["transfers"]
+        open_cents = {u["id"]: open_balances.get(u["id"], 0) for u in users}
+        if open_cents != summary["balance_cents"]:
+            # Older months left open: optionally settle everything in one go.
+            scope = st.radio("O que acertar", ["Só este mês", "Todo o saldo em aberto"], horizontal=True)
+            if scope == "Todo o saldo em aberto":
+                transfers = minimum_transfers(open_cents)
+                for src_id, dst_id, cents in transfers:
+                    st.write(
+                        f"💸 R$ {cents / 100:.2f} de **{user_names.get(src_id, '?')}** "
+                        f"para **{user_names.get(dst_id, '?')}**"
+                    )
         if st.button("✔️ Confirmar Fechamento", use_container_width=True, type="primary"):
-            from_id, to_id, amount = summary["settle_from_to_amount"]
-            if amount > 0:
-                add_settlement(month, from_id, to_id, int(round(amount * 100)))
-                st.success("✨ Fechamento registrado!")
+            # The fewest Pix that settle everyone (see logic.minimum_transfers).
+            # Recorded even with no transfers: confirming is what closes the month.
+            storage.record_settlements(month, transfers)
+            if transfers:
+                st.success(f"✨ Fechamento registrado: {len(transfers)} Pix.")
             else:
                 st.success("✅ Tudo limpo!")
 
@@ -308,7 +562,7 @@ else: # Configurações
             
             # Delete Category (protected - defaults shouldn't be deleted easily, but we'll allow it if user wants)
             if col3.button("🗑️", key=f"del_cat_{cat}"):
-                delete_category(cat)
+                storage.delete_category(cat)
                 st.success(f"Categoria {cat} removida!")
                 st.rerun()
                 
@@ -321,7 +575,7 @@ else: # Configurações
             c_save, c_cancel = st.columns(2)
             if c_save.form_submit_button("Salvar"):
                 if updated_name.strip() and updated_name != st.session_state.editing_cat:
-                    update_category(st.session_state.editing_cat, updated_name.strip())
+                    storage.update_category(st.session_state.editing_cat, updated_name.strip())
                     del st.session_state.editing_cat
                     st.success("Categoria atualizada!")
                     st.rerun()
@@ -335,4 +589,108 @@ else: # Configurações
         st.rerun()
 
     st.divider()
-    st.caption(f"Casa Split v2.0 | Usuários: {user_a['name']} & {user_b['name']}")
+    st.subheader("👥 Pessoas da casa")
+    st.write(" · ".join(f"**{u['name']}**" for u in users))
+    with st.expander("➕ Adicionar pessoa"):
+        new_user_name = st.text_input("Nome", key="new_user_name")
+        if st.button("Adicionar pessoa"):
+            if not new_user_name.strip():
+                st.warning("Informe um nome.")
+            elif new_user_name.strip() in user_names.values():
+                st.warning("Já existe alguém com esse nome.")
+            else:
+                storage.add_user(new_user_name.strip())
+                st.success(f"{new_user_name.strip()} agora divide as contas da casa!")
+                st.rerun()
+
+    if storage.multi_household and ADMIN_TOKEN:
+        st.divider()
+        st.subheader("🏘️ Nova casa")
+        st.caption("Cada casa tem suas próprias pessoas, categorias e gastos, e abre pelo próprio link.")
+        with st.form("new_household_form"):
+            new_household_name = st.text_input("Nome da casa")
+            new_household_members = st.text_input("Pessoas (separadas por vírgula)")
+            admin_token = st.text_input("Token de administração", type="password")
+            if st.form_submit_button("Criar casa"):
+                members = [m.strip() for m in new_household_members.split(",") if m.strip()]
+                if not secrets.compare_digest(admin_token.encode(), ADMIN_TOKEN.encode()):
+                    st.error("Token de administração inválido.")
+                elif not new_household_name.strip() or not members:
+                    st.warning("Informe o nome da casa e pelo menos uma pessoa.")
+                else:
+                    created = storage.add_household(new_household_name.strip(), members)
+                    st.success(f"Casa **{created['name']}** criada! Abra pelo link: `?casa={created['slug']}`")
+
+    st.divider()
+    st.subheader("📤 Exportar gastos")
+    export_file = None
+    with st.form("export_form"):
+        c_from, c_to = st.columns(2)
+        export_from = c_from.date_input("De", value=None, format="DD/MM/YYYY")
+        export_to = c_to.date_input("Até", value=None, format="DD/MM/YYYY")
+        export_categories = st.multiselect("Categorias (vazio = todas)", categorias)
+        export_format = st.radio("Formato", ["CSV", "Parquet"], horizontal=True)
+        if st.form_submit_button("Gerar arquivo"):
+            # Streamed to a temporary file batch by batch, read back once for the
+            # download and removed right away: nothing stays on disk or in the session.
+            suffix = ".parquet" if export_format == "Parquet" else ".csv"
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                export_path = tmp.name
+            try:
+                exported = export_expenses(
+                    storage, export_path, export_format.lower(),
+                    str(export_from) if export_from else None,
+                    str(export_to) if export_to else None,
+                    export_categories or None
+                )
+                with open(export_path, "rb") as f:
+                    export_file = {
+                        "data": f.read(), "rows": exported, "name": f"casa_split_gastos{suffix}",
+                        "mime": "application/octet-stream" if suffix == ".parquet" else "text/csv",
+                    }
+            except RuntimeError as e:
+                st.error(str(e))
+            finally:
+                os.remove(export_path)
+    if export_file is not None:
+        # Only on the run that generated it; generate again to download another copy.
+        st.download_button(
+            f"⬇️ Baixar {export_file['rows']} gastos", export_file["data"], file_name=export_file["name"],
+            mime=export_file["mime"], use_container_width=True
+        )
+
+    st.divider()
+    st.subheader("🩺 Diagnóstico")
+    if not diagnostics.DIAGNOSTICS_ENABLED:
+        st.info("Medição de consultas desligada (DIAGNOSTICS_ENABLED=0).")
+    elif not diagnostics.queries():
+        st.info("Nenhuma consulta medida ainda. Navegue pelas páginas e volte aqui.")
+    else:
+        st.caption(f"Últimas {len(diagnostics.queries())} consultas deste processo (máx. {diagnostics.DIAGNOSTICS_MAX_QUERIES}).")
+        st.markdown("**Consultas mais lentas**")
+        st.dataframe(
+            [
+                {"ms": round(q["duration_ms"], 2), "função": q["function"], "página": q["page"],
+                 "linhas": q["rows"], "conexão (ms)": round(q["acquire_ms"], 2), "sql": q["sql"]}
+                for q in diagnostics.slowest_queries(10)
+            ],
+            use_container_width=True, hide_index=True
+        )
+        st.markdown("**Consultas por página (por execução)**")
+        st.dataframe(diagnostics.queries_by_page(), use_container_width=True, hide_index=True)
+        st.markdown("**Latência por função (ms)**")
+        st.dataframe(diagnostics.latency_by_function(), use_container_width=True, hide_index=True)
+
+        c_clear, c_export = st.columns(2)
+        if c_clear.button("🧹 Limpar medições"):
+            diagnostics.clear()
+            st.rerun()
+        c_export.download_button(
+            "💾 Exportar JSONL", diagnostics.to_jsonl(),
+            file_name="casa_split_diagnostics.jsonl", mime="application/x-ndjson"
+        )
+        if diagnostics.DIAGNOSTICS_LOG:
+            st.caption(f"Registro contínuo em {diagnostics.DIAGNOSTICS_LOG}")
+
+    st.divider()
+    st.caption(f"Casa Split v2.0 | Usuários: {', '.join(u['name'] for u in users)}")
@@ -0,0 +1,78 @@
+"""
+Synthetic household history for benchmarks.
+
+Expenses are spread evenly over the requested years, with category-dependent
+amounts and descriptions, both payers (one pays a bit more often) and a mix
+of splits: mostly 50/50, some 60/40 either way, a few paid for one person
+only. The output is deterministic for a given seed.
+"""
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List
+
+START_DATE = date(2020, 1, 1)
+
+# category -> (typical amount in cents, descriptions). Unknown categories
+# (custom ones) fall back to "Outro".
+_PROFILES: Dict[str, Any] = {
+    "Mercado": (18_000, ["Angeloni", "Feira", "Padaria", "Hortifruti", "Atacadão"]),
+    "Contas": (25_000, ["Luz", "Água", "Internet", "Gás", "Condomínio"]),
+    "Transporte": (6_000, ["Uber", "Gasolina", "Estacionamento", "Ônibus"]),
+    "Casa": (12_000, ["Limpeza", "Conserto", "Utensílios", "Decoração"]),
+    "Pets": (9_000, ["Ração", "Veterinário", "Petshop"]),
+    "Outro": (7_000, ["Ifood", "Farmácia", "Presente", "Cinema"]),
+}
+
+# (weight, share of the first user in basis points)
+_SPLITS = [(70, 5000), (10, 6000), (10, 4000), (5, 10000), (5, 0)]
+
+def generate_expenses(
+    rows: int,
+    years: int,
+    user_ids: List[int],
+    categories: List[str],
+    seed: int = 42,
+    offset: int = 0
+) -> Iterator[Dict[str, Any]]:
+    """Yields `rows` expenses shaped for Storage.bulk_add_expenses.
+
+    `offset` continues a previous call's sequence, so growing a dataset from
+    1k to 100k rows keeps the first 1k identical.
+    """
+    rng = random.Random(f"{seed}:{offset}")
+    days = (date(START_DATE.year + years, 1, 1) - START_DATE).days
+    a_id, b_id = user_ids[0], user_ids[1]
+    split_weights = [w for w, _ in _SPLITS]
+    for i in range(offset, offset + rows):
+        category = categories[i % len(categories)]
+        typical, descriptions = _PROFILES.get(category, _PROFILES["Outro"])
+        # Even spread over the period, jittered within the day range.
+        spent_at = START_DATE + timedelta(days=(i * 7919 + rng.randrange(7)) % days)
+        amount = max(100, int(rng.lognormvariate(0, 0.6) * typical))
+        a_bp = rng.choices(_SPLITS, split_weights)[0][1]
+        yield {
+            "spent_at": spent_at.isoformat(),
+            "amount_cents": amount,
+            "payer_user_id": a_id if rng.random() < 0.55 else b_id,
+            "category": category,
+            "description": f"{rng.choice(descriptions)} {i}",
+            "split_bp": {a_id: a_bp, b_id: 10000 - a_bp},
+        }
+
+def seed_household(storage, rows: int, years: int, seed: int = 42, offset: int = 0, batch_size: int = 50_000) -> int:
+    """Inserts generated expenses into a bootstrapped storage, in batches.
+
+    Categories are the ones upsert_default_categories seeds.
+    """
+    user_ids = [u["id"] for u in storage.get_users()]
+    categories = storage.get_categories()
+    inserted = 0
+    batch: List[Dict[str, Any]] = []
+    for expense in generate_expenses(rows, years, user_ids, categories, seed, offset):
+        batch.append(expense)
+        if len(batch) == batch_size:
+            inserted += storage.bulk_add_expenses(batch)
+            batch = []
+    if batch:
+        inserted += storage.bulk_add_expenses(batch)
+    return inserted
@@ -0,0 +1,164 @@
+"""
+Times the app's data access as history grows.
+
+Seeds a scratch storage with synthetic expenses (bench.generator) in steps
+(1k, 100k, 1M rows by default) and, at each size, times:
+
+- list_expenses_month for one month
+- compute_month_summary over that month's rows
+- update_category (a rename and its rollback)
+- get_settlements
+- load_month_view, i.e. everything a "Resumo do mês" render reads
+- load_expense_columns + group_totals for the month's year, by month and
+  category (the columnar path of src.columnar)
+
+The in-process cache is cleared before every timed call so the numbers are
+the storage's, not the cache's. Results go to a JSON file; pass a previous
+one with --compare to flag regressions.
+
+    python -m bench.run --backend sqlite
+    BENCH_DATABASE_URL=postgresql://.../casa_split_bench python -m bench.run --backend postgres
+    python -m bench.run --backend sqlite --sizes 1000 100000 --compare bench_sqlite.json
+
+The Postgres run truncates BENCH_DATABASE_URL first: never point it at real data.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+from bench.generator import START_DATE, seed_household
+from src.cache import cache
+from src.columnar import group_totals
+from src.logic import compute_month_summary
+from src.storage_conformance import scratch_storage
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples: List[float] = []
+    for _ in range(repeat):
+        cache.clear()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))], 3),
+        "min_ms": round(samples[0], 3),
+    }
+
+def measure(storage, month: str, repeat: int) -> Dict[str, Any]:
+    """Times each operation once the data is in place."""
+    a, b = storage.get_users()[:2]
+    expenses = storage.list_expenses_month(month)
+    if not storage.get_settlements(month):
+        storage.record_settlements(month, [(a["id"], b["id"], 100)])
+
+    def rename_roundtrip() -> None:
+        storage.update_category("Mercado", "Mercado (bench)")
+        storage.update_category("Mercado (bench)", "Mercado")
+
+    def year_columnar() -> None:
+        year = month[:4]
+        cols = storage.load_expense_columns(f"{year}-01", f"{year}-12", [a["id"], b["id"]])
+        group_totals(cols, ("month", "category"))
+
+    return {
+        "month_rows": len(expenses),
+        "list_expenses_month": _timed(lambda: storage.list_expenses_month(month), repeat),
+        "compute_month_summary": _timed(lambda: compute_month_summary(expenses, a, b), repeat),
+        "update_category": _timed(rename_roundtrip, repeat),
+        "get_settlements": _timed(lambda: storage.get_settlements(month), repeat),
+        "load_month_view": _timed(lambda: storage.load_month_view(month), repeat),
+        "year_columnar": _timed(year_columnar, repeat),
+    }
+
+def run(backend: str, sizes: List[int], years: int, repeat: int, seed: int) -> Dict[str, Any]:
+    storage = scratch_storage(backend, "BENCH_DATABASE_URL")
+    storage.bootstrap()
+    # A month in the middle of the last year: as full as any other.
+    month = f"{START_DATE.year + years - 1}-06"
+    results: Dict[str, Any] = {}
+    rows = 0
+    for size in sorted(sizes):
+        start = time.perf_counter()
+        rows += seed_household(storage, size - rows, years, seed=seed, offset=rows)
+        seeded_s = time.perf_counter() - start
+        print(f"[{backend}] {rows} gastos (+{seeded_s:.1f}s para semear), medindo...", flush=True)
+        results[str(size)] = {"seed_s": round(seeded_s, 2), **measure(storage, month, repeat)}
+    return {
+        "backend": backend,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "years": years,
+        "repeat": repeat,
+        "seed": seed,
+        "month": month,
+        "sizes": results,
+    }
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    min_delta_ms: float = 1.0
+) -> List[str]:
+    """Returns one line per operation whose median got slower than
+    `tolerance` times the baseline (and by at least `min_delta_ms`, so
+    sub-millisecond jitter is ignored), for the sizes both runs measured."""
+    regressions: List[str] = []
+    for size, ops in current["sizes"].items():
+        base_ops = baseline.get("sizes", {}).get(size)
+        if not base_ops:
+            continue
+        for op, timing in ops.items():
+            if not isinstance(timing, dict) or op not in base_ops:
+                continue
+            before, now = base_ops[op]["median_ms"], timing["median_ms"]
+            ratio = now / before if before else 1.0
+            print(f"{size:>9} {op:<24} {before:>10.2f} ms -> {now:>10.2f} ms  ({ratio:.2f}x)")
+            if ratio > tolerance and now - before >= min_delta_ms:
+                regressions.append(f"{size} {op}: {before:.2f} ms -> {now:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do acesso a dados com histórico sintético.")
+    parser.add_argument("--backend", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Totais de gastos a medir")
+    parser.add_argument("--years", type=int, default=5, help="Anos de histórico (padrão 5)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetições por operação (padrão 5)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo JSON de resultados (padrão bench_<backend>.json)")
+    parser.add_argument("--compare", help="Resultado anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Falha se a mediana passar deste múltiplo da anterior (padrão 1.5)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Ignora pioras menores que isto em ms (padrão 1)")
+    args = parser.parse_args()
+
+    # Read the baseline first: --output may overwrite the same file.
+    baseline = None
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif args.compare:
+        print(f"Sem resultado anterior em {args.compare}: nada a comparar desta vez.")
+
+    result = run(args.backend, args.sizes, args.years, args.repeat, args.seed)
+    output = args.output or f"bench_{args.backend}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Resultados em {output}")
+
+    if baseline is not None:
+        found = compare(result, baseline, args.tolerance, args.min_delta_ms)
+        for line in found:
+            print(f"REGRESSÃO {line}")
+        sys.exit(1 if found else 0)
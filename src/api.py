@@ -0,0 +1,362 @@
+"""
+HTTP JSON API for automations (n8n, bank-notification webhooks).
+
+A separate process from the Streamlit app, on the same storage: expenses
+posted here go through Storage.bulk_add_expenses (one transaction, COPY on
+Postgres) and show up in the app like any other.
+
+    python -m src.api                      # http://127.0.0.1:8600
+    API_TOKEN=segredo python -m src.api --address 0.0.0.0
+
+    GET  /health
+    GET  /expenses?month=2024-05[&limit=50][&after=2024-05-10,123]
+    GET  /summary?month=2024-05
+    POST /expenses                         # one expense or a list of them
+
+Requests pick their household like the app's link does (`X-Casa: <slug>`
+header or `?casa=<slug>`), HOUSEHOLD_ID's otherwise. With API_TOKEN set,
+every request needs `Authorization: Bearer <API_TOKEN>`; without it the API
+only listens on a loopback address, so nobody else on the network can post.
+
+A posted expense takes amount (R$, number or "12,30") or amount_cents,
+payer (a name) or payer_user_id, and optionally spent_at (default today),
+category (default: guessed from the description), description, split
+({name: weight}, default equal parts) and idempotency_key. An expense whose
+key is already stored is skipped, so a webhook can resend a batch safely;
+an `Idempotency-Key` header keys every item of the body that has none
+("<key>:<index>" in a list). A batch is validated as a whole: one bad item
+rejects it with the errors of every item.
+
+Tornado (already installed with Streamlit) handles requests on one event
+loop; the storage calls run on a thread pool sized to the connection pool,
+so concurrent webhooks overlap their round trips.
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+import tornado.ioloop
+import tornado.web
+from src.database import EXPENSES_PAGE_SIZE, MonthClosedError, User
+from src.importers import guess_category, parse_amount_cents, parse_date
+from src.logic import equal_split, household_summary, split_from_weights
+from src.pool import POOL_MAX_SIZE
+from src.tenancy import DEFAULT_HOUSEHOLD_ID, use_household
+
+API_PORT = int(os.getenv("API_PORT", "8600"))
+API_ADDRESS = os.getenv("API_ADDRESS", "127.0.0.1")
+API_TOKEN = os.getenv("API_TOKEN", "")
+# Most expenses one POST may carry.
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", "1000"))
+# Threads running storage calls; more than the pool would only queue for a connection.
+API_WORKERS = int(os.getenv("API_WORKERS", str(POOL_MAX_SIZE)))
+MAX_BODY_BYTES = 4 * 1024 * 1024
+MAX_PAGE_SIZE = 500
+MAX_KEY_LENGTH = 200
+# R$ 100 milhões: far above any household expense, far below int64 overflow in the quota sums.
+MAX_AMOUNT_CENTS = 10_000_000_000
+DEFAULT_CATEGORY = "Outro"
+
+T = TypeVar("T")
+
+class ApiError(Exception):
+    """Ends the request with `status` and a JSON body {"error": message, **extra}."""
+
+    def __init__(self, status: int, message: str, **extra: Any):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+def _month_param(value: Optional[str]) -> str:
+    month = value or date.today().strftime("%Y-%m")
+    try:
+        date.fromisoformat(f"{month}-01")
+    except ValueError:
+        raise ApiError(400, f"Mês inválido: {month!r} (use YYYY-MM).")
+    return month
+
+def _user_id(value: Any, by_name: Dict[str, int], ids: set, field: str) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        if value not in ids:
+            raise ValueError(f"{field}: pessoa {value} não é da casa.")
+        return value
+    if isinstance(value, str) and value.strip().lower() in by_name:
+        return by_name[value.strip().lower()]
+    raise ValueError(f"{field}: pessoa desconhecida {value!r}.")
+
+def _amount_cents(item: Dict[str, Any]) -> int:
+    if "amount_cents" in item:
+        cents = item["amount_cents"]
+        if not isinstance(cents, int) or isinstance(cents, bool):
+            raise ValueError("amount_cents deve ser um número inteiro.")
+    elif isinstance(item.get("amount"), (int, float)) and not isinstance(item["amount"], bool):
+        try:
+            cents = int(round(item["amount"] * 100))
+        except (OverflowError, ValueError):
+            # json.loads reads 1e400 as inf and NaN as nan.
+            raise ValueError(f"amount inválido: {item['amount']!r}.")
+    elif isinstance(item.get("amount"), str):
+        try:
+            cents = parse_amount_cents(item["amount"])
+        except (ValueError, OverflowError):
+            raise ValueError(f"amount inválido: {item['amount']!r}.")
+    else:
+        raise ValueError("Informe amount (R$) ou amount_cents.")
+    if cents <= 0:
+        raise ValueError("O valor deve ser maior que zero.")
+    if cents > MAX_AMOUNT_CENTS:
+        raise ValueError(f"O valor passa do limite (até {MAX_AMOUNT_CENTS} centavos).")
+    return cents
+
+def parse_expense(
+    item: Any,
+    users: List[User],
+    categories: List[str],
+    default_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """Turns one posted JSON object into a bulk_add_expenses item; ValueError if invalid."""
+    if not isinstance(item, dict):
+        raise ValueError("Cada gasto deve ser um objeto JSON.")
+    by_name = {u["name"].lower(): u["id"] for u in users}
+    ids = {u["id"] for u in users}
+    payer = item.get("payer_user_id", item.get("payer"))
+    if payer is None:
+        raise ValueError("Informe payer (nome) ou payer_user_id.")
+    payer_user_id = _user_id(payer, by_name, ids, "payer")
+
+    spent_at = item.get("spent_at")
+    if spent_at is None:
+        spent_at = date.today().isoformat()
+    else:
+        try:
+            spent_at = parse_date(str(spent_at))
+        except ValueError:
+            raise ValueError(f"spent_at inválido: {spent_at!r}.")
+
+    description = str(item.get("description") or "").strip()
+    known = {c.lower(): c for c in categories}
+    default = DEFAULT_CATEGORY if DEFAULT_CATEGORY in categories or not categories else categories[0]
+    if item.get("category"):
+        category = known.get(str(item["category"]).strip().lower())
+        if category is None:
+            raise ValueError(f"Categoria desconhecida: {item['category']!r} (crie em Configurações).")
+    else:
+        category = guess_category(description, categories, default)
+
+    split = item.get("split")
+    if split is None:
+        split_bp = equal_split([u["id"] for u in users])
+    elif isinstance(split, dict) and split:
+        weights: Dict[int, float] = {}
+        for who, weight in split.items():
+            if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+                raise ValueError(f"split: peso inválido para {who!r}.")
+            weights[_user_id(int(who) if who.isdigit() else who, by_name, ids, "split")] = weight
+        split_bp = split_from_weights(weights)
+    else:
+        raise ValueError("split deve ser um objeto {pessoa: peso}.")
+
+    key = item.get("idempotency_key", default_key)
+    if key is not None and (not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH):
+        raise ValueError(f"idempotency_key deve ser um texto de 1 a {MAX_KEY_LENGTH} caracteres.")
+    return {
+        "spent_at": spent_at,
+        "amount_cents": _amount_cents(item),
+        "payer_user_id": payer_user_id,
+        "category": category,
+        "description": description or category,
+        "split_bp": split_bp,
+        "idempotency_key": key,
+    }
+
+def _is_loopback(address: str) -> bool:
+    if address == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} não é serializável")
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, storage, executor: ThreadPoolExecutor) -> None:
+        self.storage = storage
+        self.executor = executor
+        self.household_id = DEFAULT_HOUSEHOLD_ID
+
+    async def prepare(self) -> None:
+        if API_TOKEN and not hmac.compare_digest(
+            self.request.headers.get("Authorization", ""), f"Bearer {API_TOKEN}"
+        ):
+            raise ApiError(401, "Token inválido ou ausente.")
+        slug = self.request.headers.get("X-Casa") or self.get_query_argument("casa", None)
+        if slug:
+            household = await self.call(self.storage.get_household, slug)
+            if household is None:
+                raise ApiError(404, "Casa não encontrada.")
+            self.household_id = household["id"]
+
+    async def call(self, fn: Callable[..., T], *args: Any) -> T:
+        """Runs a blocking storage call on the thread pool, scoped to this request's household."""
+        def scoped() -> T:
+            with use_household(self.household_id):
+                return fn(*args)
+        return await tornado.ioloop.IOLoop.current().run_in_executor(self.executor, scoped)
+
+    def reply(self, status: int, body: Any) -> None:
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(body, ensure_ascii=False, default=_json_default))
+
+    def write_error(self, status_code: int, **kwargs: Any) -> None:
+        error = kwargs.get("exc_info", (None, None, None))[1]
+        if isinstance(error, ApiError):
+            self.reply(error.status, {"error": str(error), **error.extra})
+        elif isinstance(error, MonthClosedError):
+            self.reply(409, {"error": str(error), "months": error.months})
+        else:
+            self.reply(status_code, {"error": self._reason})
+
+    def log_exception(self, typ, value, tb) -> None:
+        # Client errors are answers, not failures worth a traceback.
+        if not isinstance(value, (ApiError, MonthClosedError)):
+            super().log_exception(typ, value, tb)
+
+class HealthHandler(BaseHandler):
+    async def get(self) -> None:
+        self.reply(200, {"status": "ok", "backend": self.storage.name})
+
+class ExpensesHandler(BaseHandler):
+    async def get(self) -> None:
+        month = _month_param(self.get_query_argument("month", None))
+        try:
+            limit = int(self.get_query_argument("limit", str(EXPENSES_PAGE_SIZE)))
+        except ValueError:
+            raise ApiError(400, "limit deve ser um número inteiro.")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ApiError(400, f"limit deve ficar entre 1 e {MAX_PAGE_SIZE}.")
+        after: Optional[Tuple[str, int]] = None
+        cursor = self.get_query_argument("after", None)
+        if cursor:
+            try:
+                after_date, after_id = cursor.split(",")
+                after = (date.fromisoformat(after_date).isoformat(), int(after_id))
+            except ValueError:
+                raise ApiError(400, "after deve ser o next_cursor de uma página anterior (YYYY-MM-DD,id).")
+        page = await self.call(self.storage.list_expenses_page, month, limit, after)
+        next_cursor = page["next_cursor"]
+        self.reply(200, {
+            "month": month,
+            "expenses": page["rows"],
+            "next_cursor": f"{next_cursor[0]},{next_cursor[1]}" if next_cursor else None,
+        })
+
+    async def post(self) -> None:
+        try:
+            body = json.loads(self.request.body or b"null")
+        except ValueError:
+            raise ApiError(400, "O corpo deve ser JSON.")
+        items = body if isinstance(body, list) else [body]
+        if not items:
+            raise ApiError(400, "Nenhum gasto enviado.")
+        if len(items) > API_MAX_BATCH:
+            raise ApiError(413, f"No máximo {API_MAX_BATCH} gastos por requisição.")
+        header_key = self.request.headers.get("Idempotency-Key")
+        users = await self.call(self.storage.get_users)
+        categories = await self.call(self.storage.get_categories)
+
+        expenses: List[Dict[str, Any]] = []
+        errors: List[Dict[str, Any]] = []
+        for i, item in enumerate(items):
+            default_key = None
+            if header_key:
+                default_key = f"{header_key}:{i}" if isinstance(body, list) else header_key
+            try:
+                expenses.append(parse_expense(item, users, categories, default_key))
+            except ValueError as e:
+                errors.append({"index": i, "error": str(e)})
+        if errors:
+            raise ApiError(400, "Gastos inválidos; nada foi gravado.", errors=errors)
+
+        # A key repeated inside the body is one expense, like a resent one.
+        seen: set = set()
+        unique = []
+        for e in expenses:
+            if e["idempotency_key"] is None or e["idempotency_key"] not in seen:
+                seen.add(e["idempotency_key"])
+                unique.append(e)
+        created = await self.call(self.storage.bulk_add_expenses, unique)
+        self.reply(201 if created else 200, {
+            "received": len(items),
+            "created": created,
+            "duplicates": len(items) - created,
+        })
+
+class SummaryHandler(BaseHandler):
+    async def get(self) -> None:
+        month = _month_param(self.get_query_argument("month", None))
+        users = await self.call(self.storage.get_users)
+        balances = await self.call(self.storage.get_month_balances, month)
+        snapshot = await self.call(self.storage.get_month_snapshot, month)
+        names = {u["id"]: u["name"] for u in users}
+        summary = household_summary(balances, users)
+        self.reply(200, {
+            "month": month,
+            "closed_at": snapshot["closed_at"] if snapshot else None,
+            "expense_count": balances["expense_count"],
+            "total_cents": balances["total_cents"],
+            "people": [
+                {
+                    "id": u["id"],
+                    "name": u["name"],
+                    "paid_cents": balances["paid_cents"].get(u["id"], 0),
+                    "quota_cents": balances["quota_cents"].get(u["id"], 0),
+                    "balance_cents": summary["balance_cents"][u["id"]],
+                }
+                for u in users
+            ],
+            "transfers": [
+                {"from": names.get(src, src), "to": names.get(dst, dst), "amount_cents": cents}
+                for src, dst, cents in summary["transfers"]
+            ],
+            "suggestion": summary["suggestion"],
+        })
+
+class NotFoundHandler(BaseHandler):
+    async def prepare(self) -> None:
+        raise ApiError(404, "Rota desconhecida.")
+
+def make_app(storage=None, workers: int = API_WORKERS) -> tornado.web.Application:
+    """The API on `storage` (default: get_storage()), with its thread pool."""
+    if storage is None:
+        from src.storage import get_storage
+        storage = get_storage()
+    context = {"storage": storage, "executor": ThreadPoolExecutor(workers, thread_name_prefix="casa-split-api")}
+    return tornado.web.Application([
+        (r"/health", HealthHandler, context),
+        (r"/expenses", ExpensesHandler, context),
+        (r"/summary", SummaryHandler, context),
+    ], default_handler_class=NotFoundHandler, default_handler_args=context)
+
+if __name__ == "__main__":
+    from src.storage import get_storage
+    parser = argparse.ArgumentParser(description="API HTTP (JSON) para automações lançarem e consultarem gastos.")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--address", default=API_ADDRESS)
+    args = parser.parse_args()
+    if not API_TOKEN and not _is_loopback(args.address):
+        raise SystemExit(f"Defina API_TOKEN para ouvir em {args.address}; sem token a API só aceita 127.0.0.1.")
+    storage = get_storage()
+    # Same start as the app: schema, and the two default people on a new database.
+    storage.bootstrap()
+    make_app(storage).listen(args.port, args.address, max_body_size=MAX_BODY_BYTES)
+    print(f"[{storage.name}] API ouvindo em http://{args.address}:{args.port}")
+    tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Keys are tuples so related entries can be dropped together with
+    `invalidate_prefix`; src.database starts them with the household id, so
+    (1, "month", "2024-05") clears every cached read of that household's
+    month. Cached values are shared between sessions: treat them as
+    read-only.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with a write
+        # doesn't store a result read before the write committed.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Tuple, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key: Tuple, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def get_or_load(self, key: Tuple, loader: Callable[[], Any]) -> Any:
+        """Returns the cached value for `key`, calling `loader` on a miss."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    async def get_or_load_async(self, key: Tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Like get_or_load, for a coroutine loader (see src.database_async)."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = await loader()
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def invalidate(self, *keys: Tuple) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def invalidate_prefix(self, prefix: Tuple) -> None:
+        """Drops every key that starts with `prefix`."""
+        n = len(prefix)
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._data if k[:n] == prefix]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+# Process-wide cache in front of the read functions of src.database.
+cache = TTLCache()
@@ -0,0 +1,209 @@
+"""
+Column-oriented expense batches and vectorized aggregation.
+
+The list-of-dicts path (list_expenses_month + logic.compute_month_summary)
+is fine for one month; multi-year analytics and large imports use
+ExpenseColumns instead: one int64 array per field plus an (expenses x users)
+matrix of split basis points, aggregated with NumPy in a single pass.
+"""
+from typing import Any, Dict, List, Sequence, Tuple, TypedDict
+import numpy as np
+from src.logic import equal_split
+
+# Share of a user missing from an expense's split: they owe nothing of it,
+# as in logic.compute_month_summary and the SQL summaries.
+MISSING_SHARE_BP = 0
+
+class GroupedTotals(TypedDict):
+    # One entry per group, in ascending key order.
+    keys: List[Tuple[Any, ...]]
+    expense_count: np.ndarray
+    total_cents: np.ndarray
+    # (groups x users), columns in ExpenseColumns.user_ids order
+    paid_cents: np.ndarray
+    quota_cents: np.ndarray
+
+class ExpenseColumns:
+    """A batch of expenses stored column by column.
+
+    Attributes:
+        amount_cents: int64, one per expense.
+        payer_idx: int64 index into user_ids (-1 for a payer outside the list).
+        month: int64 YYYYMM.
+        category_code: int64 index into categories.
+        shares_bp: int64 (expenses x users) split in basis points.
+        user_ids: user id of each shares_bp column.
+        categories: category name of each code.
+    """
+
+    def __init__(
+        self,
+        amount_cents: np.ndarray,
+        payer_idx: np.ndarray,
+        month: np.ndarray,
+        category_code: np.ndarray,
+        shares_bp: np.ndarray,
+        user_ids: Sequence[int],
+        categories: Sequence[str]
+    ):
+        self.amount_cents = amount_cents.astype(np.int64, copy=False)
+        self.payer_idx = payer_idx.astype(np.int64, copy=False)
+        self.month = month.astype(np.int64, copy=False)
+        self.category_code = category_code.astype(np.int64, copy=False)
+        self.shares_bp = shares_bp.astype(np.int64, copy=False).reshape(len(self.amount_cents), len(user_ids))
+        self.user_ids = list(user_ids)
+        self.categories = list(categories)
+
+    def __len__(self) -> int:
+        return len(self.amount_cents)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Sequence[Tuple[int, int, str, str, Sequence[int]]],
+        user_ids: Sequence[int]
+    ) -> "ExpenseColumns":
+        """Builds columns from (amount_cents, payer_user_id, spent_at, category,
+        shares) tuples, shares being aligned with `user_ids`."""
+        n = len(rows)
+        user_pos = {u: i for i, u in enumerate(user_ids)}
+        amount = np.fromiter((r[0] for r in rows), np.int64, n)
+        payer = np.fromiter((user_pos.get(r[1], -1) for r in rows), np.int64, n)
+        month = np.fromiter((int(str(r[2])[:4]) * 100 + int(str(r[2])[5:7]) for r in rows), np.int64, n)
+        categories, codes = np.unique(np.array([r[3] for r in rows], dtype=object), return_inverse=True) \
+            if n else (np.array([], dtype=object), np.array([], dtype=np.int64))
+        shares = np.array([r[4] for r in rows], dtype=np.int64).reshape(n, len(user_ids))
+        return cls(amount, payer, month, codes, shares, user_ids, [str(c) for c in categories])
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["ExpenseColumns"], user_ids: Sequence[int]) -> "ExpenseColumns":
+        """Joins batches built with the same `user_ids` into one, merging their category codes."""
+        categories = sorted({c for p in parts for c in p.categories})
+        position = {c: i for i, c in enumerate(categories)}
+        codes = [np.array([position[c] for c in p.categories], dtype=np.int64)[p.category_code]
+                 if len(p) else p.category_code for p in parts]
+        empty = np.zeros(0, dtype=np.int64)
+        return cls(
+            np.concatenate([p.amount_cents for p in parts] or [empty]),
+            np.concatenate([p.payer_idx for p in parts] or [empty]),
+            np.concatenate([p.month for p in parts] or [empty]),
+            np.concatenate(codes or [empty]),
+            np.concatenate([p.shares_bp for p in parts] or [np.zeros((0, len(user_ids)), dtype=np.int64)]),
+            user_ids,
+            categories
+        )
+
+    @classmethod
+    def from_stream(cls, rows: Sequence[Tuple], user_ids: Sequence[int]) -> "ExpenseColumns":
+        """Builds columns from one Storage.stream_expenses batch. A user without
+        a share row owes nothing of the expense; one with no share rows at all
+        is shared equally."""
+        equal = [equal_split(list(user_ids)).get(u, 0) for u in user_ids] if user_ids else []
+        return cls.from_rows(
+            [
+                (amount, payer, spent_at, category,
+                 [MISSING_SHARE_BP if s is None else s for s in shares]
+                 if any(s is not None for s in shares) else equal)
+                for _id, spent_at, amount, payer, category, _description, shares in rows
+            ],
+            user_ids
+        )
+
+    @classmethod
+    def from_expenses(cls, expenses: Sequence[Dict[str, Any]], user_ids: Sequence[int]) -> "ExpenseColumns":
+        """Builds columns from Expense dicts (as returned by list_expenses_month);
+        an expense without any split is shared equally."""
+        equal = equal_split(list(user_ids)) if user_ids else {}
+        return cls.from_rows(
+            [
+                (e["amount_cents"], e["payer_user_id"], e["spent_at"], e["category"],
+                 [(e["split_bp"] or equal).get(u, MISSING_SHARE_BP) for u in user_ids])
+                for e in expenses
+            ],
+            user_ids
+        )
+
+def summarize(cols: ExpenseColumns) -> Dict[str, Any]:
+    """Totals of the whole batch in integer cents.
+
+    Returns total_cents, expense_count and per-user paid_cents/quota_cents
+    dicts keyed by user id.
+    """
+    n_users = len(cols.user_ids)
+    known = cols.payer_idx >= 0
+    paid = np.zeros(n_users, dtype=np.int64)
+    np.add.at(paid, cols.payer_idx[known], cols.amount_cents[known])
+    # Exact int64 matrix product: sum of amount * share per user, then round.
+    quota_bp = cols.amount_cents @ cols.shares_bp
+    quota = _round_bp(quota_bp)
+    return {
+        "expense_count": len(cols),
+        "total_cents": int(cols.amount_cents.sum()),
+        "paid_cents": {u: int(paid[i]) for i, u in enumerate(cols.user_ids)},
+        "quota_cents": {u: int(quota[i]) for i, u in enumerate(cols.user_ids)},
+    }
+
+def month_totals(cols: ExpenseColumns, user_a_id: int, user_b_id: int) -> Dict[str, int]:
+    """Two-user totals shaped like database.get_month_totals, for
+    logic.summary_from_cents."""
+    s = summarize(cols)
+    return {
+        "expense_count": s["expense_count"],
+        "total_cents": s["total_cents"],
+        "paid_a_cents": s["paid_cents"].get(user_a_id, 0),
+        "paid_b_cents": s["paid_cents"].get(user_b_id, 0),
+        "quota_a_cents": s["quota_cents"].get(user_a_id, 0),
+        "quota_b_cents": s["quota_cents"].get(user_b_id, 0),
+    }
+
+def group_totals(cols: ExpenseColumns, by: Sequence[str] = ("month",)) -> GroupedTotals:
+    """Aggregates per group in one pass; `by` is any of "month", "category".
+
+    Keys come back as (YYYY-MM, category) tuples in the order of `by`.
+    """
+    n, n_users = len(cols), len(cols.user_ids)
+    fields = {"month": cols.month, "category": cols.category_code}
+    # Mixed-radix key: combine the grouping columns into one int64 per row.
+    key = np.zeros(n, dtype=np.int64)
+    for name in by:
+        values = fields[name]
+        key = key * (int(values.max()) + 1 if n else 1) + values
+    uniq, inverse = np.unique(key, return_inverse=True)
+    g = len(uniq)
+
+    count = np.bincount(inverse, minlength=g).astype(np.int64)
+    total = np.zeros(g, dtype=np.int64)
+    np.add.at(total, inverse, cols.amount_cents)
+
+    paid = np.zeros((g, n_users), dtype=np.int64)
+    known = cols.payer_idx >= 0
+    np.add.at(paid, (inverse[known], cols.payer_idx[known]), cols.amount_cents[known])
+
+    quota_bp = np.zeros((g, n_users), dtype=np.int64)
+    np.add.at(quota_bp, inverse, cols.amount_cents[:, None] * cols.shares_bp)
+
+    # Decode each group's key from one of its rows (all rows of a group share it).
+    representative = np.zeros(g, dtype=np.int64)
+    representative[inverse] = np.arange(n)
+    keys = []
+    for row in representative:
+        parts = []
+        for name in by:
+            if name == "month":
+                m = int(cols.month[row])
+                parts.append(f"{m // 100:04d}-{m % 100:02d}")
+            else:
+                parts.append(cols.categories[int(cols.category_code[row])])
+        keys.append(tuple(parts))
+
+    return {
+        "keys": keys,
+        "expense_count": count,
+        "total_cents": total,
+        "paid_cents": paid,
+        "quota_cents": _round_bp(quota_bp),
+    }
+
+def _round_bp(values: np.ndarray) -> np.ndarray:
+    """cents x basis points -> cents, rounding half away from zero like SQL ROUND."""
+    return np.sign(values) * ((np.abs(values) + 5000) // 10000)
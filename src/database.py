@@ -1,10 +1,21 @@
+import hashlib
 import os
+import secrets
+import unicodedata
 from datetime import datetime, date
-from typing import List, Optional, Dict, Any, TypedDict, Tuple
-import psycopg
-from psycopg.rows import dict_row
+from typing import List, Optional, Dict, Any, Iterable, Iterator, TypedDict, Tuple
+from psycopg.types.json import Jsonb
+from src.cache import cache
+from src.diagnostics import traced
+from src.logic import _round_bp
+from src.pool import get_pool, timed_connection
+from src.tenancy import current_household
 
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+class Household(TypedDict):
+    id: int
+    name: str
+    # Goes in the app's URL (?casa=<slug>); random, so households can't be guessed.
+    slug: str
 
 class User(TypedDict):
     id: int
@@ -17,7 +28,53 @@ class Expense(TypedDict):
     payer_user_id: int
     category: str
     description: str
-    split_json: str
+    # user_id -> share in basis points (10000 = 100%)
+    split_bp: Dict[int, int]
+    # Another expense has the same fingerprint (see expense_fingerprint).
+    is_duplicate: bool
+
+class ExpensePage(TypedDict):
+    rows: List[Expense]
+    # (spent_at, id) of the last row, to pass as `after`; None on the last page.
+    next_cursor: Optional[Tuple[str, int]]
+
+class MonthTotals(TypedDict):
+    expense_count: int
+    total_cents: int
+    paid_a_cents: int
+    paid_b_cents: int
+    quota_a_cents: int
+    quota_b_cents: int
+
+class MonthBalances(TypedDict):
+    # Every member of the household, not just two (see logic.household_summary).
+    expense_count: int
+    total_cents: int
+    # The dicts below are keyed by user id.
+    paid_cents: Dict[int, int]
+    quota_cents: Dict[int, int]
+
+class MonthReport(TypedDict):
+    month: str
+    expense_count: int
+    total_cents: int
+    # The dicts below are keyed by user id.
+    paid_cents: Dict[int, int]
+    quota_cents: Dict[int, int]
+    # paid - quota for the month alone
+    balance_cents: Dict[int, int]
+    # net Fechamento transfers recorded for the month (payer +, receiver -)
+    settled_cents: Dict[int, int]
+    # running balance since the start of the range, after settlements
+    carry_cents: Dict[int, int]
+
+class RangeReport(TypedDict):
+    start_month: str
+    end_month: str
+    months: List[MonthReport]
+    category_totals: Dict[str, int]
+    # category -> month -> cents
+    category_by_month: Dict[str, Dict[str, int]]
 
 class Settlement(TypedDict):
     month: str
@@ -26,192 +83,1148 @@ class Settlement(TypedDict):
     amount: float
     paid_at: Optional[str]
 
+# One balance change for the ledger: (user_id, kind, expense_id, month,
+# effective_on, delta in cents x basis points). kind is "expense" (expense_id
+# set) or "settlement" (month set); see _append_ledger.
+LedgerDelta = Tuple[int, str, Optional[int], Optional[str], str, int]
+
+class MonthSnapshot(TypedDict):
+    # A closed month, frozen as it read when its Fechamento was recorded.
+    month: str
+    closed_at: str
+    balances: MonthBalances
+    # Newest first, like list_expenses_month.
+    expenses: List[Expense]
+
+class MonthView(TypedDict):
+    # Everything the "Resumo do mês" page shows (see database_async.load_month_view).
+    users: List[User]
+    categories: List[str]
+    balances: MonthBalances
+    page: ExpensePage
+    # The month's transfers, oldest first; empty until Fechamento is confirmed.
+    settlements: List[Settlement]
+    # When Fechamento froze the month; None while it is open.
+    closed_at: Optional[str]
+
+class MonthClosedError(Exception):
+    """A write would change a month frozen by its Fechamento (see record_settlements)."""
+
+    def __init__(self, months: Iterable[str]):
+        self.months = sorted(set(months))
+        super().__init__(
+            f"Mês já fechado: {', '.join(self.months)}. Lance a correção como um gasto de ajuste num mês em aberto."
+        )
+
+EXPENSES_PAGE_SIZE = int(os.getenv("EXPENSES_PAGE_SIZE", "20"))
+# Rows per round trip when streaming expenses out (src.export).
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Seeded in every household (bootstrap, add_household).
+DEFAULT_CATEGORIES = ["Outro", "Mercado", "Contas", "Transporte", "Casa", "Pets"]
+
+# Hot-path statements, shared with src.query_plans so the plan check EXPLAINs
+# exactly what the app runs.
+LIST_EXPENSES_MONTH_SQL = """
+    SELECT e.id, e.spent_at, e.amount_cents, e.payer_user_id, c.name AS category,
+           COALESCE(e.description,'') as description, s.split_users, s.split_shares,
+           EXISTS (SELECT 1 FROM expenses d
+                   WHERE d.household_id = e.household_id AND d.fingerprint = e.fingerprint AND d.id <> e.id) AS is_duplicate
+    FROM expenses e
+    JOIN categories c ON c.id = e.category_id
+    LEFT JOIN LATERAL (
+        SELECT array_agg(user_id) AS split_users, array_agg(share_bp) AS split_shares
+        FROM expense_splits WHERE expense_id = e.id
+    ) s ON true
+    WHERE e.household_id = %(household)s AND e.spent_at >= %(start)s AND e.spent_at < %(end)s
+    ORDER BY e.spent_at DESC, e.id DESC;
+"""
+
+# Keyset pagination: the row comparison continues right after the cursor on
+# the (household_id, spent_at DESC, id DESC) index instead of skipping rows with OFFSET.
+_EXPENSES_PAGE_SELECT = """
+    SELECT e.id, e.spent_at, e.amount_cents, e.payer_user_id, c.name AS category,
+           COALESCE(e.description,'') as description, s.split_users, s.split_shares,
+           EXISTS (SELECT 1 FROM expenses d
+                   WHERE d.household_id = e.household_id AND d.fingerprint = e.fingerprint AND d.id <> e.id) AS is_duplicate
+    FROM expenses e
+    JOIN categories c ON c.id = e.category_id
+    LEFT JOIN LATERAL (
+        SELECT array_agg(user_id) AS split_users, array_agg(share_bp) AS split_shares
+        FROM expense_splits WHERE expense_id = e.id
+    ) s ON true
+    WHERE e.household_id = %(household)s AND e.spent_at >= %(start)s AND e.spent_at < %(end)s {after}
+    ORDER BY e.spent_at DESC, e.id DESC
+    LIMIT %(limit)s;
+"""
+LIST_EXPENSES_FIRST_PAGE_SQL = _EXPENSES_PAGE_SELECT.format(after="")
+LIST_EXPENSES_NEXT_PAGE_SQL = _EXPENSES_PAGE_SELECT.format(
+    after="AND (e.spent_at, e.id) < (%(after_date)s, %(after_id)s)"
+)
+
+# Reads the incrementally maintained month_summaries tables: one primary-key
+# lookup for the month plus one per user, whatever the number of expenses.
+MONTH_TOTALS_SQL = """
+    SELECT COALESCE(m.expense_count, 0) AS expense_count,
+           COALESCE(m.total_cents, 0) AS total_cents,
+           COALESCE(ua.paid_cents, 0) AS paid_a_cents,
+           COALESCE(ub.paid_cents, 0) AS paid_b_cents,
+           ROUND(COALESCE(ua.quota_bp_cents, 0) / 10000.0)::bigint AS quota_a_cents,
+           ROUND(COALESCE(ub.quota_bp_cents, 0) / 10000.0)::bigint AS quota_b_cents
+    FROM (SELECT %(household)s::int AS household_id, %(month)s::text AS month) k
+    LEFT JOIN month_summaries m ON m.household_id = k.household_id AND m.month = k.month
+    LEFT JOIN month_user_summaries ua
+           ON ua.household_id = k.household_id AND ua.month = k.month AND ua.user_id = %(a)s
+    LEFT JOIN month_user_summaries ub
+           ON ub.household_id = k.household_id AND ub.month = k.month AND ub.user_id = %(b)s;
+"""
+
+# Every user's paid/quota for the month from the same tables: one row per
+# user with a summary (user_id NULL when the month has none).
+MONTH_BALANCES_SQL = """
+    SELECT COALESCE(m.expense_count, 0) AS expense_count,
+           COALESCE(m.total_cents, 0) AS total_cents,
+           u.user_id, u.paid_cents,
+           ROUND(u.quota_bp_cents / 10000.0)::bigint AS quota_cents
+    FROM (SELECT %(household)s::int AS household_id, %(month)s::text AS month) k
+    LEFT JOIN month_summaries m ON m.household_id = k.household_id AND m.month = k.month
+    LEFT JOIN month_user_summaries u ON u.household_id = k.household_id AND u.month = k.month
+    ORDER BY u.user_id;
+"""
+
+# Per (household, month, user) contributions of a set of expenses: what each user paid
+# and their quota in cents x basis points (exact integers, rounded on read).
+# {where} filters the expenses (alias e); used by bulk inserts and rebuilds.
+_SUMMARY_CONTRIBUTIONS_SQL = """
+    SELECT household_id, month, user_id, SUM(paid)::bigint AS paid_cents, SUM(quota)::bigint AS quota_bp_cents
+    FROM (
+        SELECT e.household_id, to_char(e.spent_at, 'YYYY-MM') AS month, e.payer_user_id AS user_id,
+               e.amount_cents::bigint AS paid, 0::bigint AS quota
+        FROM expenses e WHERE {where}
+        UNION ALL
+        SELECT e.household_id, to_char(e.spent_at, 'YYYY-MM'), s.user_id, 0, e.amount_cents::bigint * s.share_bp
+        FROM expenses e JOIN expense_splits s ON s.expense_id = e.id WHERE {where}
+    ) c
+    GROUP BY household_id, month, user_id
+"""
+
+_ADD_MONTH_SUMMARIES_SQL = """
+    INSERT INTO month_summaries(household_id, month, expense_count, total_cents)
+    SELECT e.household_id, to_char(e.spent_at, 'YYYY-MM'), COUNT(*), SUM(e.amount_cents)
+    FROM expenses e WHERE {where}
+    GROUP BY 1, 2
+    ON CONFLICT (household_id, month) DO UPDATE SET
+        expense_count = month_summaries.expense_count + EXCLUDED.expense_count,
+        total_cents = month_summaries.total_cents + EXCLUDED.total_cents;
+"""
+
+_ADD_MONTH_USER_SUMMARIES_SQL = """
+    INSERT INTO month_user_summaries(household_id, month, user_id, paid_cents, quota_bp_cents)
+    {contributions}
+    ON CONFLICT (household_id, month, user_id) DO UPDATE SET
+        paid_cents = month_user_summaries.paid_cents + EXCLUDED.paid_cents,
+        quota_bp_cents = month_user_summaries.quota_bp_cents + EXCLUDED.quota_bp_cents;
+"""
+
+# Everything a multi-month report needs in one statement: per (month,
+# category, user) paid/quota of the expenses, plus the settlement transfers.
+# Grouping is on category_id; names are joined onto the grouped rows only.
+RANGE_REPORT_SQL = """
+    SELECT 'expense' AS kind, g.month, cat.name AS category, g.user_id,
+           g.expense_count, g.paid_cents, g.quota_bp_cents, 0::bigint AS settled_cents
+    FROM (
+        SELECT month, category_id, user_id,
+               SUM(n)::bigint AS expense_count, SUM(paid)::bigint AS paid_cents,
+               SUM(quota)::bigint AS quota_bp_cents
+        FROM (
+            SELECT to_char(e.spent_at, 'YYYY-MM') AS month, e.category_id, e.payer_user_id AS user_id,
+                   1 AS n, e.amount_cents::bigint AS paid, 0::bigint AS quota
+            FROM expenses e
+            WHERE e.household_id = %(household)s AND e.spent_at >= %(start)s AND e.spent_at < %(end)s
+            UNION ALL
+            SELECT to_char(e.spent_at, 'YYYY-MM'), e.category_id, s.user_id,
+                   0, 0, e.amount_cents::bigint * s.share_bp
+            FROM expenses e JOIN expense_splits s ON s.expense_id = e.id
+            WHERE e.household_id = %(household)s AND e.spent_at >= %(start)s AND e.spent_at < %(end)s
+        ) c
+        GROUP BY month, category_id, user_id
+    ) g
+    JOIN categories cat ON cat.id = g.category_id
+    UNION ALL
+    SELECT 'settlement', month, NULL, user_id, 0, 0, 0, SUM(amount)::bigint
+    FROM (
+        SELECT month, from_user_id AS user_id, amount_cents AS amount FROM settlements
+        WHERE household_id = %(household)s AND paid_at IS NOT NULL
+          AND month >= %(start_month)s AND month <= %(end_month)s
+        UNION ALL
+        SELECT month, to_user_id, -amount_cents FROM settlements
+        WHERE household_id = %(household)s AND paid_at IS NOT NULL
+          AND month >= %(start_month)s AND month <= %(end_month)s
+    ) t
+    GROUP BY month, user_id;
+"""
+
+FIND_DUPLICATES_SQL = """
+    SELECT fingerprint, COUNT(*) AS n FROM expenses
+    WHERE household_id = %(household)s AND fingerprint = ANY(%(fingerprints)s) GROUP BY fingerprint;
+"""
+
+# Expenses reference categories by id, so a rename is a single-row update.
+RENAME_CATEGORY_SQL = "UPDATE categories SET name=%(new)s WHERE household_id=%(household)s AND name=%(old)s;"
+
+# Ids for a list of category names in one round trip. Names nobody added
+# (a typed-in category saved with an expense) are created archived, so the
+# list of categories only grows through add_category, as before.
+CATEGORY_IDS_SQL = """
+    WITH wanted(name) AS (SELECT DISTINCT unnest(%(names)s::text[])),
+    created AS (
+        INSERT INTO categories(household_id, name, archived) SELECT %(household)s, name, true FROM wanted
+        ON CONFLICT (household_id, name) DO NOTHING
+        RETURNING id, name
+    )
+    SELECT id, name FROM created
+    UNION ALL
+    SELECT c.id, c.name FROM categories c JOIN wanted w ON w.name = c.name WHERE c.household_id = %(household)s;
+"""
+
+LIST_USERS_SQL = "SELECT id, name FROM users WHERE household_id=%(household)s ORDER BY id ASC;"
+LIST_CATEGORIES_SQL = "SELECT name FROM categories WHERE household_id=%(household)s AND NOT archived ORDER BY name ASC;"
+GET_SETTLEMENTS_SQL = """
+    SELECT month, from_user_id, to_user_id, amount_cents, paid_at FROM settlements
+    WHERE household_id=%(household)s AND month=%(month)s ORDER BY id;
+"""
+# Adds a category, or brings back an archived one.
+ACTIVATE_CATEGORY_SQL = """
+    INSERT INTO categories(household_id, name) VALUES (%(household)s, %(name)s)
+    ON CONFLICT (household_id, name) DO UPDATE SET archived = false WHERE categories.archived;
+"""
+GET_HOUSEHOLD_SQL = "SELECT id, name, slug FROM households WHERE slug=%(slug)s;"
+
+GET_MONTH_SNAPSHOT_SQL = """
+    SELECT month, closed_at, balances, expenses FROM month_snapshots
+    WHERE household_id = %(household)s AND month = %(month)s;
+"""
+_CLOSED_MONTHS_SQL = """
+    SELECT month FROM month_snapshots WHERE household_id = %(household)s AND month = ANY(%(months)s);
+"""
+# Locks the month's month_summaries row (creating an empty one if needed).
+# Expense writes lock it too, through their summary upserts, before checking
+# _CLOSED_MONTHS_SQL: so a write either lands before the snapshot is taken or
+# sees the snapshot and fails, never in between.
+_LOCK_MONTH_SQL = """
+    INSERT INTO month_summaries(household_id, month) VALUES (%(household)s, %(month)s)
+    ON CONFLICT (household_id, month) DO UPDATE SET expense_count = month_summaries.expense_count;
+"""
+_SAVE_MONTH_SNAPSHOT_SQL = """
+    INSERT INTO month_snapshots(household_id, month, closed_at, balances, expenses)
+    VALUES (%(household)s, %(month)s, %(closed_at)s, %(balances)s, %(expenses)s)
+    ON CONFLICT (household_id, month) DO UPDATE
+        SET closed_at = EXCLUDED.closed_at, balances = EXCLUDED.balances, expenses = EXCLUDED.expenses;
+"""
+
+# Appends balance deltas to the ledger. The user_balances upsert locks each
+# user's row, so concurrent writers queue up per user and every entry's
+# balance_after continues from the one before it. Amounts are cents x basis
+# points (exact integers, rounded on read).
+_APPEND_LEDGER_SQL = """
+    WITH entries AS (
+        SELECT * FROM unnest(%(users)s::int[], %(kinds)s::text[], %(expenses)s::int[], %(months)s::text[],
+                             %(dates)s::date[], %(deltas)s::bigint[]) WITH ORDINALITY
+                 AS t(user_id, kind, expense_id, month, effective_on, delta, ord)
+    ),
+    balances AS (
+        INSERT INTO user_balances(household_id, user_id, balance_bp_cents)
+        SELECT %(household)s, user_id, SUM(delta) FROM entries GROUP BY user_id
+        ON CONFLICT (household_id, user_id) DO UPDATE
+            SET balance_bp_cents = user_balances.balance_bp_cents + EXCLUDED.balance_bp_cents
+        RETURNING user_id, balance_bp_cents
+    )
+    INSERT INTO ledger_entries(household_id, user_id, kind, expense_id, month, effective_on,
+                               delta_bp_cents, balance_after_bp_cents)
+    SELECT %(household)s, e.user_id, e.kind, e.expense_id, e.month, e.effective_on, e.delta,
+           b.balance_bp_cents - SUM(e.delta) OVER (PARTITION BY e.user_id)
+                              + SUM(e.delta) OVER (PARTITION BY e.user_id ORDER BY e.ord)
+    FROM entries e JOIN balances b USING (user_id)
+    ORDER BY e.ord;
+"""
+
+# Rebuilds ledger entries from the current expenses and settlements, oldest
+# first by effective date; {where} filters on household_id. recorded_at is
+# the effective date (capped at now), so point-in-time reads of a replayed
+# ledger follow the dates of the expenses.
+_REPLAY_LEDGER_SQL = """
+    INSERT INTO ledger_entries(household_id, user_id, recorded_at, effective_on, kind, expense_id, month,
+                               delta_bp_cents, balance_after_bp_cents)
+    SELECT household_id, user_id, LEAST(effective_on::timestamptz, clock_timestamp()), effective_on, kind,
+           expense_id, month, delta,
+           SUM(delta) OVER (PARTITION BY household_id, user_id ORDER BY effective_on, kind, expense_id, seq)
+    FROM (
+        SELECT e.household_id, d.user_id, e.spent_at AS effective_on, 'expense' AS kind, e.id AS expense_id,
+               NULL::text AS month, 0 AS seq, SUM(d.delta)::bigint AS delta
+        FROM expenses e
+        CROSS JOIN LATERAL (
+            SELECT e.payer_user_id AS user_id, e.amount_cents::bigint * 10000 AS delta
+            UNION ALL
+            SELECT s.user_id, -e.amount_cents::bigint * s.share_bp FROM expense_splits s WHERE s.expense_id = e.id
+        ) d
+        GROUP BY e.household_id, d.user_id, e.spent_at, e.id
+        HAVING SUM(d.delta) <> 0
+        UNION ALL
+        SELECT s.household_id, t.user_id, COALESCE(s.paid_at::date, to_date(s.month, 'YYYY-MM')), 'settlement',
+               NULL, s.month, s.id, t.delta
+        FROM settlements s
+        CROSS JOIN LATERAL (VALUES (s.from_user_id, s.amount_cents::bigint * 10000),
+                                   (s.to_user_id, -s.amount_cents::bigint * 10000)) AS t(user_id, delta)
+    ) d
+    WHERE {where}
+    ORDER BY effective_on, kind, expense_id, seq;
+"""
+
+_REPLAY_USER_BALANCES_SQL = """
+    INSERT INTO user_balances(household_id, user_id, balance_bp_cents)
+    SELECT household_id, user_id, SUM(delta_bp_cents) FROM ledger_entries WHERE {where}
+    GROUP BY household_id, user_id;
+"""
+
+# Every member's running balance: now from user_balances, or at a past
+# moment from the last ledger entry before it (one index probe per user).
+BALANCES_SQL = """
+    SELECT u.id AS user_id, ROUND(COALESCE(b.balance_bp_cents, 0) / 10000.0)::bigint AS balance_cents
+    FROM users u
+    LEFT JOIN user_balances b ON b.household_id = u.household_id AND b.user_id = u.id
+    WHERE u.household_id = %(household)s
+    ORDER BY u.id;
+"""
+BALANCES_AS_OF_SQL = """
+    SELECT u.id AS user_id, ROUND(COALESCE(l.balance_after_bp_cents, 0) / 10000.0)::bigint AS balance_cents
+    FROM users u
+    LEFT JOIN LATERAL (
+        SELECT balance_after_bp_cents FROM ledger_entries l
+        WHERE l.household_id = u.household_id AND l.user_id = u.id AND l.recorded_at <= %(as_of)s
+        ORDER BY l.recorded_at DESC, l.id DESC
+        LIMIT 1
+    ) l ON true
+    WHERE u.household_id = %(household)s
+    ORDER BY u.id;
+"""
+
+def expense_fingerprint(spent_at: Any, amount_cents: int, payer_user_id: int, description: Optional[str]) -> str:
+    """Identifies "the same" expense across manual entry and imports.
+
+    Built from the date, amount, payer and a hash of the description after
+    lower-casing, stripping accents and collapsing whitespace, so re-imported
+    statement lines or a bill logged twice share a fingerprint.
+    """
+    text = unicodedata.normalize("NFKD", (description or "").lower())
+    text = " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+    description_hash = hashlib.md5(text.encode("utf-8")).hexdigest()
+    key = f"{str(spent_at)[:10]}|{amount_cents}|{payer_user_id}|{description_hash}"
+    return hashlib.md5(key.encode("utf-8")).hexdigest()
+
 def get_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL não definida. Configure no seu ambiente.")
-    return psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    """Borrows a connection from the process-wide pool.
+
+    Use it as a context manager: on exit the transaction is committed (or rolled
+    back on error) and the connection goes back to the pool instead of closing.
+    """
+    return timed_connection(get_pool())
+
+def _key(*parts: Any) -> Tuple:
+    """A cache key scoped to the current household, so tenants never share entries."""
+    return (current_household(),) + parts
+
+def _month_of(spent_at: Any) -> str:
+    """Returns the YYYY-MM cache bucket of a date or ISO date string."""
+    return str(spent_at)[:7]
+
+def _invalidate_months(months: Optional[Iterable[str]]) -> None:
+    """Drops cached reads of the given months (None: every month), the
+    range reports, which may span any of them, and the running balances."""
+    if months is None:
+        cache.invalidate_prefix(_key("month"))
+    else:
+        for month in set(months):
+            cache.invalidate_prefix(_key("month", month))
+    cache.invalidate_prefix(_key("report"))
+    cache.invalidate(_key("balances"))
+
+def _month_bounds(month_yyyy_mm: str) -> Tuple[date, date]:
+    """Returns the [start, end) date range of a YYYY-MM month."""
+    year, month = map(int, month_yyyy_mm.split("-"))
+    start = date(year, month, 1)
+    if month == 12:
+        end = date(year + 1, 1, 1)
+    else:
+        end = date(year, month + 1, 1)
+    return start, end
+
+def _category_ids(cur, names: Iterable[str]) -> Dict[str, int]:
+    """Maps category names to ids, creating unknown names (see CATEGORY_IDS_SQL)."""
+    cur.execute(CATEGORY_IDS_SQL, {"household": current_household(), "names": list(names)})
+    return {r["name"]: r["id"] for r in cur.fetchall()}
+
+def _write_splits(cur, expense_id: int, split_bp: Dict[int, int]) -> None:
+    """Replaces the split rows of an expense."""
+    cur.execute("DELETE FROM expense_splits WHERE expense_id=%s;", (expense_id,))
+    cur.executemany(
+        "INSERT INTO expense_splits(expense_id, user_id, share_bp) VALUES (%s, %s, %s);",
+        [(expense_id, user_id, share) for user_id, share in split_bp.items()]
+    )
+
+def _apply_summary_delta(
+    cur,
+    spent_at: Any,
+    sign: int,
+    amount_cents: int,
+    payer_user_id: int,
+    split_bp: Dict[int, int]
+) -> None:
+    """Adds (sign=1) or removes (sign=-1) one expense from month_summaries."""
+    household, month = current_household(), _month_of(spent_at)
+    cur.execute(
+        """INSERT INTO month_summaries(household_id, month, expense_count, total_cents) VALUES (%s, %s, %s, %s)
+           ON CONFLICT (household_id, month) DO UPDATE SET
+               expense_count = month_summaries.expense_count + EXCLUDED.expense_count,
+               total_cents = month_summaries.total_cents + EXCLUDED.total_cents;""",
+        (household, month, sign, sign * amount_cents)
+    )
+    rows = []
+    for user_id in set(split_bp) | {payer_user_id}:
+        paid = amount_cents if user_id == payer_user_id else 0
+        quota = amount_cents * split_bp.get(user_id, 0)
+        rows.append((household, month, user_id, sign * paid, sign * quota))
+    cur.executemany(
+        """INSERT INTO month_user_summaries(household_id, month, user_id, paid_cents, quota_bp_cents)
+           VALUES (%s, %s, %s, %s, %s)
+           ON CONFLICT (household_id, month, user_id) DO UPDATE SET
+               paid_cents = month_user_summaries.paid_cents + EXCLUDED.paid_cents,
+               quota_bp_cents = month_user_summaries.quota_bp_cents + EXCLUDED.quota_bp_cents;""",
+        rows
+    )
+
+def _add_to_month_summaries(cur, where: str, params: Dict[str, Any]) -> None:
+    """Adds the expenses matching `where` (alias e) to month_summaries."""
+    cur.execute(_ADD_MONTH_SUMMARIES_SQL.format(where=where), params)
+    cur.execute(_ADD_MONTH_USER_SUMMARIES_SQL.format(
+        contributions=_SUMMARY_CONTRIBUTIONS_SQL.format(where=where)
+    ), params)
+
+def _check_months_open(cur, months: Iterable[str]) -> None:
+    """Raises MonthClosedError if any of `months` is closed. Call it after the
+    write's month_summaries upserts (see _LOCK_MONTH_SQL)."""
+    cur.execute(_CLOSED_MONTHS_SQL, {"household": current_household(), "months": sorted(set(months))})
+    closed = [r["month"] for r in cur.fetchall()]
+    if closed:
+        raise MonthClosedError(closed)
+
+def _read_splits(cur, expense_id: int) -> Dict[int, int]:
+    cur.execute("SELECT user_id, share_bp FROM expense_splits WHERE expense_id=%s;", (expense_id,))
+    return {r["user_id"]: r["share_bp"] for r in cur.fetchall()}
+
+def expense_ledger_deltas(
+    expense_id: int,
+    spent_at: Any,
+    amount_cents: int,
+    payer_user_id: int,
+    split_bp: Dict[int, int],
+    sign: int = 1
+) -> List[LedgerDelta]:
+    """What one expense adds to each balance (paid - quota); sign=-1 takes it back."""
+    deltas = {payer_user_id: amount_cents * 10000}
+    for user_id, share in split_bp.items():
+        deltas[user_id] = deltas.get(user_id, 0) - amount_cents * share
+    return [(user_id, "expense", expense_id, None, str(spent_at)[:10], sign * delta)
+            for user_id, delta in sorted(deltas.items()) if delta]
+
+def settlement_ledger_deltas(
+    month: str,
+    transfers: Iterable[Tuple[int, int, int]],
+    effective_on: str,
+    sign: int = 1
+) -> List[LedgerDelta]:
+    """What a month's transfers do to the balances: the payer's goes up, the receiver's down."""
+    deltas: List[LedgerDelta] = []
+    for from_id, to_id, cents in transfers:
+        deltas.append((from_id, "settlement", None, month, effective_on, sign * cents * 10000))
+        deltas.append((to_id, "settlement", None, month, effective_on, -sign * cents * 10000))
+    return deltas
+
+def _append_ledger(cur, deltas: List[LedgerDelta]) -> None:
+    """Appends `deltas` to the household's ledger in order (see _APPEND_LEDGER_SQL)."""
+    if not deltas:
+        return
+    users, kinds, expenses, months, dates, amounts = zip(*deltas)
+    cur.execute(_APPEND_LEDGER_SQL, {
+        "household": current_household(), "users": list(users), "kinds": list(kinds),
+        "expenses": list(expenses), "months": list(months), "dates": list(dates), "deltas": list(amounts),
+    })
+
+@traced
+def rebuild_month_summaries(months: Optional[List[str]] = None) -> None:
+    """Recomputes the household's month_summaries from its expenses (all
+    months, or the given ones).
+
+    Repair tool: the incremental updates keep the tables right on their own.
+    """
+    params: Dict[str, Any] = {"household": current_household()}
+    if months is None:
+        where = "e.household_id = %(household)s"
+        summaries = "household_id = %(household)s"
+    else:
+        where = "e.household_id = %(household)s AND to_char(e.spent_at, 'YYYY-MM') = ANY(%(months)s)"
+        summaries = "household_id = %(household)s AND month = ANY(%(months)s)"
+        params["months"] = months
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM month_user_summaries WHERE {summaries};", params)
+            cur.execute(f"DELETE FROM month_summaries WHERE {summaries};", params)
+            _add_to_month_summaries(cur, where, params)
+        conn.commit()
+    _invalidate_months(months)
 
 def init_db() -> None:
-    """Initializes the database schema if it doesn't exist."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS expenses (
-                    id SERIAL PRIMARY KEY,
-                    created_at TIMESTAMPTZ NOT NULL,
-                    spent_at DATE NOT NULL,
-                    amount_cents INTEGER NOT NULL,
-                    payer_user_id INTEGER NOT NULL REFERENCES users(id),
-                    category TEXT NOT NULL,
-                    description TEXT,
-                    split_json TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS settlements (
-                    id SERIAL PRIMARY KEY,
-                    month TEXT NOT NULL UNIQUE,
-                    from_user_id INTEGER NOT NULL REFERENCES users(id),
-                    to_user_id INTEGER NOT NULL REFERENCES users(id),
-                    amount_cents INTEGER NOT NULL,
-                    paid_at TIMESTAMPTZ
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE
-                );
-            """)
+    """Brings the schema up to date (kept for compatibility, see src.migrations)."""
+    from src.migrations import migrate
+    migrate()
+
+@traced
+def get_household(slug: str) -> Optional[Household]:
+    """Looks a household up by the slug of its URL (cached); None if there is none."""
+    def load() -> Optional[Household]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(GET_HOUSEHOLD_SQL, {"slug": slug})
+                return cur.fetchone()
+    # Not scoped with _key: this is how a session finds its household.
+    return cache.get_or_load(("household", slug), load)
+
+@traced
+def list_households() -> List[Household]:
+    """Every household, oldest first (for operators looking for a link)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name, slug FROM households ORDER BY id;")
+            return cur.fetchall()
+
+@traced
+def add_household(name: str, member_names: List[str]) -> Household:
+    """Creates a household with its members and the default categories, in one transaction."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO households(name, slug) VALUES (%s, %s) RETURNING id, name, slug;",
+                (name, secrets.token_urlsafe(6))
+            )
+            household = cur.fetchone()
+            cur.executemany(
+                "INSERT INTO users(household_id, name) VALUES (%s, %s);",
+                [(household["id"], member) for member in member_names]
+            )
+            cur.executemany(
+                "INSERT INTO categories(household_id, name) VALUES (%s, %s);",
+                [(household["id"], category) for category in DEFAULT_CATEGORIES]
+            )
         conn.commit()
+    return household
 
+@traced
 def upsert_default_users(user_a_name: str = "Thiago", user_b_name: str = "Marina") -> None:
-    """Creates default users if the table is empty."""
+    """Creates default users if the household has none."""
+    household = current_household()
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM users;")
+            cur.execute("SELECT COUNT(*) FROM users WHERE household_id=%s;", (household,))
             count = cur.fetchone()["count"]
             if count == 0:
-                cur.execute("INSERT INTO users(name) VALUES (%s);", (user_a_name,))
-                cur.execute("INSERT INTO users(name) VALUES (%s);", (user_b_name,))
+                cur.executemany(
+                    "INSERT INTO users(household_id, name) VALUES (%s, %s);",
+                    [(household, user_a_name), (household, user_b_name)]
+                )
         conn.commit()
+    cache.invalidate(_key("users"))
 
-def get_users() -> List[User]:
-    """Returns a list of all users."""
+@traced
+def add_user(name: str) -> None:
+    """Adds a member to the household."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, name FROM users ORDER BY id ASC;")
-            return cur.fetchall()
+            cur.execute("INSERT INTO users(household_id, name) VALUES (%s, %s);", (current_household(), name))
+        conn.commit()
+    cache.invalidate(_key("users"))
 
+@traced
+def get_users() -> List[User]:
+    """Returns a list of all users (cached)."""
+    def load() -> List[User]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(LIST_USERS_SQL, {"household": current_household()})
+                return cur.fetchall()
+    return cache.get_or_load(_key("users"), load)
+
+@traced
 def upsert_default_categories() -> None:
     """Seeds default categories, ensuring all defaults exist."""
-    defaults = ["Outro", "Mercado", "Contas", "Transporte", "Casa", "Pets"]
     with get_connection() as conn:
         with conn.cursor() as cur:
-            for cat in defaults:
-                cur.execute("INSERT INTO categories(name) VALUES (%s) ON CONFLICT DO NOTHING;", (cat,))
+            for cat in DEFAULT_CATEGORIES:
+                # Restores a default that was deleted (archived), like it did
+                # when deleting removed the row.
+                cur.execute(ACTIVATE_CATEGORY_SQL, {"household": current_household(), "name": cat})
         conn.commit()
+    cache.invalidate(_key("categories"))
 
+@traced
 def get_categories() -> List[str]:
-    """Returns a list of all category names."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT name FROM categories ORDER BY name ASC;")
-            return [r["name"] for r in cur.fetchall()]
+    """Returns the names of the categories in use, archived ones excluded (cached)."""
+    def load() -> List[str]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(LIST_CATEGORIES_SQL, {"household": current_household()})
+                return [r["name"] for r in cur.fetchall()]
+    return cache.get_or_load(_key("categories"), load)
 
+@traced
 def add_category(name: str) -> None:
-    """Adds a new category if it doesn't already exist."""
+    """Adds a new category if it doesn't already exist (un-archiving it if it does)."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO categories(name) VALUES (%s) ON CONFLICT DO NOTHING;", (name,))
+            cur.execute(ACTIVATE_CATEGORY_SQL, {"household": current_household(), "name": name})
         conn.commit()
+    cache.invalidate(_key("categories"))
 
+@traced
 def update_category(old_name: str, new_name: str) -> None:
-    """Updates a category name and all associated expenses."""
+    """Renames a category; its expenses follow through category_id."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # Update expenses first (or use a cascade if schema allowed, but this is safer)
-            cur.execute("UPDATE expenses SET category=%s WHERE category=%s;", (new_name, old_name))
-            # Update category table
-            cur.execute("UPDATE categories SET name=%s WHERE name=%s;", (new_name, old_name))
+            cur.execute(RENAME_CATEGORY_SQL, {"household": current_household(), "new": new_name, "old": old_name})
         conn.commit()
+    # Cached expense rows of any month may carry the old name.
+    cache.invalidate(_key("categories"))
+    _invalidate_months(None)
 
+@traced
 def delete_category(name: str) -> None:
-    """Deletes a category (expenses will keep the category name as text, but it won't be in the list)."""
+    """Removes a category from the list. It is archived, not deleted, so its
+    expenses keep their category; adding the name again brings it back."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM categories WHERE name=%s;", (name,))
+            cur.execute(
+                "UPDATE categories SET archived = true WHERE household_id=%s AND name=%s;",
+                (current_household(), name)
+            )
         conn.commit()
+    cache.invalidate(_key("categories"))
 
+@traced
 def add_expense(
     amount_cents: int,
     payer_user_id: int,
     category: str,
     description: str,
     spent_at: str,
-    split_json: str
+    split_bp: Dict[int, int],
+    idempotency_key: Optional[str] = None
 ) -> None:
-    """Adds a new expense to the database."""
+    """Adds a new expense to the database.
+
+    `split_bp` maps user id to that user's share in basis points (10000 = 100%).
+    An expense whose `idempotency_key` is already stored is not added again
+    (see src.write_queue). Raises MonthClosedError if its month is closed, as
+    do every other expense write.
+    """
+    fingerprint = expense_fingerprint(spent_at, amount_cents, payer_user_id, description)
     with get_connection() as conn:
         with conn.cursor() as cur:
+            category_id = _category_ids(cur, [category])[category]
             cur.execute(
-                """INSERT INTO expenses(created_at, spent_at, amount_cents, payer_user_id, category, description, split_json)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s);""",
-                (datetime.utcnow(), spent_at, amount_cents, payer_user_id, category, description, split_json)
+                """INSERT INTO expenses(household_id, created_at, spent_at, amount_cents, payer_user_id, category_id,
+                                        description, fingerprint, idempotency_key)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                   ON CONFLICT (household_id, idempotency_key) DO NOTHING
+                   RETURNING id;""",
+                (current_household(), datetime.utcnow(), spent_at, amount_cents, payer_user_id, category_id,
+                 description, fingerprint, idempotency_key)
             )
+            inserted = cur.fetchone()
+            if inserted:
+                _write_splits(cur, inserted["id"], split_bp)
+                _apply_summary_delta(cur, spent_at, 1, amount_cents, payer_user_id, split_bp)
+                _check_months_open(cur, [_month_of(spent_at)])
+                _append_ledger(cur, expense_ledger_deltas(
+                    inserted["id"], spent_at, amount_cents, payer_user_id, split_bp
+                ))
         conn.commit()
+    _invalidate_months([_month_of(spent_at)])
 
-def list_expenses_month(month_yyyy_mm: str) -> List[Expense]:
-    """Lists all expenses for a given month (YYYY-MM)."""
-    year, month = map(int, month_yyyy_mm.split("-"))
-    start = date(year, month, 1)
-    if month == 12:
-        end = date(year + 1, 1, 1)
-    else:
-        end = date(year, month + 1, 1)
+@traced
+def bulk_add_expenses(expenses: List[Dict[str, Any]]) -> int:
+    """Inserts many expenses in one transaction using COPY.
 
+    Each item has the add_expense fields (spent_at, amount_cents,
+    payer_user_id, category, description, split_bp) and optionally an
+    idempotency_key; items whose key is already stored are skipped. Ids are
+    reserved from the sequence up front so expenses and their split rows can
+    both be streamed with COPY. Returns the number of expenses inserted.
+    """
+    if not expenses:
+        return 0
+    household, now = current_household(), datetime.utcnow()
     with get_connection() as conn:
         with conn.cursor() as cur:
+            keys = [e["idempotency_key"] for e in expenses if e.get("idempotency_key")]
+            if keys:
+                cur.execute(
+                    "SELECT idempotency_key FROM expenses WHERE household_id = %s AND idempotency_key = ANY(%s);",
+                    (household, keys)
+                )
+                stored = {r["idempotency_key"] for r in cur.fetchall()}
+                expenses = [e for e in expenses if e.get("idempotency_key") not in stored]
+                if not expenses:
+                    return 0
             cur.execute(
-                """SELECT id, spent_at, amount_cents, payer_user_id, category, COALESCE(description,'') as description, split_json
-                   FROM expenses
-                   WHERE spent_at >= %s AND spent_at < %s
-                   ORDER BY spent_at DESC, id DESC;""",
-                (start, end)
+                "SELECT nextval(pg_get_serial_sequence('expenses', 'id')) AS id FROM generate_series(1, %s);",
+                (len(expenses),)
             )
-            rows = cur.fetchall()
+            ids = [r["id"] for r in cur.fetchall()]
+            category_ids = _category_ids(cur, {e["category"] for e in expenses})
+            with cur.copy(
+                "COPY expenses (id, household_id, created_at, spent_at, amount_cents, payer_user_id, category_id,"
+                " description, fingerprint, idempotency_key) FROM STDIN"
+            ) as copy:
+                for expense_id, e in zip(ids, expenses):
+                    fingerprint = expense_fingerprint(e["spent_at"], e["amount_cents"], e["payer_user_id"], e["description"])
+                    copy.write_row((expense_id, household, now, e["spent_at"], e["amount_cents"], e["payer_user_id"],
+                                    category_ids[e["category"]], e["description"], fingerprint,
+                                    e.get("idempotency_key")))
+            with cur.copy("COPY expense_splits (expense_id, user_id, share_bp) FROM STDIN") as copy:
+                for expense_id, e in zip(ids, expenses):
+                    for user_id, share in e["split_bp"].items():
+                        copy.write_row((expense_id, user_id, share))
+            _add_to_month_summaries(cur, "e.id = ANY(%(ids)s)", {"ids": ids})
+            _check_months_open(cur, {_month_of(e["spent_at"]) for e in expenses})
+            _append_ledger(cur, [
+                delta
+                for expense_id, e in zip(ids, expenses)
+                for delta in expense_ledger_deltas(
+                    expense_id, e["spent_at"], e["amount_cents"], e["payer_user_id"], e["split_bp"]
+                )
+            ])
+        conn.commit()
+    _invalidate_months({_month_of(e["spent_at"]) for e in expenses})
+    return len(expenses)
+
+@traced
+def find_duplicates(fingerprints: List[str]) -> Dict[str, int]:
+    """Counts existing expenses per fingerprint (only those that exist).
+
+    One index lookup per fingerprint, however many expenses the months hold.
+    """
+    if not fingerprints:
+        return {}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(FIND_DUPLICATES_SQL, {"household": current_household(), "fingerprints": list(set(fingerprints))})
+            return {r["fingerprint"]: r["n"] for r in cur.fetchall()}
+
+def _expense_from_row(r: Dict[str, Any]) -> Expense:
+    """Shapes a row selected with split_users/split_shares arrays into an Expense."""
+    return {
+        "id": r["id"],
+        "spent_at": str(r["spent_at"]),
+        "amount_cents": r["amount_cents"],
+        "amount": r["amount_cents"] / 100.0,
+        "payer_user_id": r["payer_user_id"],
+        "category": r["category"],
+        "description": r["description"],
+        "split_bp": dict(zip(r["split_users"] or (), r["split_shares"] or ())),
+        "is_duplicate": r["is_duplicate"],
+    }
+
+@traced
+def list_expenses_month(month_yyyy_mm: str) -> List[Expense]:
+    """Lists all expenses for a given month (YYYY-MM), cached per month."""
+    snapshot = get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return snapshot["expenses"]
+    start, end = _month_bounds(month_yyyy_mm)
+
+    def load() -> List[Expense]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(LIST_EXPENSES_MONTH_SQL, {"household": current_household(), "start": start, "end": end})
+                rows = cur.fetchall()
+
+        return [_expense_from_row(r) for r in rows]
+    return cache.get_or_load(_key("month", month_yyyy_mm, "expenses"), load)
+
+def _expenses_page_query(
+    month_yyyy_mm: str,
+    page_size: int,
+    after: Optional[Tuple[str, int]]
+) -> Tuple[str, Dict[str, Any], Tuple]:
+    """Returns (sql, params, cache key) for one page of list_expenses_page."""
+    start, end = _month_bounds(month_yyyy_mm)
+    # One extra row tells whether another page exists.
+    params: Dict[str, Any] = {"household": current_household(), "start": start, "end": end, "limit": page_size + 1}
+    if after is None:
+        sql = LIST_EXPENSES_FIRST_PAGE_SQL
+    else:
+        sql = LIST_EXPENSES_NEXT_PAGE_SQL
+        params["after_date"], params["after_id"] = date.fromisoformat(after[0]), after[1]
+    key = _key("month", month_yyyy_mm, "page", page_size, tuple(after) if after else None)
+    return sql, params, key
+
+def _expenses_page_from_rows(rows: List[Dict[str, Any]], page_size: int) -> ExpensePage:
+    return _expense_page([_expense_from_row(r) for r in rows], page_size)
 
-    return [
-        {
-            **r,
-            "spent_at": str(r["spent_at"]),
-            "amount": r["amount_cents"] / 100.0
-        }
-        for r in rows
-    ]
+def _snapshot_page(expenses: List[Expense], page_size: int, after: Optional[Tuple[str, int]]) -> ExpensePage:
+    """A page of a snapshot's expenses, with list_expenses_page's cursors."""
+    if after is not None:
+        expenses = [e for e in expenses if (e["spent_at"], e["id"]) < (after[0], after[1])]
+    return _expense_page(expenses[:page_size + 1], page_size)
 
-def add_settlement(month: str, from_user_id: int, to_user_id: int, amount_cents: int) -> None:
-    """Registers a monthly settlement."""
+def _expense_page(expenses: List[Expense], page_size: int) -> ExpensePage:
+    """Up to page_size + 1 expenses -> a page; the extra one means there is a next page."""
+    has_more = len(expenses) > page_size
+    expenses = expenses[:page_size]
+    next_cursor = (expenses[-1]["spent_at"], expenses[-1]["id"]) if has_more else None
+    return {"rows": expenses, "next_cursor": next_cursor}
+
+@traced
+def list_expenses_page(
+    month_yyyy_mm: str,
+    page_size: int = EXPENSES_PAGE_SIZE,
+    after: Optional[Tuple[str, int]] = None
+) -> ExpensePage:
+    """Lists one page of a month's expenses, newest first (cached per page).
+
+    Pass the previous page's `next_cursor` as `after` to get the next page.
+    """
+    snapshot = get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return _snapshot_page(snapshot["expenses"], page_size, after)
+    sql, params, key = _expenses_page_query(month_yyyy_mm, page_size, after)
+
+    def load() -> ExpensePage:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+        return _expenses_page_from_rows(rows, page_size)
+    return cache.get_or_load(key, load)
+
+@traced
+def get_month_totals(month_yyyy_mm: str, user_a_id: int, user_b_id: int) -> MonthTotals:
+    """Returns a month's totals in integer cents (cached per month).
+
+    Reads the month_summaries tables kept up to date by every expense write,
+    so the cost doesn't depend on how many expenses the month has. Quotas sum
+    the stored shares (writes always store one per user) in cents x basis
+    points and are rounded to whole cents once, half away from zero, like
+    logic.compute_month_summary. Pair it with logic.summary_from_cents.
+    """
+    snapshot = get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return _month_totals_from_balances(snapshot["balances"], user_a_id, user_b_id)
+
+    def load() -> MonthTotals:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    MONTH_TOTALS_SQL,
+                    {"household": current_household(), "a": user_a_id, "b": user_b_id, "month": month_yyyy_mm}
+                )
+                return cur.fetchone()
+    return cache.get_or_load(_key("month", month_yyyy_mm, "totals", user_a_id, user_b_id), load)
+
+@traced
+def get_month_balances(month_yyyy_mm: str) -> MonthBalances:
+    """Returns every user's paid and quota for a month in integer cents (cached per month).
+
+    Reads the month_summaries tables like get_month_totals, so the cost
+    grows with the number of members, not of expenses. Pair it with
+    logic.household_summary.
+    """
+    snapshot = get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return snapshot["balances"]
+
+    def load() -> MonthBalances:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(MONTH_BALANCES_SQL, {"household": current_household(), "month": month_yyyy_mm})
+                return _month_balances_from_rows(cur.fetchall())
+    return cache.get_or_load(_key("month", month_yyyy_mm, "balances"), load)
+
+def _month_balances_from_rows(rows: List[Dict[str, Any]]) -> MonthBalances:
+    """Builds MonthBalances from rows shaped like MONTH_BALANCES_SQL's output."""
+    users = [r for r in rows if r["user_id"] is not None]
+    return {
+        "expense_count": rows[0]["expense_count"] if rows else 0,
+        "total_cents": rows[0]["total_cents"] if rows else 0,
+        "paid_cents": {r["user_id"]: r["paid_cents"] for r in users},
+        "quota_cents": {r["user_id"]: r["quota_cents"] for r in users},
+    }
+
+def _month_totals_from_balances(balances: MonthBalances, user_a_id: int, user_b_id: int) -> MonthTotals:
+    return {
+        "expense_count": balances["expense_count"],
+        "total_cents": balances["total_cents"],
+        "paid_a_cents": balances["paid_cents"].get(user_a_id, 0),
+        "paid_b_cents": balances["paid_cents"].get(user_b_id, 0),
+        "quota_a_cents": balances["quota_cents"].get(user_a_id, 0),
+        "quota_b_cents": balances["quota_cents"].get(user_b_id, 0),
+    }
+
+def _months_between(start_month: str, end_month: str) -> List[str]:
+    """Lists every YYYY-MM from start_month to end_month, inclusive."""
+    year, month = map(int, start_month.split("-"))
+    months = []
+    while f"{year:04d}-{month:02d}" <= end_month:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+@traced
+def get_range_report(start_month: str, end_month: str) -> RangeReport:
+    """Per-month and per-category totals, balances and running carry-over for
+    an arbitrary range of months (YYYY-MM, inclusive), from a single query.
+
+    The carry-over starts at zero at `start_month`. Cached per range;
+    any expense or settlement write drops every cached report.
+    """
+    start, _ = _month_bounds(start_month)
+    _, end = _month_bounds(end_month)
+
+    def load() -> RangeReport:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RANGE_REPORT_SQL, {
+                    "household": current_household(),
+                    "start": start, "end": end, "start_month": start_month, "end_month": end_month
+                })
+                return _range_report_from_rows(start_month, end_month, cur.fetchall())
+    return cache.get_or_load(_key("report", start_month, end_month), load)
+
+def _range_report_from_rows(start_month: str, end_month: str, rows: Iterable[Dict[str, Any]]) -> RangeReport:
+    """Builds a RangeReport from rows shaped like RANGE_REPORT_SQL's output."""
+    months: Dict[str, MonthReport] = {
+        m: {"month": m, "expense_count": 0, "total_cents": 0, "paid_cents": {}, "quota_cents": {},
+            "balance_cents": {}, "settled_cents": {}, "carry_cents": {}}
+        for m in _months_between(start_month, end_month)
+    }
+    quota_bp: Dict[str, Dict[int, int]] = {m: {} for m in months}
+    category_by_month: Dict[str, Dict[str, int]] = {}
+    for r in rows:
+        m, user_id = months[r["month"]], r["user_id"]
+        if r["kind"] == "settlement":
+            m["settled_cents"][user_id] = m["settled_cents"].get(user_id, 0) + r["settled_cents"]
+            continue
+        # Every expense contributes exactly one payer row, so summing the
+        # paid side gives the month and category totals.
+        m["expense_count"] += r["expense_count"]
+        m["total_cents"] += r["paid_cents"]
+        m["paid_cents"][user_id] = m["paid_cents"].get(user_id, 0) + r["paid_cents"]
+        q = quota_bp[r["month"]]
+        q[user_id] = q.get(user_id, 0) + r["quota_bp_cents"]
+        by_month = category_by_month.setdefault(r["category"], {})
+        by_month[r["month"]] = by_month.get(r["month"], 0) + r["paid_cents"]
+
+    carry: Dict[int, int] = {}
+    for month_key, m in months.items():
+        for user_id, bp in quota_bp[month_key].items():
+            m["quota_cents"][user_id] = _round_bp(bp)
+        for user_id in set(m["paid_cents"]) | set(m["quota_cents"]) | set(m["settled_cents"]):
+            balance = m["paid_cents"].get(user_id, 0) - m["quota_cents"].get(user_id, 0)
+            m["balance_cents"][user_id] = balance
+            carry[user_id] = carry.get(user_id, 0) + balance + m["settled_cents"].get(user_id, 0)
+        m["carry_cents"] = dict(carry)
+
+    return {
+        "start_month": start_month,
+        "end_month": end_month,
+        "months": list(months.values()),
+        "category_totals": {c: sum(v.values()) for c, v in category_by_month.items()},
+        "category_by_month": category_by_month,
+    }
+
+# Every expense in date order with its shares aligned to %(users)s, for the
+# export. {where} adds the optional date and category filters.
+_STREAM_EXPENSES_SQL = """
+    SELECT e.id, e.spent_at, e.amount_cents, e.payer_user_id, c.name, COALESCE(e.description, ''),
+           ARRAY(SELECT s.share_bp
+                 FROM unnest(%(users)s::int[]) WITH ORDINALITY AS u(id, ord)
+                 LEFT JOIN expense_splits s ON s.expense_id = e.id AND s.user_id = u.id
+                 ORDER BY u.ord)
+    FROM expenses e
+    JOIN categories c ON c.id = e.category_id
+    WHERE e.household_id = %(household)s {where}
+    ORDER BY e.spent_at, e.id;
+"""
+
+def stream_expenses(
+    user_ids: List[int],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[Tuple]]:
+    """Yields expenses oldest first, in batches of plain tuples
+    (id, spent_at, amount_cents, payer_user_id, category, description, shares),
+    shares aligned with `user_ids` (None where a user has no share row).
+
+    Rows come through a server-side cursor, so only one batch is in memory
+    however long the history is. Dates are inclusive; None means unbounded.
+    """
+    from psycopg.rows import tuple_row
+    where = ""
+    params: Dict[str, Any] = {"household": current_household(), "users": list(user_ids)}
+    if start_date:
+        where += " AND e.spent_at >= %(start)s"
+        params["start"] = start_date
+    if end_date:
+        where += " AND e.spent_at <= %(end)s"
+        params["end"] = end_date
+    if categories:
+        where += " AND c.name = ANY(%(categories)s)"
+        params["categories"] = list(categories)
+    with get_connection() as conn:
+        with conn.cursor(name="stream_expenses", row_factory=tuple_row) as cur:
+            cur.itersize = batch_size
+            cur.execute(_STREAM_EXPENSES_SQL.format(where=where), params)
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+
+@traced
+def record_settlements(month: str, transfers: List[Tuple[int, int, int]]) -> None:
+    """Registers a month's settlement as (from_user_id, to_user_id, amount_cents)
+    transfers, replacing any recorded before for that month, and closes the
+    month: its balances and expense list are frozen in month_snapshots, the
+    month's reads come from there, and expense writes to it raise
+    MonthClosedError. Recording again refreshes the snapshot."""
+    household, now = current_household(), datetime.utcnow()
     with get_connection() as conn:
         with conn.cursor() as cur:
+            params = {"household": household, "month": month}
+            cur.execute(_LOCK_MONTH_SQL, params)
+            start, end = _month_bounds(month)
+            cur.execute(MONTH_BALANCES_SQL, params)
+            balances = _month_balances_from_rows(cur.fetchall())
+            cur.execute(LIST_EXPENSES_MONTH_SQL, {"household": household, "start": start, "end": end})
+            expenses = [_expense_from_row(r) for r in cur.fetchall()]
+            cur.execute(_SAVE_MONTH_SNAPSHOT_SQL, {
+                **params, "closed_at": now, "balances": Jsonb(balances), "expenses": Jsonb(expenses),
+            })
             cur.execute(
-                """INSERT INTO settlements(month, from_user_id, to_user_id, amount_cents, paid_at)
-                   VALUES (%s, %s, %s, %s, %s)
-                   ON CONFLICT(month) DO UPDATE SET
-                   from_user_id=EXCLUDED.from_user_id,
-                   to_user_id=EXCLUDED.to_user_id,
-                   amount_cents=EXCLUDED.amount_cents,
-                   paid_at=EXCLUDED.paid_at;""",
-                (month, from_user_id, to_user_id, amount_cents, datetime.utcnow())
+                """DELETE FROM settlements WHERE household_id=%s AND month=%s
+                   RETURNING from_user_id, to_user_id, amount_cents;""",
+                (household, month)
             )
+            replaced = [(r["from_user_id"], r["to_user_id"], r["amount_cents"]) for r in cur.fetchall()]
+            cur.executemany(
+                """INSERT INTO settlements(household_id, month, from_user_id, to_user_id, amount_cents, paid_at)
+                   VALUES (%s, %s, %s, %s, %s, %s);""",
+                [(household, month, from_id, to_id, cents, now) for from_id, to_id, cents in transfers]
+            )
+            today = now.date().isoformat()
+            _append_ledger(cur, settlement_ledger_deltas(month, replaced, today, -1)
+                           + settlement_ledger_deltas(month, transfers, today))
         conn.commit()
+    cache.invalidate(_key("settlements", month), _key("balances"))
+    cache.invalidate_prefix(_key("month", month))
+    cache.invalidate_prefix(_key("report"))
+
+def _month_snapshot_from_json(month: str, closed_at: Any, balances: Dict[str, Any],
+                              expenses: List[Dict[str, Any]]) -> MonthSnapshot:
+    """Rebuilds a MonthSnapshot from its JSON columns (object keys are strings there)."""
+    return {
+        "month": month,
+        "closed_at": str(closed_at),
+        "balances": {
+            "expense_count": balances["expense_count"],
+            "total_cents": balances["total_cents"],
+            "paid_cents": {int(u): c for u, c in balances["paid_cents"].items()},
+            "quota_cents": {int(u): c for u, c in balances["quota_cents"].items()},
+        },
+        "expenses": [{**e, "split_bp": {int(u): bp for u, bp in e["split_bp"].items()}} for e in expenses],
+    }
+
+@traced
+def get_month_snapshot(month: str) -> Optional[MonthSnapshot]:
+    """The frozen copy of a closed month, or None while it is open (cached)."""
+    def load() -> Optional[MonthSnapshot]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(GET_MONTH_SNAPSHOT_SQL, {"household": current_household(), "month": month})
+                r = cur.fetchone()
+        return r and _month_snapshot_from_json(r["month"], r["closed_at"], r["balances"], r["expenses"])
+    return cache.get_or_load(_key("month", month, "snapshot"), load)
+
+@traced
+def get_settlements(month: str) -> List[Settlement]:
+    """Retrieves the settlement transfers of a month (cached)."""
+    def load() -> List[Settlement]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(GET_SETTLEMENTS_SQL, {"household": current_household(), "month": month})
+                return [_settlement_from_row(r) for r in cur.fetchall()]
+    return cache.get_or_load(_key("settlements", month), load)
 
-def get_settlement(month: str) -> Optional[Settlement]:
-    """Retrieves settlement info for a month."""
+def _settlement_from_row(r: Dict[str, Any]) -> Settlement:
+    return {
+        "month": r["month"],
+        "from_user_id": r["from_user_id"],
+        "to_user_id": r["to_user_id"],
+        "amount": r["amount_cents"] / 100.0,
+        "paid_at": r["paid_at"].isoformat() if r["paid_at"] else None
+    }
+
+@traced
+def get_balances(as_of: Optional[datetime] = None) -> Dict[int, int]:
+    """Every member's running balance in cents across all months: paid -
+    quota, plus Fechamento transfers sent, minus those received. Positive
+    means the household owes them.
+
+    Read from the ledger, so the cost doesn't grow with the history. With
+    `as_of` (UTC), the balances as the ledger stood at that moment; only
+    the current ones are cached.
+    """
+    def load() -> Dict[int, int]:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if as_of is None:
+                    cur.execute(BALANCES_SQL, {"household": current_household()})
+                else:
+                    cur.execute(BALANCES_AS_OF_SQL, {"household": current_household(), "as_of": as_of})
+                return {r["user_id"]: r["balance_cents"] for r in cur.fetchall()}
+    if as_of is not None:
+        return load()
+    return cache.get_or_load(_key("balances"), load)
+
+@traced
+def rebuild_ledger() -> int:
+    """Replays the household's ledger from its expenses and settlements,
+    replacing what was there; returns the number of entries written.
+
+    Repair tool: every write appends to the ledger on its own.
+    """
+    params = {"household": current_household()}
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT month, from_user_id, to_user_id, amount_cents, paid_at FROM settlements WHERE month=%s;",
-                (month,)
-            )
-            r = cur.fetchone()
-            if not r:
-                return None
-            return {
-                "month": r["month"],
-                "from_user_id": r["from_user_id"],
-                "to_user_id": r["to_user_id"],
-                "amount": r["amount_cents"] / 100.0,
-                "paid_at": r["paid_at"].isoformat() if r["paid_at"] else None
-            }
+            cur.execute("DELETE FROM ledger_entries WHERE household_id = %(household)s;", params)
+            cur.execute("DELETE FROM user_balances WHERE household_id = %(household)s;", params)
+            cur.execute(_REPLAY_LEDGER_SQL.format(where="household_id = %(household)s"), params)
+            written = cur.rowcount
+            cur.execute(_REPLAY_USER_BALANCES_SQL.format(where="household_id = %(household)s"), params)
+        conn.commit()
+    cache.invalidate(_key("balances"))
+    return written
 
+@traced
 def update_expense(
     expense_id: int,
     amount_cents: int,
@@ -219,22 +1232,59 @@ def update_expense(
     category: str,
     description: str,
     spent_at: str,
-    split_json: str
+    split_bp: Dict[int, int]
 ) -> None:
-    """Updates an existing expense."""
+    """Updates an existing expense (and replaces its split)."""
+    fingerprint = expense_fingerprint(spent_at, amount_cents, payer_user_id, description)
     with get_connection() as conn:
         with conn.cursor() as cur:
+            # Self-join so RETURNING sees the pre-update values: an edit may move
+            # the expense to another month, and both months' summaries change.
+            category_id = _category_ids(cur, [category])[category]
             cur.execute(
-                """UPDATE expenses 
-                   SET amount_cents=%s, payer_user_id=%s, category=%s, description=%s, spent_at=%s, split_json=%s
-                   WHERE id=%s;""",
-                (amount_cents, payer_user_id, category, description, spent_at, split_json, expense_id)
+                """UPDATE expenses e
+                   SET amount_cents=%s, payer_user_id=%s, category_id=%s, description=%s, spent_at=%s, fingerprint=%s
+                   FROM expenses old
+                   WHERE e.id=%s AND e.household_id=%s AND old.id=e.id
+                   RETURNING old.spent_at AS old_spent_at, old.amount_cents AS old_amount_cents,
+                             old.payer_user_id AS old_payer_user_id;""",
+                (amount_cents, payer_user_id, category_id, description, spent_at, fingerprint, expense_id,
+                 current_household())
             )
+            old = cur.fetchone()
+            if old:
+                old_split = _read_splits(cur, expense_id)
+                _apply_summary_delta(cur, old["old_spent_at"], -1, old["old_amount_cents"],
+                                     old["old_payer_user_id"], old_split)
+                _write_splits(cur, expense_id, split_bp)
+                _apply_summary_delta(cur, spent_at, 1, amount_cents, payer_user_id, split_bp)
+                _check_months_open(cur, [_month_of(old["old_spent_at"]), _month_of(spent_at)])
+                # The ledger is append-only: take the old version back, add the new one.
+                _append_ledger(cur, expense_ledger_deltas(
+                    expense_id, old["old_spent_at"], old["old_amount_cents"], old["old_payer_user_id"], old_split, -1
+                ) + expense_ledger_deltas(expense_id, spent_at, amount_cents, payer_user_id, split_bp))
         conn.commit()
+    _invalidate_months([_month_of(spent_at)] + ([_month_of(old["old_spent_at"])] if old else []))
 
+@traced
 def delete_expense(expense_id: int) -> None:
     """Deletes an expense from the database."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM expenses WHERE id=%s;", (expense_id,))
+            # Splits go with the expense (ON DELETE CASCADE): read them first.
+            split = _read_splits(cur, expense_id)
+            cur.execute(
+                "DELETE FROM expenses WHERE id=%s AND household_id=%s RETURNING spent_at, amount_cents, payer_user_id;",
+                (expense_id, current_household())
+            )
+            deleted = cur.fetchone()
+            if deleted:
+                _apply_summary_delta(cur, deleted["spent_at"], -1, deleted["amount_cents"],
+                                     deleted["payer_user_id"], split)
+                _check_months_open(cur, [_month_of(deleted["spent_at"])])
+                _append_ledger(cur, expense_ledger_deltas(
+                    expense_id, deleted["spent_at"], deleted["amount_cents"], deleted["payer_user_id"], split, -1
+                ))
         conn.commit()
+    if deleted:
+        _invalidate_months([_month_of(deleted["spent_at"])])
@@ -0,0 +1,222 @@
+"""
+Asyncio counterpart of the read path of src.database.
+
+A page render needs several independent reads (users, categories, month
+balances, a page of expenses, the settlement transfers). Done one after the other, the
+render waits for the sum of their round trips; here they run concurrently on
+an AsyncConnectionPool so it waits for the slowest one only.
+
+The statements, row shaping and cache keys are the ones src.database uses,
+so both layers share the same cache entries and the writes in src.database
+keep invalidating them. Tasks run with the caller's context, household
+(src.tenancy) included.
+
+Streamlit scripts are synchronous: the *_sync wrappers submit the coroutine
+to one long-lived event loop running in a background thread (the async pool
+is bound to that loop) and block until it finishes.
+"""
+import asyncio
+import atexit
+import contextvars
+import threading
+from typing import Any, Awaitable, List, Optional, Tuple, TypeVar
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from src.cache import cache
+from src.diagnostics import traced
+from src.tenancy import current_household
+from src.pool import (
+    TimedAsyncCursor,
+    timed_async_connection,
+    database_url,
+    POOL_MIN_SIZE,
+    POOL_MAX_SIZE,
+    POOL_TIMEOUT,
+    POOL_MAX_IDLE,
+    POOL_MAX_LIFETIME,
+    POOL_CHECK,
+)
+from src.database import (
+    User,
+    ExpensePage,
+    MonthBalances,
+    MonthSnapshot,
+    Settlement,
+    MonthView,
+    EXPENSES_PAGE_SIZE,
+    LIST_USERS_SQL,
+    LIST_CATEGORIES_SQL,
+    MONTH_BALANCES_SQL,
+    GET_SETTLEMENTS_SQL,
+    GET_MONTH_SNAPSHOT_SQL,
+    _key,
+    _expenses_page_query,
+    _expenses_page_from_rows,
+    _month_balances_from_rows,
+    _month_snapshot_from_json,
+    _settlement_from_row,
+    _snapshot_page,
+)
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool: Optional[AsyncConnectionPool] = None
+_loop_lock = threading.Lock()
+
+async def _open_pool() -> AsyncConnectionPool:
+    pool = AsyncConnectionPool(
+        database_url(),
+        min_size=POOL_MIN_SIZE,
+        max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+        timeout=POOL_TIMEOUT,
+        max_idle=POOL_MAX_IDLE,
+        max_lifetime=POOL_MAX_LIFETIME,
+        kwargs={"row_factory": dict_row, "cursor_factory": TimedAsyncCursor},
+        check=AsyncConnectionPool.check_connection if POOL_CHECK else None,
+        name="casa-split-async",
+        open=False,
+    )
+    await pool.open()
+    return pool
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Starts the background event loop and opens the async pool on first use."""
+    global _loop, _pool
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                if not database_url():
+                    raise RuntimeError("DATABASE_URL não definida. Configure no seu ambiente.")
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="casa-split-db-async", daemon=True).start()
+                _pool = asyncio.run_coroutine_threadsafe(_open_pool(), loop).result()
+                _loop = loop
+                atexit.register(close)
+    return _loop
+
+def _get_pool() -> AsyncConnectionPool:
+    _get_loop()
+    return _pool
+
+async def _in_context(context: contextvars.Context, coro: Awaitable[T]) -> T:
+    # The task runs on the loop thread; carry the caller's context variables
+    # (current rerun for src.diagnostics, ...) over to it.
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+def run(coro: Awaitable[T]) -> T:
+    """Runs a coroutine of this module from synchronous code and returns its result."""
+    return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), _get_loop()).result()
+
+def close() -> None:
+    """Closes the async pool and stops the background loop (safe to call more than once)."""
+    global _loop, _pool
+    with _loop_lock:
+        if _loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(_pool.close(), _loop).result()
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop, _pool = None, None
+
+async def _fetch(sql: str, params: Any = None, one: bool = False) -> Any:
+    async with timed_async_connection(_get_pool()) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone() if one else await cur.fetchall()
+
+@traced
+async def get_users() -> List[User]:
+    """Returns a list of all users (cached)."""
+    return await cache.get_or_load_async(_key("users"), lambda: _fetch(LIST_USERS_SQL, {"household": current_household()}))
+
+@traced
+async def get_categories() -> List[str]:
+    """Returns a list of all category names (cached)."""
+    async def load() -> List[str]:
+        return [r["name"] for r in await _fetch(LIST_CATEGORIES_SQL, {"household": current_household()})]
+    return await cache.get_or_load_async(_key("categories"), load)
+
+@traced
+async def get_month_snapshot(month: str) -> Optional[MonthSnapshot]:
+    """The frozen copy of a closed month, or None while it is open (cached)."""
+    async def load() -> Optional[MonthSnapshot]:
+        r = await _fetch(GET_MONTH_SNAPSHOT_SQL, {"household": current_household(), "month": month}, one=True)
+        return r and _month_snapshot_from_json(r["month"], r["closed_at"], r["balances"], r["expenses"])
+    return await cache.get_or_load_async(_key("month", month, "snapshot"), load)
+
+@traced
+async def get_month_balances(month_yyyy_mm: str) -> MonthBalances:
+    """Returns every user's paid and quota for a month in integer cents (cached per month)."""
+    snapshot = await get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return snapshot["balances"]
+
+    async def load() -> MonthBalances:
+        return _month_balances_from_rows(
+            await _fetch(MONTH_BALANCES_SQL, {"household": current_household(), "month": month_yyyy_mm})
+        )
+    return await cache.get_or_load_async(_key("month", month_yyyy_mm, "balances"), load)
+
+@traced
+async def list_expenses_page(
+    month_yyyy_mm: str,
+    page_size: int = EXPENSES_PAGE_SIZE,
+    after: Optional[Tuple[str, int]] = None
+) -> ExpensePage:
+    """Lists one page of a month's expenses, newest first (cached per page)."""
+    snapshot = await get_month_snapshot(month_yyyy_mm)
+    if snapshot is not None:
+        return _snapshot_page(snapshot["expenses"], page_size, after)
+    sql, params, key = _expenses_page_query(month_yyyy_mm, page_size, after)
+
+    async def load() -> ExpensePage:
+        return _expenses_page_from_rows(await _fetch(sql, params), page_size)
+    return await cache.get_or_load_async(key, load)
+
+@traced
+async def get_settlements(month: str) -> List[Settlement]:
+    """Retrieves the settlement transfers of a month (cached)."""
+    async def load() -> List[Settlement]:
+        return [_settlement_from_row(r) for r in
+                await _fetch(GET_SETTLEMENTS_SQL, {"household": current_household(), "month": month})]
+    return await cache.get_or_load_async(_key("settlements", month), load)
+
+async def load_month_view(
+    month_yyyy_mm: str,
+    page_size: int = EXPENSES_PAGE_SIZE,
+    after: Optional[Tuple[str, int]] = None
+) -> MonthView:
+    """Loads everything the "Resumo do mês" page shows, with the queries in flight together."""
+    async def month_data() -> Tuple[MonthBalances, ExpensePage, Optional[MonthSnapshot]]:
+        # Snapshot first: a closed month's balances and page then come from it.
+        snapshot = await get_month_snapshot(month_yyyy_mm)
+        balances, page = await asyncio.gather(
+            get_month_balances(month_yyyy_mm),
+            list_expenses_page(month_yyyy_mm, page_size, after),
+        )
+        return balances, page, snapshot
+
+    users, categories, (balances, page, snapshot), settlements = await asyncio.gather(
+        get_users(),
+        get_categories(),
+        month_data(),
+        get_settlements(month_yyyy_mm),
+    )
+    return {
+        "users": users,
+        "categories": categories,
+        "balances": balances,
+        "page": page,
+        "settlements": settlements,
+        "closed_at": snapshot["closed_at"] if snapshot else None,
+    }
+
+def load_month_view_sync(
+    month_yyyy_mm: str,
+    page_size: int = EXPENSES_PAGE_SIZE,
+    after: Optional[Tuple[str, int]] = None
+) -> MonthView:
+    """Blocking wrapper around load_month_view for the Streamlit script."""
+    return run(load_month_view(month_yyyy_mm, page_size, after))
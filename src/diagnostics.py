@@ -0,0 +1,221 @@
+"""
+Per-query timing for the data layer.
+
+Every statement that goes through an instrumented cursor (src.pool,
+src.database_async, src.sqlite_storage) is recorded with its SQL, wall time,
+rows and, for the first statement on a freshly borrowed connection, how long
+the borrow took. Records carry the data-access function that issued them
+(see `traced`) and the Streamlit rerun they belong to (see `begin_rerun`).
+
+Everything is kept in memory in bounded ring buffers, so the cost is a few
+microseconds per statement and memory stays flat. Set DIAGNOSTICS_LOG to a
+file path to also append every record there as one JSON object per line.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, TypedDict, TypeVar
+
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "1") not in ("0", "false", "False", "")
+DIAGNOSTICS_MAX_QUERIES = int(os.getenv("DIAGNOSTICS_MAX_QUERIES", "2000"))
+DIAGNOSTICS_MAX_RERUNS = int(os.getenv("DIAGNOSTICS_MAX_RERUNS", "200"))
+DIAGNOSTICS_LOG = os.getenv("DIAGNOSTICS_LOG", "")
+
+# Long statements (DDL, the range report) are cut to keep the buffer small.
+SQL_MAX_CHARS = 500
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+class QueryRecord(TypedDict):
+    at: float
+    # 0 for statements outside a rerun (bootstrap at import, CLI tools)
+    rerun_id: int
+    page: str
+    # Data-access function that issued the statement ("" if untraced)
+    function: str
+    sql: str
+    duration_ms: float
+    # Rows returned (SELECT) or affected; -1 when the driver doesn't say
+    rows: int
+    # Time spent borrowing the connection, on its first statement only
+    acquire_ms: float
+
+class RerunRecord(TypedDict):
+    rerun_id: int
+    page: str
+    started_at: float
+    queries: int
+    connections: int
+    db_ms: float
+
+_queries: Deque[QueryRecord] = deque(maxlen=DIAGNOSTICS_MAX_QUERIES)
+_reruns: Deque[RerunRecord] = deque(maxlen=DIAGNOSTICS_MAX_RERUNS)
+_lock = threading.Lock()
+_rerun_ids = itertools.count(1)
+
+_current_rerun: contextvars.ContextVar[Optional[RerunRecord]] = contextvars.ContextVar("rerun", default=None)
+_current_function: contextvars.ContextVar[str] = contextvars.ContextVar("function", default="")
+_pending_acquire_ms: contextvars.ContextVar[float] = contextvars.ContextVar("acquire_ms", default=0.0)
+
+def begin_rerun(page: str = "") -> int:
+    """Starts grouping the statements of this thread/task under a new rerun."""
+    rerun: RerunRecord = {
+        "rerun_id": next(_rerun_ids), "page": page, "started_at": time.time(),
+        "queries": 0, "connections": 0, "db_ms": 0.0,
+    }
+    _current_rerun.set(rerun)
+    with _lock:
+        _reruns.append(rerun)
+    return rerun["rerun_id"]
+
+def set_page(page: str) -> None:
+    """Names the page of the current rerun once it is known."""
+    rerun = _current_rerun.get()
+    if rerun is not None:
+        rerun["page"] = page
+
+def current_rerun() -> Optional[RerunRecord]:
+    return _current_rerun.get()
+
+def traced(fn: F) -> F:
+    """Attributes the statements run inside `fn` to it.
+
+    The outermost traced call wins, so a helper called from a public
+    function is reported under the public one.
+    """
+    name = fn.__name__
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            if _current_function.get():
+                return await fn(*args, **kwargs)
+            token = _current_function.set(name)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _current_function.reset(token)
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current_function.get():
+            return fn(*args, **kwargs)
+        token = _current_function.set(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_function.reset(token)
+    return wrapper  # type: ignore[return-value]
+
+def record_acquire(seconds: float) -> None:
+    """Called when a connection is borrowed; its wait goes on the next statement."""
+    if not DIAGNOSTICS_ENABLED:
+        return
+    _pending_acquire_ms.set(seconds * 1000)
+    rerun = _current_rerun.get()
+    if rerun is not None:
+        with _lock:
+            rerun["connections"] += 1
+
+def record_query(sql: Any, seconds: float, rows: int) -> Optional[QueryRecord]:
+    """Appends one statement to the buffer (and to DIAGNOSTICS_LOG if set)."""
+    if not DIAGNOSTICS_ENABLED:
+        return None
+    rerun = _current_rerun.get()
+    acquire_ms = _pending_acquire_ms.get()
+    if acquire_ms:
+        _pending_acquire_ms.set(0.0)
+    record: QueryRecord = {
+        "at": time.time(),
+        "rerun_id": rerun["rerun_id"] if rerun else 0,
+        "page": rerun["page"] if rerun else "",
+        "function": _current_function.get(),
+        "sql": " ".join(str(sql).split())[:SQL_MAX_CHARS],
+        "duration_ms": seconds * 1000,
+        "rows": rows if rows is not None else -1,
+        "acquire_ms": acquire_ms,
+    }
+    with _lock:
+        _queries.append(record)
+        if rerun is not None:
+            rerun["queries"] += 1
+            rerun["db_ms"] += record["duration_ms"]
+        if DIAGNOSTICS_LOG:
+            with open(DIAGNOSTICS_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return record
+
+def queries(rerun_id: Optional[int] = None) -> List[QueryRecord]:
+    """Buffered statements, oldest first (only those of `rerun_id` if given)."""
+    with _lock:
+        items = list(_queries)
+    return [q for q in items if rerun_id is None or q["rerun_id"] == rerun_id]
+
+def reruns() -> List[RerunRecord]:
+    with _lock:
+        return [dict(r) for r in _reruns]  # type: ignore[misc]
+
+def clear() -> None:
+    with _lock:
+        _queries.clear()
+        _reruns.clear()
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))]
+
+def slowest_queries(n: int = 10) -> List[QueryRecord]:
+    return sorted(queries(), key=lambda q: q["duration_ms"], reverse=True)[:n]
+
+def latency_by_function() -> List[Dict[str, Any]]:
+    """count / p50 / p95 / max statement time per data-access function, slowest p95 first."""
+    by_function: Dict[str, List[float]] = {}
+    for q in queries():
+        by_function.setdefault(q["function"] or "(outro)", []).append(q["duration_ms"])
+    stats = []
+    for function, values in by_function.items():
+        values.sort()
+        stats.append({
+            "function": function,
+            "count": len(values),
+            "p50_ms": _percentile(values, 0.50),
+            "p95_ms": _percentile(values, 0.95),
+            "max_ms": values[-1],
+        })
+    return sorted(stats, key=lambda s: s["p95_ms"], reverse=True)
+
+def queries_by_page() -> List[Dict[str, Any]]:
+    """Statements and connections per rerun, summarized per page."""
+    by_page: Dict[str, List[RerunRecord]] = {}
+    for r in reruns():
+        by_page.setdefault(r["page"] or "(início)", []).append(r)
+    stats = []
+    for page, items in by_page.items():
+        counts = [r["queries"] for r in items]
+        stats.append({
+            "page": page,
+            "reruns": len(items),
+            "median_queries": statistics.median(counts),
+            "max_queries": max(counts),
+            "median_connections": statistics.median(r["connections"] for r in items),
+            "median_db_ms": statistics.median(r["db_ms"] for r in items),
+        })
+    return sorted(stats, key=lambda s: s["max_queries"], reverse=True)
+
+def to_jsonl() -> str:
+    """The buffered statements as JSON lines."""
+    return "".join(json.dumps(q, ensure_ascii=False) + "\n" for q in queries())
+
+def export_jsonl(path: str) -> int:
+    """Writes the buffered statements to `path`, one JSON object per line."""
+    items = queries()
+    with open(path, "w", encoding="utf-8") as f:
+        for q in items:
+            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    return len(items)
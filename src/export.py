@@ -0,0 +1,130 @@
+"""
+Streams the expense history out to CSV or Parquet.
+
+Rows come from Storage.stream_expenses in fixed-size batches (a server-side
+cursor on Postgres) and each batch is written before the next one is read,
+so memory stays flat whatever the size of the history. Parquet needs
+pyarrow, which is imported only when that format is asked for.
+
+    python -m src.export gastos.csv
+    python -m src.export gastos.parquet --from 2024-01-01 --to 2024-12-31 --category Mercado Contas
+"""
+import argparse
+import csv
+import os
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from src.database import EXPORT_BATCH_SIZE, User
+
+FORMATS = ("csv", "parquet")
+
+def columns(users: List[User]) -> List[str]:
+    """Output columns: the expense fields, then one share column per user."""
+    return ["id", "spent_at", "amount_cents", "amount", "payer", "category", "description"] + [
+        f"share_bp_{u['name']}" for u in users
+    ]
+
+def _amount(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+def _spent_at(value: Any) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+def write_csv(batches: Iterator[List[Tuple]], path: str, users: List[User]) -> int:
+    """Writes the batches as CSV (amounts with a dot, dates ISO). Returns the row count."""
+    names = {u["id"]: u["name"] for u in users}
+    count = 0
+    # utf-8-sig: spreadsheets then read the accents right.
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns(users))
+        for batch in batches:
+            writer.writerows(
+                (expense_id, _spent_at(spent_at).isoformat(), cents, _amount(cents), names.get(payer, payer),
+                 category, description, *shares)
+                for expense_id, spent_at, cents, payer, category, description, shares in batch
+            )
+            count += len(batch)
+    return count
+
+def write_parquet(batches: Iterator[List[Tuple]], path: str, users: List[User]) -> int:
+    """Writes the batches as Parquet, one row group per batch. Returns the row count."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Exportar em Parquet requer o pacote pyarrow (pip install pyarrow).") from e
+    names = {u["id"]: u["name"] for u in users}
+    share_columns = columns(users)[7:]
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("spent_at", pa.date32()),
+            ("amount_cents", pa.int64()),
+            ("amount", pa.decimal128(14, 2)),
+            ("payer", pa.string()),
+            ("category", pa.string()),
+            ("description", pa.string()),
+        ]
+        + [(name, pa.int32()) for name in share_columns]
+    )
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            data: Dict[str, List[Any]] = {
+                "id": [r[0] for r in batch],
+                "spent_at": [_spent_at(r[1]) for r in batch],
+                "amount_cents": [r[2] for r in batch],
+                "amount": [_amount(r[2]) for r in batch],
+                "payer": [names.get(r[3], str(r[3])) for r in batch],
+                "category": [r[4] for r in batch],
+                "description": [r[5] for r in batch],
+            }
+            for i, name in enumerate(share_columns):
+                data[name] = [r[6][i] for r in batch]
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            count += len(batch)
+    return count
+
+def export_expenses(
+    storage,
+    path: str,
+    fmt: str = "csv",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> int:
+    """Exports the expenses matching the filters to `path`; returns the row count.
+
+    Dates are inclusive (YYYY-MM-DD, None for no bound); `categories` limits
+    the export to those names.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconhecido: {fmt!r} (use {' ou '.join(FORMATS)}).")
+    users = storage.get_users()
+    batches = storage.stream_expenses([u["id"] for u in users], start_date, end_date, categories, batch_size)
+    writer = write_parquet if fmt == "parquet" else write_csv
+    try:
+        return writer(batches, path, users)
+    except BaseException:
+        # Don't leave a truncated file that looks like a complete export.
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+if __name__ == "__main__":
+    from src.storage import get_storage
+    parser = argparse.ArgumentParser(description="Exporta os gastos para CSV ou Parquet.")
+    parser.add_argument("path", help="Arquivo de saída (.csv ou .parquet)")
+    parser.add_argument("--format", choices=FORMATS, help="Padrão: pela extensão do arquivo")
+    parser.add_argument("--from", dest="start_date", help="Primeiro dia (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", help="Último dia (YYYY-MM-DD)")
+    parser.add_argument("--category", nargs="+", help="Só estas categorias")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    fmt = args.format or ("parquet" if os.path.splitext(args.path)[1].lower() == ".parquet" else "csv")
+    exported = export_expenses(get_storage(), args.path, fmt, args.start_date, args.end_date,
+                               args.category, args.batch_size)
+    print(f"{exported} gastos exportados para {args.path}")
@@ -0,0 +1,182 @@
+import csv
+import io
+import math
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, TypedDict
+
+class StatementLine(TypedDict):
+    spent_at: str
+    # Signed, as printed in the statement (debits are usually negative).
+    amount_cents: int
+    description: str
+
+class ImportedExpense(TypedDict):
+    spent_at: str
+    amount_cents: int
+    payer_user_id: int
+    category: str
+    description: str
+    split_bp: Dict[int, int]
+
+# Header names (lower case, no accents) recognised in bank CSV exports.
+_DATE_HEADERS = ("data", "date", "data lancamento", "data de lancamento", "dt")
+_AMOUNT_HEADERS = ("valor", "amount", "valor (r$)", "quantia")
+_DESCRIPTION_HEADERS = ("descricao", "description", "title", "historico", "memo", "estabelecimento", "lancamento")
+
+_ACCENTS = str.maketrans("áàâãéêíóôõúç", "aaaaeeiooouc")
+
+def _normalize_header(h: str) -> str:
+    return h.strip().lower().translate(_ACCENTS)
+
+def _decode(data: bytes) -> str:
+    """Decodes a statement file; Brazilian banks still ship cp1252 files."""
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+def parse_amount_cents(text: str) -> int:
+    """Parses '1.234,56', '-1234.56', 'R$ 12,30', '1.234' ... into signed cents."""
+    t = text.strip().replace("R$", "").replace(" ", "")
+    negative = t.startswith("-") or (t.startswith("(") and t.endswith(")"))
+    t = t.strip("-()+")
+    if "," in t and "." in t:
+        # Whichever separator comes last is the decimal one.
+        if t.rfind(",") > t.rfind("."):
+            t = t.replace(".", "").replace(",", ".")
+        else:
+            t = t.replace(",", "")
+    elif "," in t:
+        t = t.replace(",", ".")
+    elif re.fullmatch(r"[1-9]\d{0,2}(\.\d{3})+", t):
+        # Dots alone with groups of three digits are thousands: '1.234' is R$ 1.234,00.
+        t = t.replace(".", "")
+    value = float(t)
+    if not math.isfinite(value):
+        raise ValueError(f"Valor não reconhecido: {text!r}")
+    cents = int(round(value * 100))
+    return -cents if negative else cents
+
+def parse_date(text: str) -> str:
+    """Parses the usual statement date formats into YYYY-MM-DD."""
+    t = text.strip()
+    # Width trims trailing times ("2024-01-05 10:00", OFX "20240105120000[-3:BRT]").
+    for fmt, width in (("%Y-%m-%d", 10), ("%d/%m/%Y", 10), ("%d/%m/%y", 8), ("%d-%m-%Y", 10), ("%Y%m%d", 8)):
+        try:
+            return datetime.strptime(t[:width], fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Data não reconhecida: {text!r}")
+
+def _pick(headers: List[str], candidates: tuple) -> Optional[int]:
+    for i, h in enumerate(headers):
+        if h in candidates:
+            return i
+    return None
+
+def parse_csv(data: bytes) -> List[StatementLine]:
+    """Parses a bank CSV export with date, amount and description columns."""
+    text = _decode(data)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+    headers = [_normalize_header(h) for h in next(reader, [])]
+    i_date = _pick(headers, _DATE_HEADERS)
+    i_amount = _pick(headers, _AMOUNT_HEADERS)
+    i_desc = _pick(headers, _DESCRIPTION_HEADERS)
+    if i_date is None or i_amount is None:
+        raise ValueError("CSV precisa de colunas de data e valor (ex: 'data', 'valor').")
+
+    lines: List[StatementLine] = []
+    for row in reader:
+        # Blank lines, and footers too short to hold a date and an amount ("Saldo;123").
+        if len(row) <= max(i_date, i_amount) or not any(c.strip() for c in row):
+            continue
+        lines.append({
+            "spent_at": parse_date(row[i_date]),
+            "amount_cents": parse_amount_cents(row[i_amount]),
+            "description": row[i_desc].strip() if i_desc is not None and i_desc < len(row) else "",
+        })
+    return lines
+
+_OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|(?=</BANKTRANLIST>))", re.S | re.I)
+
+def _ofx_field(block: str, tag: str) -> Optional[str]:
+    # OFX 1.x (SGML) omits closing tags, so stop at the next tag or line end.
+    m = re.search(rf"<{tag}>([^<\r\n]*)", block, re.I)
+    return m.group(1).strip() if m else None
+
+def parse_ofx(data: bytes) -> List[StatementLine]:
+    """Parses the transactions of an OFX statement (SGML 1.x or XML 2.x)."""
+    text = _decode(data)
+    lines: List[StatementLine] = []
+    for block in _OFX_TRANSACTION.findall(text):
+        posted = _ofx_field(block, "DTPOSTED")
+        amount = _ofx_field(block, "TRNAMT")
+        if not posted or not amount:
+            continue
+        description = _ofx_field(block, "MEMO") or _ofx_field(block, "NAME") or ""
+        lines.append({
+            "spent_at": parse_date(posted[:8]),
+            "amount_cents": parse_amount_cents(amount),
+            "description": description,
+        })
+    return lines
+
+def parse_statement(filename: str, data: bytes) -> List[StatementLine]:
+    """Dispatches on the file extension (.ofx or .csv)."""
+    if filename.lower().endswith((".ofx", ".qfx")):
+        return parse_ofx(data)
+    return parse_csv(data)
+
+def guess_category(description: str, categories: List[str], default: str) -> str:
+    """Picks the first known category whose name appears in the description."""
+    d = description.lower()
+    for cat in categories:
+        if cat != default and cat.lower() in d:
+            return cat
+    return default
+
+def map_statement_lines(
+    lines: List[StatementLine],
+    payer_user_id: int,
+    split_bp: Dict[int, int],
+    categories: List[str],
+    default_category: str,
+    expenses_negative: bool = True
+) -> List[ImportedExpense]:
+    """
+    Turns statement lines into expenses ready for bulk_add_expenses.
+
+    Args:
+        lines: Parsed statement lines.
+        payer_user_id: Who paid every expense of the statement.
+        split_bp: Split applied to every expense (user id -> basis points).
+        categories: Known categories, matched against the descriptions.
+        default_category: Category for lines that match none.
+        expenses_negative: True when debits are negative (bank accounts, OFX);
+            False for card statements that list purchases as positive.
+
+    Returns:
+        One expense per debit line; credits (refunds, payments) are skipped.
+    """
+    expenses: List[ImportedExpense] = []
+    for line in lines:
+        cents = -line["amount_cents"] if expenses_negative else line["amount_cents"]
+        if cents <= 0:
+            continue
+        description = line["description"] or default_category
+        expenses.append({
+            "spent_at": line["spent_at"],
+            "amount_cents": cents,
+            "payer_user_id": payer_user_id,
+            "category": guess_category(description, categories, default_category),
+            "description": description,
+            "split_bp": dict(split_bp),
+        })
+    return expenses
@@ -1,9 +1,21 @@
-import json
+import heapq
 from typing import Dict, List, Any, Tuple
 
+# (from_user_id, to_user_id, amount_cents)
+Transfer = Tuple[int, int, int]
+
+# Members with a non-zero balance up to which minimum_transfers searches for
+# the exact optimum (2^n subsets); above it, a greedy pass (at most n - 1 transfers).
+EXACT_SOLVER_MAX_MEMBERS = 14
+
 def compute_month_summary(expenses: List[Dict[str, Any]], user_a: Dict[str, Any], user_b: Dict[str, Any]) -> Dict[str, Any]:
     """
     Computes the summary of expenses for a month.
+
+    Rounding follows database.get_month_totals, so both paths give the same
+    summary: each quota is summed in cents x basis points over the month and
+    rounded to whole cents once, half away from zero (1001 cents split 50/50
+    is 501 + 501, not 500.5 each).
     
     Args:
         expenses: List of expense dictionaries.
@@ -13,32 +25,62 @@ def compute_month_summary(expenses: List[Dict[str, Any]], user_a: Dict[str, Any]
     Returns:
         A dictionary containing total, paid amounts, quotas, balances and suggestions.
     """
-    a_id, b_id = str(user_a["id"]), str(user_b["id"])
-    paid_a = paid_b = 0.0
-    quota_a = quota_b = 0.0
-    total = 0.0
+    a_id, b_id = user_a["id"], user_b["id"]
+    paid_a = paid_b = 0
+    quota_a_bp = quota_b_bp = 0
+    total = 0
 
     for e in expenses:
-        amount = float(e["amount"])
-        total += amount
-        payer = str(e["payer_user_id"])
-        
-        try:
-            split = json.loads(e["split_json"])
-        except (json.JSONDecodeError, TypeError):
-            split = {a_id: 0.5, b_id: 0.5}
-            
-        sa = float(split.get(a_id, 0.5))
-        sb = float(split.get(b_id, 0.5))
+        cents = e["amount_cents"] if "amount_cents" in e else int(round(float(e["amount"]) * 100))
+        total += cents
+        payer = e["payer_user_id"]
 
-        quota_a += amount * sa
-        quota_b += amount * sb
+        # Shares in basis points (10000 = 100%). Same rule as the SQL path: a
+        # user missing from the split owes nothing; no split at all is 50/50.
+        split = e.get("split_bp") or equal_split([a_id, b_id])
+        quota_a_bp += cents * split.get(a_id, 0)
+        quota_b_bp += cents * split.get(b_id, 0)
 
         if payer == a_id:
-            paid_a += amount
+            paid_a += cents
         elif payer == b_id:
-            paid_b += amount
+            paid_b += cents
 
+    return summary_from_cents(
+        {
+            "total_cents": total,
+            "paid_a_cents": paid_a, "paid_b_cents": paid_b,
+            "quota_a_cents": _round_bp(quota_a_bp), "quota_b_cents": _round_bp(quota_b_bp),
+        },
+        user_a, user_b
+    )
+
+def summary_from_cents(totals: Dict[str, int], user_a: Dict[str, Any], user_b: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the same summary as compute_month_summary from integer-cent totals.
+
+    Args:
+        totals: Aggregates as returned by database.get_month_totals.
+        user_a: Dictionary with user A information (id, name).
+        user_b: Dictionary with user B information (id, name).
+
+    Returns:
+        A dictionary with the same keys (and units, R$) as compute_month_summary.
+    """
+    return _build_summary(
+        totals["total_cents"] / 100.0,
+        totals["paid_a_cents"] / 100.0, totals["paid_b_cents"] / 100.0,
+        totals["quota_a_cents"] / 100.0, totals["quota_b_cents"] / 100.0,
+        user_a, user_b
+    )
+
+def _build_summary(
+    total: float,
+    paid_a: float, paid_b: float,
+    quota_a: float, quota_b: float,
+    user_a: Dict[str, Any], user_b: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Derives balances and the settlement suggestion from paid/quota totals."""
     bal_a = paid_a - quota_a
     bal_b = paid_b - quota_b
 
@@ -60,3 +102,205 @@ def compute_month_summary(expenses: List[Dict[str, Any]], user_a: Dict[str, Any]
         "suggestion": suggestion,
         "settle_from_to_amount": settle
     }
+
+def equal_split(user_ids: List[int]) -> Dict[int, int]:
+    """Splits 100% equally; the basis points left by the division go to the first users."""
+    return split_from_weights({u: 1 for u in user_ids})
+
+def split_from_weights(weights: Dict[int, float]) -> Dict[int, int]:
+    """Turns arbitrary non-negative weights into shares in basis points that add up to 10000.
+
+    Largest remainder: each user gets the floor of their exact share and the
+    leftover basis points go to the largest fractions (ties: input order).
+    """
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Pelo menos uma pessoa precisa ter peso maior que zero.")
+    exact = {u: w * 10000 / total for u, w in weights.items()}
+    split = {u: int(v) for u, v in exact.items()}
+    order = sorted(exact, key=lambda u: exact[u] - split[u], reverse=True)
+    for u in order[:10000 - sum(split.values())]:
+        split[u] += 1
+    return split
+
+def month_balances_from_expenses(expenses: List[Dict[str, Any]], user_ids: List[int]) -> Dict[str, Any]:
+    """
+    Reference N-person month totals, from a list of expenses.
+
+    A user missing from an expense's split owes nothing of it; an expense
+    without any split is shared equally. Quotas are summed in cents x basis
+    points and rounded once per user, like database.get_month_balances.
+
+    Returns:
+        A dict shaped like database.MonthBalances.
+    """
+    paid = {u: 0 for u in user_ids}
+    quota_bp = {u: 0 for u in user_ids}
+    total = 0
+    for e in expenses:
+        cents = e["amount_cents"] if "amount_cents" in e else int(round(float(e["amount"]) * 100))
+        total += cents
+        if e["payer_user_id"] in paid:
+            paid[e["payer_user_id"]] += cents
+        for u, bp in (e.get("split_bp") or equal_split(user_ids)).items():
+            if u in quota_bp:
+                quota_bp[u] += cents * bp
+    return {
+        "expense_count": len(expenses),
+        "total_cents": total,
+        "paid_cents": paid,
+        "quota_cents": {u: _round_bp(v) for u, v in quota_bp.items()},
+    }
+
+def _round_bp(value: int) -> int:
+    """cents x basis points -> cents, half away from zero like SQL ROUND."""
+    return (value + 5000) // 10000 if value >= 0 else -((-value + 5000) // 10000)
+
+def minimum_transfers(balances: Dict[int, int]) -> List[Transfer]:
+    """
+    Transfers that settle every balance, as few as possible.
+
+    Args:
+        balances: user id -> cents (positive: is owed money; negative: owes).
+
+    Returns:
+        (from_user_id, to_user_id, amount_cents) transfers, largest first.
+
+    A group of k people whose balances add up to zero settles among
+    themselves with k - 1 transfers, so the fewest transfers come from
+    splitting the members into as many zero-sum groups as possible. Pairs
+    that cancel out exactly are always such a group; the rest is solved
+    exactly over subsets when there are at most EXACT_SOLVER_MAX_MEMBERS
+    people left, greedily (never more than n - 1 transfers) above that.
+    Rounding residue (balances not adding up to zero by a few cents) is
+    taken off the largest balance on the side that has too much.
+    """
+    remaining = {u: b for u, b in balances.items() if b}
+    residue = sum(remaining.values())
+    if residue:
+        side = [u for u in remaining if (remaining[u] > 0) == (residue > 0)]
+        biggest = max(side, key=lambda u: abs(remaining[u]))
+        remaining[biggest] -= residue
+        if not remaining[biggest]:
+            del remaining[biggest]
+
+    transfers: List[Transfer] = []
+    # Exact opposites settle with one transfer each.
+    by_amount: Dict[int, List[int]] = {}
+    for u in sorted(remaining):
+        if remaining[u] < 0:
+            by_amount.setdefault(-remaining[u], []).append(u)
+    for u in sorted(remaining):
+        b = remaining.get(u, 0)
+        if b > 0 and by_amount.get(b):
+            debtor = by_amount[b].pop()
+            transfers.append((debtor, u, b))
+            del remaining[u], remaining[debtor]
+
+    members = sorted(remaining)
+    if len(members) <= EXACT_SOLVER_MAX_MEMBERS:
+        groups = _zero_sum_groups(members, [remaining[u] for u in members])
+    else:
+        groups = [members]
+    for group in groups:
+        transfers += _settle_greedily({u: remaining[u] for u in group})
+    return sorted(transfers, key=lambda t: (-t[2], t[0], t[1]))
+
+def _zero_sum_groups(members: List[int], amounts: List[int]) -> List[List[int]]:
+    """Splits members (amounts adding up to zero) into the most zero-sum groups.
+
+    best[mask] is the most zero-sum groups that the members in `mask` can be
+    cut into when they are taken in some order; a prefix closes a group each
+    time its sum hits zero.
+    """
+    n = len(members)
+    if n == 0:
+        return []
+    size = 1 << n
+    sums = [0] * size
+    best = [0] * size
+    for mask in range(1, size):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + amounts[low.bit_length() - 1]
+        top = 0
+        m = mask
+        while m:
+            bit = m & -m
+            if best[mask ^ bit] > top:
+                top = best[mask ^ bit]
+            m ^= bit
+        best[mask] = top + (sums[mask] == 0)
+
+    # Walk back from everyone, peeling members off while keeping the optimum;
+    # each time the remaining set sums to zero, what was peeled is a group.
+    groups: List[List[int]] = []
+    current: List[int] = []
+    mask = size - 1
+    while mask:
+        target = best[mask] - (sums[mask] == 0)
+        m = mask
+        while m:
+            bit = m & -m
+            if best[mask ^ bit] == target:
+                break
+            m ^= bit
+        mask ^= bit
+        current.append(members[bit.bit_length() - 1])
+        if sums[mask] == 0:
+            groups.append(current)
+            current = []
+    return groups
+
+def _settle_greedily(balances: Dict[int, int]) -> List[Transfer]:
+    """Largest debtor pays largest creditor until everyone is even (at most n - 1 transfers)."""
+    creditors = [(-b, u) for u, b in balances.items() if b > 0]
+    debtors = [(b, u) for u, b in balances.items() if b < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers: List[Transfer] = []
+    while creditors and debtors:
+        credit, to_user = heapq.heappop(creditors)
+        debt, from_user = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((from_user, to_user, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, to_user))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, from_user))
+    return transfers
+
+def household_summary(balances: Dict[str, Any], users: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Builds the N-person month summary.
+
+    Args:
+        balances: Totals shaped like database.MonthBalances (integer cents).
+        users: Every member of the household (id, name).
+
+    Returns:
+        total, and paid/quota/balance per user id in R$; balance_cents per
+        user id; transfers, the minimum_transfers that settle the month (cents);
+        and a suggestion sentence naming them.
+    """
+    names = {u["id"]: u["name"] for u in users}
+    balance_cents = {
+        u["id"]: balances["paid_cents"].get(u["id"], 0) - balances["quota_cents"].get(u["id"], 0)
+        for u in users
+    }
+    transfers = minimum_transfers(balance_cents)
+    if transfers:
+        suggestion = "Para equalizar: " + "; ".join(
+            f"Pix de R$ {cents / 100:.2f} de {names.get(src, src)} para {names.get(dst, dst)}"
+            for src, dst, cents in transfers
+        ) + "."
+    else:
+        suggestion = "Perfeito: não há nada a acertar neste mês."
+    return {
+        "total": balances["total_cents"] / 100.0,
+        "paid": {u["id"]: balances["paid_cents"].get(u["id"], 0) / 100.0 for u in users},
+        "quota": {u["id"]: balances["quota_cents"].get(u["id"], 0) / 100.0 for u in users},
+        "balance": {u: cents / 100.0 for u, cents in balance_cents.items()},
+        "balance_cents": balance_cents,
+        "transfers": transfers,
+        "suggestion": suggestion,
+    }
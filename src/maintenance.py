@@ -0,0 +1,83 @@
+"""
+Maintenance commands for derived data.
+
+    python -m src.maintenance rebuild-summaries            # every month
+    python -m src.maintenance rebuild-summaries 2024-05    # only these months
+    python -m src.maintenance check-summaries              # list drifted months
+    python -m src.maintenance replay-ledger                # rebuild the balance ledger
+    python -m src.maintenance households                   # every household and its link
+
+The others work on one household: HOUSEHOLD_ID's (see src.tenancy). The
+summaries exist only on Postgres; replay-ledger runs on the configured backend.
+"""
+import argparse
+import sys
+from typing import List
+from src.database import get_connection, rebuild_month_summaries, _SUMMARY_CONTRIBUTIONS_SQL
+from src.tenancy import current_household
+
+def check_month_summaries() -> List[str]:
+    """Returns the household's months whose maintained summary differs from its expenses."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""WITH fresh AS ({_SUMMARY_CONTRIBUTIONS_SQL.format(where="e.household_id = %(household)s")})
+                    SELECT DISTINCT COALESCE(f.month, m.month) AS month
+                    FROM fresh f
+                    FULL JOIN (SELECT * FROM month_user_summaries
+                               WHERE household_id = %(household)s AND (paid_cents <> 0 OR quota_bp_cents <> 0)) m
+                      ON m.month = f.month AND m.user_id = f.user_id
+                    WHERE f.month IS NULL OR m.month IS NULL
+                       OR f.paid_cents <> m.paid_cents OR f.quota_bp_cents <> m.quota_bp_cents
+                    UNION
+                    SELECT COALESCE(f.month, m.month)
+                    FROM (SELECT to_char(spent_at, 'YYYY-MM') AS month, COUNT(*) AS n, SUM(amount_cents) AS total
+                          FROM expenses WHERE household_id = %(household)s GROUP BY 1) f
+                    FULL JOIN (SELECT * FROM month_summaries
+                               WHERE household_id = %(household)s AND expense_count <> 0) m ON m.month = f.month
+                    WHERE f.month IS NULL OR m.month IS NULL
+                       OR f.n <> m.expense_count OR f.total <> m.total_cents
+                    ORDER BY 1;""",
+                {"household": current_household()}
+            )
+            return [r["month"] for r in cur.fetchall()]
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild-summaries", help="Recalcula month_summaries a partir dos gastos")
+    rebuild.add_argument("months", nargs="*", help="Meses YYYY-MM (padrão: todos)")
+    sub.add_parser("check-summaries", help="Lista meses cujo resumo diverge dos gastos")
+    sub.add_parser("replay-ledger", help="Refaz o livro de saldos a partir dos gastos e acertos")
+    sub.add_parser("households", help="Lista as casas e o link de cada uma")
+    args = parser.parse_args(argv)
+
+    if args.command == "households":
+        from src.storage import get_storage
+        storage = get_storage()
+        storage.migrate()
+        households = storage.list_households()
+        for h in households:
+            print(f"{h['id']:>4}  {h['name']:<30} ?casa={h['slug']}")
+        if not households:
+            print("Uma casa só: o app abre sem ?casa=.")
+        return 0
+
+    if args.command == "replay-ledger":
+        from src.storage import get_storage
+        storage = get_storage()
+        storage.migrate()
+        print(f"Livro de saldos refeito: {storage.rebuild_ledger()} lançamentos")
+        return 0
+    if args.command == "rebuild-summaries":
+        rebuild_month_summaries(args.months or None)
+        print("Resumos recalculados: " + (", ".join(args.months) if args.months else "todos os meses"))
+        return 0
+    drifted = check_month_summaries()
+    for month in drifted:
+        print(f"Divergente: {month}")
+    print("OK: resumos consistentes." if not drifted else f"{len(drifted)} mês(es) divergente(s).")
+    return 1 if drifted else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
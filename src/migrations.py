@@ -0,0 +1,459 @@
+import json
+import secrets
+import threading
+from typing import Any, Callable, Dict, List, Tuple, Union
+from src.diagnostics import traced
+from src.database import (
+    get_connection,
+    upsert_default_users,
+    upsert_default_categories,
+    expense_fingerprint,
+)
+from src.tenancy import DEFAULT_HOUSEHOLD_ID, use_household
+
+# A step is either a SQL statement or a callable receiving the open cursor
+# (for data backfills that are awkward to express in plain SQL).
+Step = Union[str, Callable[[Any], None]]
+Migration = Tuple[int, str, List[Step]]
+
+def legacy_split_bp(split_json: Any, user_ids: List[int]) -> Dict[int, int]:
+    """Decodes an old split_json into basis points per user.
+
+    Mirrors the old reader: unreadable JSON or a missing user key means 50%.
+    So does anything it could not have used: JSON that isn't an object, and
+    a share that isn't a number between 0 and 1.
+    """
+    try:
+        split = json.loads(split_json)
+    except (json.JSONDecodeError, TypeError):
+        split = {}
+    if not isinstance(split, dict):
+        split = {}
+    shares = {}
+    for user_id in user_ids:
+        try:
+            share = float(split.get(str(user_id), 0.5))
+        except (TypeError, ValueError):
+            share = 0.5
+        # NaN fails both comparisons too.
+        if not 0 <= share <= 1:
+            share = 0.5
+        shares[user_id] = int(round(share * 10000))
+    return shares
+
+def _backfill_expense_splits(cur) -> None:
+    """Decodes every split_json into expense_splits rows (see legacy_split_bp)."""
+    cur.execute("SELECT id FROM users;")
+    user_ids = [r["id"] for r in cur.fetchall()]
+    cur.execute("SELECT id, split_json FROM expenses;")
+    cur.executemany(
+        "INSERT INTO expense_splits(expense_id, user_id, share_bp) VALUES (%s, %s, %s);",
+        [
+            (r["id"], user_id, share)
+            for r in cur.fetchall()
+            for user_id, share in legacy_split_bp(r["split_json"], user_ids).items()
+        ]
+    )
+
+def _backfill_fingerprints(cur) -> None:
+    """Computes expense_fingerprint for existing rows (Python-side, so the
+    normalization matches new inserts exactly) and applies it in one UPDATE."""
+    cur.execute("SELECT id, spent_at, amount_cents, payer_user_id, description FROM expenses;")
+    rows = cur.fetchall()
+    cur.execute("CREATE TEMP TABLE fingerprint_backfill (id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL) ON COMMIT DROP;")
+    with cur.copy("COPY fingerprint_backfill (id, fingerprint) FROM STDIN") as copy:
+        for r in rows:
+            copy.write_row((r["id"], expense_fingerprint(
+                r["spent_at"], r["amount_cents"], r["payer_user_id"], r["description"]
+            )))
+    cur.execute("UPDATE expenses e SET fingerprint = b.fingerprint FROM fingerprint_backfill b WHERE b.id = e.id;")
+
+# Tables whose rows belong to a household; expense_splits rows are only ever
+# reached through their expense, which carries it.
+HOUSEHOLD_TABLES = ("users", "categories", "expenses", "settlements", "month_summaries", "month_user_summaries")
+
+def _add_household_columns(cur) -> None:
+    """Creates the HOUSEHOLD_ID household and gives it every existing row.
+
+    A constant default fills household_id without rewriting the tables; it is
+    dropped right after so every write has to name its household.
+    """
+    # A random slug like add_household's: its link must not be guessable either.
+    cur.execute(
+        "INSERT INTO households(id, name, slug) VALUES (%s, 'Casa', %s);",
+        (DEFAULT_HOUSEHOLD_ID, secrets.token_urlsafe(6))
+    )
+    cur.execute("SELECT setval(pg_get_serial_sequence('households', 'id'), (SELECT MAX(id) FROM households));")
+    for table in HOUSEHOLD_TABLES:
+        cur.execute(
+            f"ALTER TABLE {table} ADD COLUMN household_id INTEGER NOT NULL DEFAULT {DEFAULT_HOUSEHOLD_ID}"
+            " REFERENCES households(id);"
+        )
+        cur.execute(f"ALTER TABLE {table} ALTER COLUMN household_id DROP DEFAULT;")
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent processes (several
+# app replicas starting at once) don't apply the same migration twice.
+MIGRATION_LOCK_KEY = 4_242_001
+
+# Ordered, append-only. Never edit a migration that has shipped: add a new one.
+MIGRATIONS: List[Migration] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id SERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL,
+            spent_at DATE NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            payer_user_id INTEGER NOT NULL REFERENCES users(id),
+            category TEXT NOT NULL,
+            description TEXT,
+            split_json TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settlements (
+            id SERIAL PRIMARY KEY,
+            month TEXT NOT NULL UNIQUE,
+            from_user_id INTEGER NOT NULL REFERENCES users(id),
+            to_user_id INTEGER NOT NULL REFERENCES users(id),
+            amount_cents INTEGER NOT NULL,
+            paid_at TIMESTAMPTZ
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        """,
+    ]),
+    (2, "structured expense splits", [
+        """
+        CREATE TABLE expense_splits (
+            expense_id INTEGER NOT NULL REFERENCES expenses(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            share_bp INTEGER NOT NULL CHECK (share_bp BETWEEN 0 AND 10000),
+            PRIMARY KEY (expense_id, user_id)
+        );
+        """,
+        _backfill_expense_splits,
+        "ALTER TABLE expenses DROP COLUMN split_json;",
+    ]),
+    (3, "indexes for month listing and category renames", [
+        # Month range scans come back already in display order.
+        "CREATE INDEX IF NOT EXISTS expenses_spent_at_id_idx ON expenses (spent_at DESC, id DESC);",
+        "CREATE INDEX IF NOT EXISTS expenses_category_idx ON expenses (category);",
+    ]),
+    (4, "expense fingerprints for duplicate detection", [
+        "ALTER TABLE expenses ADD COLUMN fingerprint TEXT;",
+        _backfill_fingerprints,
+        "ALTER TABLE expenses ALTER COLUMN fingerprint SET NOT NULL;",
+        # Not unique: duplicates are flagged for the user, never rejected.
+        "CREATE INDEX expenses_fingerprint_idx ON expenses (fingerprint);",
+    ]),
+    (5, "incrementally maintained month summaries", [
+        """
+        CREATE TABLE month_summaries (
+            month TEXT PRIMARY KEY,
+            expense_count INTEGER NOT NULL DEFAULT 0,
+            total_cents BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE month_user_summaries (
+            month TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            paid_cents BIGINT NOT NULL DEFAULT 0,
+            -- sum of amount_cents * share_bp; divide by 10000 for cents
+            quota_bp_cents BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, user_id)
+        );
+        """,
+        # Backfill with the statements the repair tool used at this version
+        # (before households; src.database's now also group by household).
+        """
+        INSERT INTO month_summaries(month, expense_count, total_cents)
+        SELECT to_char(spent_at, 'YYYY-MM'), COUNT(*), SUM(amount_cents) FROM expenses GROUP BY 1;
+        """,
+        """
+        INSERT INTO month_user_summaries(month, user_id, paid_cents, quota_bp_cents)
+        SELECT month, user_id, SUM(paid), SUM(quota)
+        FROM (
+            SELECT to_char(e.spent_at, 'YYYY-MM') AS month, e.payer_user_id AS user_id,
+                   e.amount_cents::bigint AS paid, 0::bigint AS quota
+            FROM expenses e
+            UNION ALL
+            SELECT to_char(e.spent_at, 'YYYY-MM'), s.user_id, 0, e.amount_cents::bigint * s.share_bp
+            FROM expenses e JOIN expense_splits s ON s.expense_id = e.id
+        ) c
+        GROUP BY month, user_id;
+        """,
+    ]),
+    (6, "expenses reference categories by id; deleted categories are archived", [
+        "ALTER TABLE categories ADD COLUMN archived BOOLEAN NOT NULL DEFAULT false;",
+        # Names left behind by deleted categories become archived categories.
+        """
+        INSERT INTO categories(name, archived)
+        SELECT DISTINCT category, true FROM expenses
+        ON CONFLICT (name) DO NOTHING;
+        """,
+        "ALTER TABLE expenses ADD COLUMN category_id INTEGER REFERENCES categories(id);",
+        "UPDATE expenses e SET category_id = c.id FROM categories c WHERE c.name = e.category;",
+        "ALTER TABLE expenses ALTER COLUMN category_id SET NOT NULL;",
+        "DROP INDEX IF EXISTS expenses_category_idx;",
+        "CREATE INDEX expenses_category_id_idx ON expenses (category_id);",
+        "ALTER TABLE expenses DROP COLUMN category;",
+    ]),
+    (7, "idempotency keys for queued expense writes", [
+        "ALTER TABLE expenses ADD COLUMN idempotency_key TEXT;",
+        # Unique where set; expenses saved directly leave it NULL.
+        "CREATE UNIQUE INDEX expenses_idempotency_key_idx ON expenses (idempotency_key);",
+    ]),
+    (8, "several settlement transfers per month", [
+        "ALTER TABLE settlements DROP CONSTRAINT IF EXISTS settlements_month_key;",
+        "CREATE INDEX settlements_month_idx ON settlements (month);",
+    ]),
+    (9, "households: every table scoped to one", [
+        """
+        CREATE TABLE households (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            slug TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        _add_household_columns,
+        # Category names are unique per household. The (household_id, id)
+        # keys let expenses and settlements only point at their own
+        # household's users and categories.
+        "ALTER TABLE categories DROP CONSTRAINT categories_name_key;",
+        "ALTER TABLE categories ADD CONSTRAINT categories_household_id_name_key UNIQUE (household_id, name);",
+        "ALTER TABLE categories ADD CONSTRAINT categories_household_id_id_key UNIQUE (household_id, id);",
+        "ALTER TABLE users ADD CONSTRAINT users_household_id_id_key UNIQUE (household_id, id);",
+        """
+        ALTER TABLE expenses
+            ADD CONSTRAINT expenses_household_payer_fkey
+                FOREIGN KEY (household_id, payer_user_id) REFERENCES users(household_id, id),
+            ADD CONSTRAINT expenses_household_category_fkey
+                FOREIGN KEY (household_id, category_id) REFERENCES categories(household_id, id);
+        """,
+        """
+        ALTER TABLE settlements
+            ADD CONSTRAINT settlements_household_from_user_fkey
+                FOREIGN KEY (household_id, from_user_id) REFERENCES users(household_id, id),
+            ADD CONSTRAINT settlements_household_to_user_fkey
+                FOREIGN KEY (household_id, to_user_id) REFERENCES users(household_id, id);
+        """,
+        # Every index the app reads through leads with household_id, so one
+        # household's queries never walk another's rows.
+        "DROP INDEX expenses_spent_at_id_idx;",
+        "CREATE INDEX expenses_household_spent_at_id_idx ON expenses (household_id, spent_at DESC, id DESC);",
+        "DROP INDEX expenses_fingerprint_idx;",
+        "CREATE INDEX expenses_household_fingerprint_idx ON expenses (household_id, fingerprint);",
+        "DROP INDEX expenses_idempotency_key_idx;",
+        "CREATE UNIQUE INDEX expenses_household_idempotency_key_idx ON expenses (household_id, idempotency_key);",
+        "DROP INDEX settlements_month_idx;",
+        "CREATE INDEX settlements_household_month_idx ON settlements (household_id, month);",
+        "ALTER TABLE month_summaries DROP CONSTRAINT month_summaries_pkey, ADD PRIMARY KEY (household_id, month);",
+        """
+        ALTER TABLE month_user_summaries
+            DROP CONSTRAINT month_user_summaries_pkey, ADD PRIMARY KEY (household_id, month, user_id);
+        """,
+    ]),
+    (10, "append-only ledger of balance changes", [
+        """
+        CREATE TABLE ledger_entries (
+            id BIGSERIAL PRIMARY KEY,
+            household_id INTEGER NOT NULL REFERENCES households(id),
+            user_id INTEGER NOT NULL,
+            recorded_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+            effective_on DATE NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('expense', 'settlement')),
+            -- No foreign key: entries outlive the expense they describe.
+            expense_id INTEGER,
+            month TEXT,
+            -- cents x basis points, like quota_bp_cents
+            delta_bp_cents BIGINT NOT NULL,
+            balance_after_bp_cents BIGINT NOT NULL,
+            FOREIGN KEY (household_id, user_id) REFERENCES users(household_id, id)
+        );
+        """,
+        "CREATE INDEX ledger_entries_household_user_recorded_idx"
+        " ON ledger_entries (household_id, user_id, recorded_at DESC, id DESC);",
+        """
+        CREATE TABLE user_balances (
+            household_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            balance_bp_cents BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (household_id, user_id),
+            FOREIGN KEY (household_id, user_id) REFERENCES users(household_id, id)
+        );
+        """,
+        # Backfill with the replay of src.database.rebuild_ledger at this
+        # version, over every household.
+        """
+        INSERT INTO ledger_entries(household_id, user_id, recorded_at, effective_on, kind, expense_id, month,
+                                   delta_bp_cents, balance_after_bp_cents)
+        SELECT household_id, user_id, LEAST(effective_on::timestamptz, clock_timestamp()), effective_on, kind,
+               expense_id, month, delta,
+               SUM(delta) OVER (PARTITION BY household_id, user_id ORDER BY effective_on, kind, expense_id, seq)
+        FROM (
+            SELECT e.household_id, d.user_id, e.spent_at AS effective_on, 'expense' AS kind, e.id AS expense_id,
+                   NULL::text AS month, 0 AS seq, SUM(d.delta)::bigint AS delta
+            FROM expenses e
+            CROSS JOIN LATERAL (
+                SELECT e.payer_user_id AS user_id, e.amount_cents::bigint * 10000 AS delta
+                UNION ALL
+                SELECT s.user_id, -e.amount_cents::bigint * s.share_bp FROM expense_splits s WHERE s.expense_id = e.id
+            ) d
+            GROUP BY e.household_id, d.user_id, e.spent_at, e.id
+            HAVING SUM(d.delta) <> 0
+            UNION ALL
+            SELECT s.household_id, t.user_id, COALESCE(s.paid_at::date, to_date(s.month, 'YYYY-MM')), 'settlement',
+                   NULL, s.month, s.id, t.delta
+            FROM settlements s
+            CROSS JOIN LATERAL (VALUES (s.from_user_id, s.amount_cents::bigint * 10000),
+                                       (s.to_user_id, -s.amount_cents::bigint * 10000)) AS t(user_id, delta)
+        ) d
+        ORDER BY effective_on, kind, expense_id, seq;
+        """,
+        """
+        INSERT INTO user_balances(household_id, user_id, balance_bp_cents)
+        SELECT household_id, user_id, SUM(delta_bp_cents) FROM ledger_entries GROUP BY household_id, user_id;
+        """,
+    ]),
+    (11, "frozen snapshots of closed months", [
+        """
+        CREATE TABLE month_snapshots (
+            household_id INTEGER NOT NULL REFERENCES households(id),
+            month TEXT NOT NULL,
+            closed_at TIMESTAMPTZ NOT NULL,
+            -- MonthBalances and the list_expenses_month rows at closing
+            balances JSONB NOT NULL,
+            expenses JSONB NOT NULL,
+            PRIMARY KEY (household_id, month)
+        );
+        """,
+        # Months already settled are closed as they read now, in the shapes
+        # src.database.record_settlements writes at this version.
+        """
+        INSERT INTO month_snapshots(household_id, month, closed_at, balances, expenses)
+        SELECT k.household_id, k.month, k.closed_at,
+               jsonb_build_object(
+                   'expense_count', COALESCE(m.expense_count, 0),
+                   'total_cents', COALESCE(m.total_cents, 0),
+                   'paid_cents', COALESCE(u.paid_cents, '{}'::jsonb),
+                   'quota_cents', COALESCE(u.quota_cents, '{}'::jsonb)
+               ),
+               COALESCE(x.expenses, '[]'::jsonb)
+        FROM (SELECT household_id, month, COALESCE(MAX(paid_at), now()) AS closed_at
+              FROM settlements GROUP BY household_id, month) k
+        LEFT JOIN month_summaries m ON m.household_id = k.household_id AND m.month = k.month
+        LEFT JOIN LATERAL (
+            SELECT jsonb_object_agg(user_id, paid_cents) AS paid_cents,
+                   jsonb_object_agg(user_id, ROUND(quota_bp_cents / 10000.0)::bigint) AS quota_cents
+            FROM month_user_summaries s WHERE s.household_id = k.household_id AND s.month = k.month
+        ) u ON true
+        LEFT JOIN LATERAL (
+            SELECT jsonb_agg(jsonb_build_object(
+                       'id', e.id,
+                       'spent_at', e.spent_at::text,
+                       'amount_cents', e.amount_cents,
+                       'amount', e.amount_cents / 100.0,
+                       'payer_user_id', e.payer_user_id,
+                       'category', c.name,
+                       'description', COALESCE(e.description, ''),
+                       'split_bp', (SELECT COALESCE(jsonb_object_agg(user_id, share_bp), '{}'::jsonb)
+                                    FROM expense_splits WHERE expense_id = e.id),
+                       'is_duplicate', EXISTS (SELECT 1 FROM expenses d
+                                               WHERE d.household_id = e.household_id
+                                                 AND d.fingerprint = e.fingerprint AND d.id <> e.id)
+                   ) ORDER BY e.spent_at DESC, e.id DESC) AS expenses
+            FROM expenses e JOIN categories c ON c.id = e.category_id
+            WHERE e.household_id = k.household_id
+              AND e.spent_at >= to_date(k.month, 'YYYY-MM')
+              AND e.spent_at < to_date(k.month, 'YYYY-MM') + interval '1 month'
+        ) x ON true;
+        """,
+    ]),
+]
+
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+def current_version() -> int:
+    """Returns the schema version recorded in the database (0 if none)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present;")
+            if not cur.fetchone()["present"]:
+                return 0
+            cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version;")
+            return cur.fetchone()["version"]
+
+@traced
+def migrate() -> List[int]:
+    """Applies pending migrations in order, in a single transaction.
+
+    Returns the versions that were applied (empty when already up to date).
+    """
+    applied: List[int] = []
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+            cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version;")
+            current = cur.fetchone()["version"]
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_version(version, description) VALUES (%s, %s);",
+                    (version, description)
+                )
+                applied.append(version)
+        conn.commit()
+    return applied
+
+@traced
+def bootstrap(user_a_name: str = "Thiago", user_b_name: str = "Marina") -> None:
+    """Migrates the schema and seeds defaults once per process.
+
+    Streamlit reruns the whole script on every interaction; only the first
+    call in the process touches the database, later calls return immediately.
+    The defaults go to the HOUSEHOLD_ID household, whichever one the caller
+    is scoped to; src.database.add_household seeds the others.
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        migrate()
+        with use_household(DEFAULT_HOUSEHOLD_ID):
+            upsert_default_users(user_a_name, user_b_name)
+            upsert_default_categories()
+        _bootstrapped = True
+
+if __name__ == "__main__":
+    # Run ahead of the app (see start.sh) so deploys apply DDL before serving.
+    done = migrate()
+    print(f"Migrações aplicadas: {done}" if done else "Esquema já está atualizado.")
@@ -0,0 +1,136 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+from psycopg import AsyncCursor, Cursor
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from src import diagnostics
+
+def database_url() -> str:
+    """DATABASE_URL as it is when a pool opens, not when this module was
+    imported: tools that run on a scratch database (src.storage_conformance)
+    set it after the modules are loaded."""
+    return os.getenv("DATABASE_URL", "")
+
+# Pool sizing and recycling. Streamlit serves every browser session from the
+# same process, so a handful of connections is usually plenty.
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Idle connections above min_size are closed after this many seconds.
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+# Every connection is replaced after this many seconds, idle or not.
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+# Validate connections before handing them out (hosted Postgres drops idle sockets).
+POOL_CHECK = os.getenv("DB_POOL_CHECK", "1") not in ("0", "false", "False", "")
+
+def _sql_text(query, cursor) -> str:
+    return query if isinstance(query, str) else query.as_string(cursor)
+
+def _record(query, cursor, seconds: float) -> None:
+    sql = _sql_text(query, cursor)
+    # The pool's connection check runs an empty statement: that round trip is
+    # part of the acquire time, not a query of its own.
+    if sql:
+        diagnostics.record_query(sql, seconds, cursor.rowcount)
+
+class TimedCursor(Cursor):
+    """Cursor that reports every statement to src.diagnostics."""
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            _record(query, self, time.perf_counter() - start)
+
+    def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            _record(query, self, time.perf_counter() - start)
+
+    @contextmanager
+    def copy(self, statement, params=None, **kwargs):
+        # Timed from start to end of the COPY block, rows streamed included.
+        start = time.perf_counter()
+        try:
+            with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+        finally:
+            _record(statement, self, time.perf_counter() - start)
+
+class TimedAsyncCursor(AsyncCursor):
+    """Async counterpart of TimedCursor, for src.database_async."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            _record(query, self, time.perf_counter() - start)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            _record(query, self, time.perf_counter() - start)
+
+@contextmanager
+def timed_connection(pool):
+    """pool.connection(), reporting the time spent waiting for it."""
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        diagnostics.record_acquire(time.perf_counter() - start)
+        yield conn
+
+@asynccontextmanager
+async def timed_async_connection(pool):
+    start = time.perf_counter()
+    async with pool.connection() as conn:
+        diagnostics.record_acquire(time.perf_counter() - start)
+        yield conn
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, opening it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                url = database_url()
+                if not url:
+                    raise RuntimeError("DATABASE_URL não definida. Configure no seu ambiente.")
+                _pool = ConnectionPool(
+                    url,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+                    timeout=POOL_TIMEOUT,
+                    max_idle=POOL_MAX_IDLE,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    kwargs={"row_factory": dict_row, "cursor_factory": TimedCursor},
+                    check=ConnectionPool.check_connection if POOL_CHECK else None,
+                    name="casa-split",
+                    open=True,
+                )
+                atexit.register(close_pool)
+    return _pool
+
+def close_pool() -> None:
+    """Closes the pool and all its connections (safe to call more than once)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def pool_stats() -> dict:
+    """Returns the pool counters (connections in use, waiting clients, ...)."""
+    return get_pool().get_stats()
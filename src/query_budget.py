@@ -0,0 +1,204 @@
+"""
+Query-count budgets for each page of app.py.
+
+Drives the app headlessly with Streamlit's AppTest against a scratch
+database, counts the statements and connections of every rerun through
+src.diagnostics and fails when a scenario goes over its budget. Each
+scenario is measured cold (cache cleared first) and warm (the same rerun
+again), so both a new N+1 loop and a read that stopped being cached show up.
+
+    python -m src.query_budget                      # SQLite in a temporary file
+    QUERY_BUDGET_DATABASE_URL=postgresql://.../casa_split_test \\
+        python -m src.query_budget --backend postgres
+    python -m src.query_budget --verbose            # statements of each rerun
+
+The Postgres run truncates QUERY_BUDGET_DATABASE_URL first: never point it
+at real data. Exit code 1 if any scenario is over budget.
+"""
+import argparse
+import os
+import sys
+from datetime import date
+from typing import Callable, Dict, List, Tuple, TypedDict
+from src import diagnostics
+from src.storage_conformance import scratch_storage
+from src.tenancy import DEFAULT_HOUSEHOLD_ID
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+APP_TIMEOUT = 60
+
+# Expenses seeded in the current month: more than two pages of
+# EXPENSES_PAGE_SIZE, so a per-row query blows any budget below.
+SEED_MONTH_ROWS = 45
+
+class Budget(TypedDict):
+    # Statements in the worst rerun with an empty cache
+    cold: int
+    # Statements in the worst rerun repeated right after
+    warm: int
+    # Connections borrowed (Postgres) or opened (SQLite) in the worst rerun
+    connections: int
+
+Action = Callable[..., None]
+
+def _goto(page: str) -> Action:
+    def action(at) -> None:
+        at.sidebar.radio[0].set_value(page).run()
+    return action
+
+def _click(label: str) -> Action:
+    def action(at) -> None:
+        next(b for b in at.button if b.label == label).click().run()
+    return action
+
+def _start(at) -> None:
+    at.run()
+
+# (name, action). Run in order on one AppTest session; each action is one
+# user interaction and may span several reruns (st.rerun()).
+SCENARIOS: List[Tuple[str, Action]] = [
+    ("startup", _start),
+    ("Adicionar gasto", _goto("Adicionar gasto")),
+    ("Importar extrato", _goto("Importar extrato")),
+    ("Resumo do mês", _goto("Resumo do mês")),
+    ("Resumo do mês: próxima página", _click("Próxima ▶")),
+    ("Resumo do mês: editar gasto", _click("📝")),
+    ("Resumo do ano", _goto("Resumo do ano")),
+    ("Fechamento", _goto("Fechamento")),
+    ("Configurações", _goto("Configurações")),
+]
+
+# Declared per backend, at today's counts: raise a number only together with
+# the change that needs it. SQLite has no cache in front of it (warm == cold),
+# reports BEGIN IMMEDIATE as a statement and keeps one connection per thread;
+# Postgres borrows a pool connection per call, and the month page's async
+# loader runs its six reads (five plus the closed-month snapshot) on
+# connections of their own. Fechamento and the month reads look up the
+# month's snapshot first; uncached on SQLite, that is one more statement
+# per public read of an open month. On Postgres every page also looks up the
+# household of its ?casa= link (cached like any read).
+BUDGETS: Dict[str, Dict[str, Budget]] = {
+    "postgres": {
+        "startup": {"cold": 14, "warm": 0, "connections": 6},
+        "Adicionar gasto": {"cold": 3, "warm": 0, "connections": 3},
+        "Importar extrato": {"cold": 3, "warm": 0, "connections": 3},
+        "Resumo do mês": {"cold": 7, "warm": 0, "connections": 7},
+        "Resumo do mês: próxima página": {"cold": 7, "warm": 0, "connections": 7},
+        "Resumo do mês: editar gasto": {"cold": 7, "warm": 0, "connections": 7},
+        "Resumo do ano": {"cold": 3, "warm": 0, "connections": 3},
+        "Fechamento": {"cold": 6, "warm": 0, "connections": 6},
+        "Configurações": {"cold": 3, "warm": 0, "connections": 3},
+    },
+    "sqlite": {
+        "startup": {"cold": 53, "warm": 2, "connections": 1},
+        "Adicionar gasto": {"cold": 2, "warm": 2, "connections": 1},
+        "Importar extrato": {"cold": 2, "warm": 2, "connections": 1},
+        "Resumo do mês": {"cold": 7, "warm": 7, "connections": 1},
+        "Resumo do mês: próxima página": {"cold": 7, "warm": 7, "connections": 1},
+        "Resumo do mês: editar gasto": {"cold": 7, "warm": 7, "connections": 1},
+        "Resumo do ano": {"cold": 2, "warm": 2, "connections": 1},
+        "Fechamento": {"cold": 6, "warm": 6, "connections": 1},
+        "Configurações": {"cold": 2, "warm": 2, "connections": 1},
+    },
+}
+
+class Measurement(TypedDict):
+    reruns: int
+    queries: int
+    connections: int
+    rerun_ids: List[int]
+
+def _measure(at, action: Action) -> Measurement:
+    """Runs one interaction and returns its worst rerun."""
+    seen = {r["rerun_id"] for r in diagnostics.reruns()}
+    action(at)
+    if at.exception:
+        raise RuntimeError(f"app.py falhou: {at.exception[0].value}")
+    new = [r for r in diagnostics.reruns() if r["rerun_id"] not in seen]
+    return {
+        "reruns": len(new),
+        "queries": max((r["queries"] for r in new), default=0),
+        "connections": max((r["connections"] for r in new), default=0),
+        "rerun_ids": [r["rerun_id"] for r in new],
+    }
+
+def _seed(storage) -> None:
+    """A current month with a few pages of expenses, and a settled previous month."""
+    a, b = storage.get_users()
+    today = date.today()
+    previous = date(today.year - (today.month == 1), (today.month - 2) % 12 + 1, 10)
+    split = {a["id"]: 5000, b["id"]: 5000}
+    storage.bulk_add_expenses([
+        {"spent_at": today.replace(day=1 + i % min(today.day, 28)).isoformat(), "amount_cents": 1000 + i,
+         "payer_user_id": (a, b)[i % 2]["id"], "category": "Mercado", "description": f"Gasto {i}", "split_bp": split}
+        for i in range(SEED_MONTH_ROWS)
+    ] + [
+        {"spent_at": previous.isoformat(), "amount_cents": 5000, "payer_user_id": a["id"],
+         "category": "Contas", "description": "Luz", "split_bp": split}
+    ])
+    storage.record_settlements(previous.strftime("%Y-%m"), [(b["id"], a["id"], 2500)])
+
+def _print_statements(rerun_ids: List[int]) -> None:
+    for rerun_id in rerun_ids:
+        for q in diagnostics.queries(rerun_id):
+            print(f"      #{rerun_id} {q['duration_ms']:8.2f} ms  {q['function'] or '-':<22} {q['sql'][:90]}")
+
+def run(backend: str, verbose: bool = False) -> List[str]:
+    """Measures every scenario; returns one line per budget exceeded."""
+    # scratch_storage first: the Postgres run must point DATABASE_URL at
+    # QUERY_BUDGET_DATABASE_URL before anything opens the pool.
+    storage = scratch_storage(backend, "QUERY_BUDGET_DATABASE_URL")
+    from streamlit.testing.v1 import AppTest
+    from src.cache import cache
+    from src.storage import use_storage
+
+    use_storage(storage)
+    budgets = BUDGETS[backend]
+    at = AppTest.from_file(APP_PATH, default_timeout=APP_TIMEOUT)
+    # With several households the app only opens one from its link.
+    for household in storage.list_households():
+        if household["id"] == DEFAULT_HOUSEHOLD_ID:
+            at.query_params["casa"] = household["slug"]
+    diagnostics.clear()
+
+    failures: List[str] = []
+    print(f"[{backend}] {'cenário':<32} {'frio':>9} {'quente':>9} {'conexões':>9}")
+    for name, action in SCENARIOS:
+        cache.clear()
+        cold = _measure(at, action)
+        if name == "startup":
+            # Seed once the app has created the schema and the users; the
+            # writes invalidate what they touch, like any other write.
+            _seed(storage)
+        warm = _measure(at, _start)
+        budget = budgets[name]
+        connections = max(cold["connections"], warm["connections"])
+        over = [
+            f"{label} {got} > {limit}"
+            for label, got, limit in (
+                ("frio", cold["queries"], budget["cold"]),
+                ("quente", warm["queries"], budget["warm"]),
+                ("conexões", connections, budget["connections"]),
+            )
+            if got > limit
+        ]
+        print(
+            f"[{backend}] {name:<32} {cold['queries']:>4}/{budget['cold']:<4} {warm['queries']:>4}/{budget['warm']:<4} "
+            f"{connections:>4}/{budget['connections']:<4} {'ACIMA: ' + ', '.join(over) if over else 'ok'}"
+        )
+        if over or verbose:
+            _print_statements(cold["rerun_ids"] + warm["rerun_ids"])
+        if over:
+            failures.append(f"{backend} {name}: {', '.join(over)}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Falha se alguma página do app passar do orçamento de consultas.")
+    parser.add_argument("--backend", choices=sorted(BUDGETS), default="sqlite")
+    parser.add_argument("--verbose", action="store_true", help="Lista as consultas de cada execução")
+    args = parser.parse_args()
+    found = run(args.backend, args.verbose)
+    for line in found:
+        print(f"ACIMA DO ORÇAMENTO {line}")
+    print("OK: todas as páginas dentro do orçamento." if not found else f"{len(found)} cenário(s) acima do orçamento.")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,123 @@
+"""
+Checks that the hot queries keep using indexes as history grows.
+
+Seeds a realistic volume of expenses into temporary copies of the tables
+(same columns and indexes, `LIKE ... INCLUDING ALL`), ANALYZEs them and runs
+EXPLAIN on the statements src.database actually executes. Temporary tables
+shadow the real ones for the session, so the real data and its statistics are
+never touched and everything is rolled back at the end.
+
+    python -m src.query_plans            # exit code 1 if a seq scan shows up
+    python -m src.query_plans --rows 200000
+"""
+import argparse
+import sys
+from datetime import date
+from typing import Any, Dict, Iterator, List, Tuple
+from src.database import (
+    get_connection,
+    LIST_EXPENSES_MONTH_SQL,
+    LIST_EXPENSES_FIRST_PAGE_SQL,
+    LIST_EXPENSES_NEXT_PAGE_SQL,
+    MONTH_TOTALS_SQL,
+    MONTH_BALANCES_SQL,
+    FIND_DUPLICATES_SQL,
+    RENAME_CATEGORY_SQL,
+    BALANCES_AS_OF_SQL,
+)
+
+# Tables that must never be read with a sequential scan on the hot path.
+WATCHED_TABLES = {"expenses", "expense_splits", "ledger_entries"}
+
+SEED_YEARS = 5
+SEED_CATEGORIES = 40
+# The expenses are spread over this many households; the plans are for household 1.
+SEED_HOUSEHOLDS = 20
+
+def hot_queries() -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Returns (name, sql, params) for each statement to EXPLAIN."""
+    month = {"household": 1, "start": date(2022, 6, 1), "end": date(2022, 7, 1)}
+    return [
+        ("list_expenses_month", LIST_EXPENSES_MONTH_SQL, month),
+        ("list_expenses_page", LIST_EXPENSES_FIRST_PAGE_SQL, {**month, "limit": 21}),
+        ("list_expenses_page (cursor)", LIST_EXPENSES_NEXT_PAGE_SQL,
+         {**month, "limit": 21, "after_date": date(2022, 6, 15), "after_id": 10_000}),
+        ("get_month_totals", MONTH_TOTALS_SQL, {"household": 1, "month": "2022-06", "a": 1, "b": 2}),
+        ("get_month_balances", MONTH_BALANCES_SQL, {"household": 1, "month": "2022-06"}),
+        ("find_duplicates", FIND_DUPLICATES_SQL,
+         {"household": 1, "fingerprints": ["c4ca4238a0b923820dcc509a6f75849b"]}),
+        ("update_category", RENAME_CATEGORY_SQL, {"household": 1, "new": "Categoria 1b", "old": "Categoria 1"}),
+        ("get_balances (as_of)", BALANCES_AS_OF_SQL, {"household": 1, "as_of": date(2022, 6, 15)}),
+    ]
+
+def _seed(cur, rows: int) -> None:
+    """Creates and fills temporary shadows of the expense, category and ledger tables."""
+    cur.execute("CREATE TEMP TABLE expenses (LIKE public.expenses INCLUDING ALL) ON COMMIT DROP;")
+    cur.execute("CREATE TEMP TABLE expense_splits (LIKE public.expense_splits INCLUDING ALL) ON COMMIT DROP;")
+    cur.execute("CREATE TEMP TABLE categories (LIKE public.categories INCLUDING ALL) ON COMMIT DROP;")
+    cur.execute(
+        """INSERT INTO categories(id, household_id, name)
+           SELECT g, 1, 'Categoria ' || g FROM generate_series(1, %(categories)s) AS g;""",
+        {"categories": SEED_CATEGORIES}
+    )
+    cur.execute(
+        """INSERT INTO expenses(id, household_id, created_at, spent_at, amount_cents, payer_user_id, category_id,
+                               description, fingerprint)
+           SELECT g, 1 + g %% %(households)s, now(),
+                  DATE '2020-01-01' + (g %% (365 * %(years)s)),
+                  100 + (g::bigint * 7919) %% 50000,
+                  1 + g %% 2,
+                  1 + g %% %(categories)s,
+                  'Gasto ' || g,
+                  md5(g::text)
+           FROM generate_series(1, %(rows)s) AS g;""",
+        {"rows": rows, "years": SEED_YEARS, "categories": SEED_CATEGORIES, "households": SEED_HOUSEHOLDS}
+    )
+    cur.execute(
+        """INSERT INTO expense_splits(expense_id, user_id, share_bp)
+           SELECT id, u, 5000 FROM expenses CROSS JOIN (VALUES (1), (2)) AS users(u);"""
+    )
+    cur.execute("CREATE TEMP TABLE ledger_entries (LIKE public.ledger_entries INCLUDING ALL) ON COMMIT DROP;")
+    cur.execute(
+        """INSERT INTO ledger_entries(household_id, user_id, recorded_at, effective_on, kind, expense_id,
+                                      delta_bp_cents, balance_after_bp_cents)
+           SELECT household_id, u, spent_at, spent_at, 'expense', id,
+                  amount_cents * 5000 * (CASE WHEN u = payer_user_id THEN 1 ELSE -1 END), 0
+           FROM expenses CROSS JOIN (VALUES (1), (2)) AS users(u);"""
+    )
+    cur.execute("ANALYZE categories;")
+    cur.execute("ANALYZE expenses;")
+    cur.execute("ANALYZE expense_splits;")
+    cur.execute("ANALYZE ledger_entries;")
+
+def _walk(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+def check_query_plans(rows: int = 50_000) -> List[str]:
+    """Returns one message per hot query that seq-scans a watched table."""
+    problems: List[str] = []
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                _seed(cur, rows)
+                for name, sql, params in hot_queries():
+                    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                    plan = cur.fetchone()["QUERY PLAN"][0]["Plan"]
+                    for node in _walk(plan):
+                        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in WATCHED_TABLES:
+                            problems.append(f"{name}: Seq Scan em {node['Relation Name']}")
+        finally:
+            conn.rollback()
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Falha se consultas críticas voltarem a usar Seq Scan.")
+    parser.add_argument("--rows", type=int, default=50_000, help="Gastos sintéticos a semear (padrão 50000)")
+    args = parser.parse_args()
+    found = check_query_plans(args.rows)
+    for problem in found:
+        print(problem)
+    print("OK: nenhuma consulta crítica usa Seq Scan." if not found else f"{len(found)} problema(s).")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,961 @@
+"""
+Embedded SQLite backend for single-household deployments.
+
+Same behaviour as the Postgres functions of src.database, without a server:
+no network hop and no cold-start wake-up of a hosted database. The file runs
+in WAL mode so Streamlit sessions can read while another one writes. Each
+thread gets its own connection (sqlite3 connections are not shared across
+threads); writes take the write lock up front with BEGIN IMMEDIATE.
+
+Reads are local and cheap, so there is no cache in front of them and month
+totals are aggregated on the fly instead of kept in summary tables.
+
+A file holds one household, HOUSEHOLD_ID's: its tables have no
+household_id, and a session scoped to another household (src.tenancy) is
+refused instead of being shown this one's data.
+
+The schema has its own schema_version migrations. Version 1 is the layout
+of the legacy casa_split.db, so an existing file is upgraded in place.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from src.database import (
+    Household,
+    User,
+    Expense,
+    ExpensePage,
+    MonthBalances,
+    MonthClosedError,
+    MonthSnapshot,
+    MonthTotals,
+    MonthView,
+    RangeReport,
+    Settlement,
+    LedgerDelta,
+    DEFAULT_CATEGORIES,
+    EXPENSES_PAGE_SIZE,
+    EXPORT_BATCH_SIZE,
+    expense_fingerprint,
+    expense_ledger_deltas,
+    settlement_ledger_deltas,
+    _month_balances_from_rows,
+    _month_bounds,
+    _month_snapshot_from_json,
+    _month_totals_from_balances,
+    _range_report_from_rows,
+    _snapshot_page,
+)
+from src import diagnostics
+from src.diagnostics import traced
+from src.migrations import legacy_split_bp
+from src.storage import Storage
+from src.tenancy import DEFAULT_HOUSEHOLD_ID, current_household
+
+# Seconds a writer waits for the lock held by another connection.
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+# Applied to every connection. WAL lets readers proceed during a write, and
+# synchronous=NORMAL is durable across application crashes in WAL mode
+# (only a power loss can drop the last commits).
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA foreign_keys=ON;",
+    "PRAGMA temp_store=MEMORY;",
+    # Negative means KiB: 20 MB page cache per connection.
+    "PRAGMA cache_size=-20000;",
+    "PRAGMA mmap_size=134217728;",
+)
+
+class TimedCursor(sqlite3.Cursor):
+    """Reports every statement to src.diagnostics.
+
+    sqlite3 steps through a SELECT while it is fetched, so statements that
+    return rows are recorded on their first fetch, with the fetch time and
+    row count included.
+    """
+    _pending: Optional[Tuple[str, float]] = None
+
+    def execute(self, sql: str, parameters: Any = ()) -> "TimedCursor":
+        self._flush(0.0, -1)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except Exception:
+            diagnostics.record_query(sql, time.perf_counter() - start, -1)
+            raise
+        elapsed = time.perf_counter() - start
+        if self.description is None:
+            diagnostics.record_query(sql, elapsed, self.rowcount)
+        else:
+            self._pending = (sql, elapsed)
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> "TimedCursor":
+        self._flush(0.0, -1)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            diagnostics.record_query(sql, time.perf_counter() - start, self.rowcount)
+        return self
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._flush(time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchall(self) -> List[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._flush(time.perf_counter() - start, len(rows))
+        return rows
+
+    def _flush(self, fetch_seconds: float, rows: int) -> None:
+        if self._pending is not None:
+            sql, elapsed = self._pending
+            self._pending = None
+            diagnostics.record_query(sql, elapsed + fetch_seconds, rows)
+
+Step = Union[str, Callable[[sqlite3.Cursor], None]]
+Migration = Tuple[int, str, List[Step]]
+
+def _backfill_fingerprints(cur: sqlite3.Cursor) -> None:
+    rows = cur.execute("SELECT id, spent_at, amount_cents, payer_user_id, description FROM expenses;").fetchall()
+    cur.executemany(
+        "UPDATE expenses SET fingerprint=? WHERE id=?;",
+        [(expense_fingerprint(r["spent_at"], r["amount_cents"], r["payer_user_id"], r["description"]), r["id"])
+         for r in rows]
+    )
+
+def _backfill_expense_splits(cur: sqlite3.Cursor) -> None:
+    # Same decoding as the Postgres backfill (src.migrations.legacy_split_bp).
+    user_ids = [r["id"] for r in cur.execute("SELECT id FROM users;").fetchall()]
+    cur.executemany(
+        "INSERT INTO expense_splits(expense_id, user_id, share_bp) VALUES (?, ?, ?);",
+        [
+            (r["id"], user_id, share)
+            for r in cur.execute("SELECT id, split_json FROM expenses;").fetchall()
+            for user_id, share in legacy_split_bp(r["split_json"], user_ids).items()
+        ]
+    )
+
+def _replay_ledger(cur: sqlite3.Cursor) -> None:
+    """Fills the (empty) ledger from the expenses and settlements, like
+    src.database.rebuild_ledger: oldest first by effective date, each entry
+    recorded at its effective date (capped at now)."""
+    cur.execute(
+        """INSERT INTO ledger_entries(user_id, recorded_at, effective_on, kind, expense_id, month,
+                                      delta_bp_cents, balance_after_bp_cents)
+           SELECT user_id, MIN(effective_on || 'T00:00:00', :now), effective_on, kind, expense_id, month, delta,
+                  SUM(delta) OVER (PARTITION BY user_id ORDER BY effective_on, kind, expense_id, seq)
+           FROM (
+               SELECT d.user_id, e.spent_at AS effective_on, 'expense' AS kind, e.id AS expense_id,
+                      NULL AS month, 0 AS seq, SUM(d.delta) AS delta
+               FROM expenses e
+               JOIN (
+                   SELECT id AS expense_id, payer_user_id AS user_id, amount_cents * 10000 AS delta FROM expenses
+                   UNION ALL
+                   SELECT s.expense_id, s.user_id, -x.amount_cents * s.share_bp
+                   FROM expense_splits s JOIN expenses x ON x.id = s.expense_id
+               ) d ON d.expense_id = e.id
+               GROUP BY d.user_id, e.id
+               HAVING SUM(d.delta) <> 0
+               UNION ALL
+               SELECT from_user_id, COALESCE(substr(paid_at, 1, 10), month || '-01'), 'settlement', NULL, month, id,
+                      amount_cents * 10000
+               FROM settlements
+               UNION ALL
+               SELECT to_user_id, COALESCE(substr(paid_at, 1, 10), month || '-01'), 'settlement', NULL, month, id,
+                      -amount_cents * 10000
+               FROM settlements
+           )
+           ORDER BY effective_on, kind, expense_id, seq;""",
+        {"now": datetime.utcnow().isoformat()}
+    )
+
+def _save_month_snapshot(cur: sqlite3.Cursor, month: str, closed_at: str) -> None:
+    """Freezes the month's balances and expense list as they read now."""
+    balances = _month_balances(cur.execute(_MONTH_BALANCES_SQL, _month_range(month)).fetchall())
+    expenses = [_expense_from_row(r) for r in cur.execute(_LIST_EXPENSES_MONTH_SQL, _month_range(month)).fetchall()]
+    cur.execute(
+        """INSERT INTO month_snapshots(month, closed_at, balances, expenses) VALUES (?, ?, ?, ?)
+           ON CONFLICT(month) DO UPDATE
+               SET closed_at = excluded.closed_at, balances = excluded.balances, expenses = excluded.expenses;""",
+        (month, closed_at, json.dumps(balances), json.dumps(expenses, ensure_ascii=False))
+    )
+
+def _snapshot_settled_months(cur: sqlite3.Cursor) -> None:
+    """Closes the months that already have a Fechamento."""
+    for r in cur.execute(
+        "SELECT month, MAX(paid_at) AS paid_at FROM settlements GROUP BY month;"
+    ).fetchall():
+        _save_month_snapshot(cur, r["month"], r["paid_at"] or datetime.utcnow().isoformat())
+
+# Ordered, append-only, mirroring src.migrations step for step.
+MIGRATIONS: List[Migration] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            spent_at TEXT NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            payer_user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            split_json TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settlements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT NOT NULL UNIQUE,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            paid_at TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        );
+        """,
+    ]),
+    (2, "structured expense splits", [
+        """
+        CREATE TABLE expense_splits (
+            expense_id INTEGER NOT NULL REFERENCES expenses(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            share_bp INTEGER NOT NULL CHECK (share_bp BETWEEN 0 AND 10000),
+            PRIMARY KEY (expense_id, user_id)
+        );
+        """,
+        _backfill_expense_splits,
+        "ALTER TABLE expenses DROP COLUMN split_json;",
+    ]),
+    (3, "indexes for month listing and category renames", [
+        "CREATE INDEX IF NOT EXISTS expenses_spent_at_id_idx ON expenses (spent_at DESC, id DESC);",
+        "CREATE INDEX IF NOT EXISTS expenses_category_idx ON expenses (category);",
+    ]),
+    (4, "expense fingerprints for duplicate detection", [
+        # SQLite can't add NOT NULL to an existing column; every write sets it.
+        "ALTER TABLE expenses ADD COLUMN fingerprint TEXT;",
+        _backfill_fingerprints,
+        "CREATE INDEX expenses_fingerprint_idx ON expenses (fingerprint);",
+    ]),
+    (5, "expenses reference categories by id; deleted categories are archived", [
+        "ALTER TABLE categories ADD COLUMN archived INTEGER NOT NULL DEFAULT 0;",
+        "INSERT OR IGNORE INTO categories(name, archived) SELECT DISTINCT category, 1 FROM expenses;",
+        # Nullable as far as SQLite is concerned (no NOT NULL on ADD COLUMN);
+        # every write sets it.
+        "ALTER TABLE expenses ADD COLUMN category_id INTEGER REFERENCES categories(id);",
+        "UPDATE expenses SET category_id = (SELECT c.id FROM categories c WHERE c.name = expenses.category);",
+        "DROP INDEX IF EXISTS expenses_category_idx;",
+        "CREATE INDEX expenses_category_id_idx ON expenses (category_id);",
+        "ALTER TABLE expenses DROP COLUMN category;",
+    ]),
+    (6, "idempotency keys for queued expense writes", [
+        "ALTER TABLE expenses ADD COLUMN idempotency_key TEXT;",
+        "CREATE UNIQUE INDEX expenses_idempotency_key_idx ON expenses (idempotency_key);",
+    ]),
+    (7, "several settlement transfers per month", [
+        # SQLite can't drop a UNIQUE constraint: rebuild the table without it.
+        """
+        CREATE TABLE settlements_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT NOT NULL,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            paid_at TEXT
+        );
+        """,
+        "INSERT INTO settlements_new SELECT id, month, from_user_id, to_user_id, amount_cents, paid_at FROM settlements;",
+        "DROP TABLE settlements;",
+        "ALTER TABLE settlements_new RENAME TO settlements;",
+        "CREATE INDEX settlements_month_idx ON settlements (month);",
+    ]),
+    (8, "append-only ledger of balance changes", [
+        # No user_balances table: writers hold the file's write lock, so the
+        # last entry of each user is their running balance.
+        """
+        CREATE TABLE ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            recorded_at TEXT NOT NULL,
+            effective_on TEXT NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('expense', 'settlement')),
+            expense_id INTEGER,
+            month TEXT,
+            delta_bp_cents INTEGER NOT NULL,
+            balance_after_bp_cents INTEGER NOT NULL
+        );
+        """,
+        "CREATE INDEX ledger_entries_user_recorded_idx ON ledger_entries (user_id, recorded_at DESC, id DESC);",
+        _replay_ledger,
+    ]),
+    (9, "frozen snapshots of closed months", [
+        """
+        CREATE TABLE month_snapshots (
+            month TEXT PRIMARY KEY,
+            closed_at TEXT NOT NULL,
+            -- JSON: MonthBalances and the list_expenses_month rows at closing
+            balances TEXT NOT NULL,
+            expenses TEXT NOT NULL
+        );
+        """,
+        _snapshot_settled_months,
+    ]),
+]
+
+# Last ledger entry of a user (u.id) up to :as_of: their balance at that moment.
+_LEDGER_BALANCE_SQL = """
+    SELECT balance_after_bp_cents FROM ledger_entries l
+    WHERE l.user_id = u.id AND l.recorded_at <= :as_of
+    ORDER BY l.recorded_at DESC, l.id DESC
+    LIMIT 1
+"""
+
+# Columns shared by the month listing and the page queries (FROM expenses e
+# JOIN categories c); splits come back as a JSON object {"user_id": share_bp}.
+_EXPENSE_COLUMNS = """
+    e.id, e.spent_at, e.amount_cents, e.payer_user_id, c.name AS category,
+    COALESCE(e.description, '') AS description,
+    (SELECT json_group_object(CAST(s.user_id AS TEXT), s.share_bp) FROM expense_splits s WHERE s.expense_id = e.id) AS split,
+    EXISTS (SELECT 1 FROM expenses d WHERE d.fingerprint = e.fingerprint AND d.id <> e.id) AS is_duplicate
+"""
+
+_LIST_EXPENSES_MONTH_SQL = f"""
+    SELECT {_EXPENSE_COLUMNS} FROM expenses e JOIN categories c ON c.id = e.category_id
+    WHERE e.spent_at >= :start AND e.spent_at < :end
+    ORDER BY e.spent_at DESC, e.id DESC;
+"""
+
+# Every user's paid and quota (cents x basis points) for the month, in the
+# rows _month_balances_from_rows expects.
+_MONTH_BALANCES_SQL = """
+    SELECT (SELECT COUNT(*) FROM expenses
+            WHERE spent_at >= :start AND spent_at < :end) AS expense_count,
+           (SELECT COALESCE(SUM(amount_cents), 0) FROM expenses
+            WHERE spent_at >= :start AND spent_at < :end) AS total_cents,
+           u.user_id, u.paid_cents, u.quota_bp
+    FROM (SELECT 1) k
+    LEFT JOIN (
+        SELECT user_id, SUM(paid) AS paid_cents, SUM(quota) AS quota_bp
+        FROM (
+            SELECT e.payer_user_id AS user_id, e.amount_cents AS paid, 0 AS quota
+            FROM expenses e WHERE e.spent_at >= :start AND e.spent_at < :end
+            UNION ALL
+            SELECT s.user_id, 0, e.amount_cents * s.share_bp
+            FROM expenses e JOIN expense_splits s ON s.expense_id = e.id
+            WHERE e.spent_at >= :start AND e.spent_at < :end
+        )
+        GROUP BY user_id
+    ) u ON 1
+    ORDER BY u.user_id;
+"""
+
+_RANGE_REPORT_SQL = """
+    SELECT 'expense' AS kind, g.month, cat.name AS category, g.user_id,
+           g.expense_count, g.paid_cents, g.quota_bp_cents, 0 AS settled_cents
+    FROM (
+        SELECT month, category_id, user_id,
+               SUM(n) AS expense_count, SUM(paid) AS paid_cents, SUM(quota) AS quota_bp_cents
+        FROM (
+            SELECT substr(e.spent_at, 1, 7) AS month, e.category_id, e.payer_user_id AS user_id,
+                   1 AS n, e.amount_cents AS paid, 0 AS quota
+            FROM expenses e WHERE e.spent_at >= :start AND e.spent_at < :end
+            UNION ALL
+            SELECT substr(e.spent_at, 1, 7), e.category_id, s.user_id, 0, 0, e.amount_cents * s.share_bp
+            FROM expenses e JOIN expense_splits s ON s.expense_id = e.id
+            WHERE e.spent_at >= :start AND e.spent_at < :end
+        )
+        GROUP BY month, category_id, user_id
+    ) g
+    JOIN categories cat ON cat.id = g.category_id
+    UNION ALL
+    SELECT 'settlement', month, NULL, user_id, 0, 0, 0, SUM(amount)
+    FROM (
+        SELECT month, from_user_id AS user_id, amount_cents AS amount FROM settlements
+        WHERE paid_at IS NOT NULL AND month >= :start_month AND month <= :end_month
+        UNION ALL
+        SELECT month, to_user_id, -amount_cents FROM settlements
+        WHERE paid_at IS NOT NULL AND month >= :start_month AND month <= :end_month
+    )
+    GROUP BY month, user_id;
+"""
+
+# Adds a category, or brings back an archived one.
+_ACTIVATE_CATEGORY_SQL = """
+    INSERT INTO categories(name) VALUES (?)
+    ON CONFLICT(name) DO UPDATE SET archived = 0 WHERE archived;
+"""
+
+def _round_bp(value: int) -> int:
+    """cents x basis points -> cents, half away from zero like Postgres ROUND."""
+    return (value + 5000) // 10000 if value >= 0 else -((-value + 5000) // 10000)
+
+def _expense_from_row(r: sqlite3.Row) -> Expense:
+    return {
+        "id": r["id"],
+        "spent_at": r["spent_at"],
+        "amount_cents": r["amount_cents"],
+        "amount": r["amount_cents"] / 100.0,
+        "payer_user_id": r["payer_user_id"],
+        "category": r["category"],
+        "description": r["description"],
+        "split_bp": {int(k): v for k, v in json.loads(r["split"] or "{}").items()},
+        "is_duplicate": bool(r["is_duplicate"]),
+    }
+
+def _month_range(month_yyyy_mm: str) -> Dict[str, str]:
+    start, end = _month_bounds(month_yyyy_mm)
+    return {"start": start.isoformat(), "end": end.isoformat()}
+
+def _month_balances(rows: List[sqlite3.Row]) -> MonthBalances:
+    return _month_balances_from_rows([
+        {**dict(r), "quota_cents": None if r["user_id"] is None else _round_bp(r["quota_bp"])} for r in rows
+    ])
+
+def _check_months_open(cur: sqlite3.Cursor, months: Iterable[str]) -> None:
+    """Raises MonthClosedError if any of `months` is closed (the caller holds the write lock)."""
+    unique = sorted(set(months))
+    closed = [r[0] for r in cur.execute(
+        f"SELECT month FROM month_snapshots WHERE month IN ({','.join('?' * len(unique))});", unique
+    ).fetchall()]
+    if closed:
+        raise MonthClosedError(closed)
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite file."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._bootstrapped = False
+        self._bootstrap_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if current_household() != DEFAULT_HOUSEHOLD_ID:
+            raise RuntimeError(
+                f"O arquivo SQLite guarda só a casa {DEFAULT_HOUSEHOLD_ID}; várias casas precisam do Postgres."
+            )
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            start = time.perf_counter()
+            # isolation_level=None: no implicit transactions, see _transaction.
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            # Connections are per thread and kept open, so only opening one counts.
+            diagnostics.record_acquire(time.perf_counter() - start)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """A write transaction holding the database write lock from the start."""
+        conn = self._connection()
+        cur = conn.cursor(TimedCursor)
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            yield cur
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            cur.close()
+
+    def _query(self, sql: str, params: Any = ()) -> List[sqlite3.Row]:
+        cur = self._connection().cursor(TimedCursor)
+        try:
+            return cur.execute(sql, params).fetchall()
+        finally:
+            cur.close()
+
+    # --- schema ---
+
+    @traced
+    def migrate(self) -> List[int]:
+        applied: List[int] = []
+        with self._transaction() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            current = cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;").fetchone()[0]
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_version(version, description) VALUES (?, ?);",
+                    (version, description)
+                )
+                applied.append(version)
+        return applied
+
+    @traced
+    def bootstrap(self, user_a_name: str = "Thiago", user_b_name: str = "Marina") -> None:
+        if self._bootstrapped:
+            return
+        with self._bootstrap_lock:
+            if self._bootstrapped:
+                return
+            self.migrate()
+            with self._transaction() as cur:
+                if cur.execute("SELECT COUNT(*) FROM users;").fetchone()[0] == 0:
+                    cur.executemany("INSERT INTO users(name) VALUES (?);", [(user_a_name,), (user_b_name,)])
+            self.upsert_default_categories()
+            self._bootstrapped = True
+
+    # --- households ---
+
+    def get_household(self, slug: str) -> Optional[Household]:
+        return None
+
+    def add_household(self, name: str, member_names: List[str]) -> Household:
+        raise RuntimeError("O arquivo SQLite guarda uma casa só; várias casas precisam do Postgres.")
+
+    def list_households(self) -> List[Household]:
+        return []
+
+    # --- users and categories ---
+
+    @traced
+    def get_users(self) -> List[User]:
+        return [{"id": r["id"], "name": r["name"]} for r in self._query("SELECT id, name FROM users ORDER BY id ASC;")]
+
+    @traced
+    def add_user(self, name: str) -> None:
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO users(name) VALUES (?);", (name,))
+
+    @traced
+    def get_categories(self) -> List[str]:
+        return [r["name"] for r in self._query("SELECT name FROM categories WHERE NOT archived ORDER BY name ASC;")]
+
+    @traced
+    def upsert_default_categories(self) -> None:
+        with self._transaction() as cur:
+            cur.executemany(_ACTIVATE_CATEGORY_SQL, [(c,) for c in DEFAULT_CATEGORIES])
+
+    @traced
+    def add_category(self, name: str) -> None:
+        with self._transaction() as cur:
+            cur.execute(_ACTIVATE_CATEGORY_SQL, (name,))
+
+    @traced
+    def update_category(self, old_name: str, new_name: str) -> None:
+        with self._transaction() as cur:
+            cur.execute("UPDATE categories SET name=? WHERE name=?;", (new_name, old_name))
+
+    @traced
+    def delete_category(self, name: str) -> None:
+        with self._transaction() as cur:
+            cur.execute("UPDATE categories SET archived = 1 WHERE name=?;", (name,))
+
+    # --- expenses ---
+
+    @staticmethod
+    def _category_ids(cur: sqlite3.Cursor, names: Iterable[str]) -> Dict[str, int]:
+        """Maps category names to ids; unknown names are created archived,
+        like src.database.CATEGORY_IDS_SQL."""
+        unique = list(set(names))
+        cur.executemany("INSERT OR IGNORE INTO categories(name, archived) VALUES (?, 1);", [(n,) for n in unique])
+        rows = cur.execute(
+            f"SELECT id, name FROM categories WHERE name IN ({','.join('?' * len(unique))});", unique
+        ).fetchall()
+        return {r["name"]: r["id"] for r in rows}
+
+    @staticmethod
+    def _append_ledger(cur: sqlite3.Cursor, deltas: List[LedgerDelta]) -> None:
+        """Appends `deltas` in order, each continuing its user's running balance
+        (safe: the caller holds the write lock)."""
+        if not deltas:
+            return
+        now = datetime.utcnow().isoformat()
+        users = sorted({d[0] for d in deltas})
+        rows = cur.execute(
+            f"""SELECT u.id, ({_LEDGER_BALANCE_SQL.replace(":as_of", "?")}) AS balance
+                FROM users u WHERE u.id IN ({",".join("?" * len(users))});""",
+            [now, *users]
+        ).fetchall()
+        balances = {r["id"]: r["balance"] or 0 for r in rows}
+        entries = []
+        for user_id, kind, expense_id, month, effective_on, delta in deltas:
+            balances[user_id] = balances.get(user_id, 0) + delta
+            entries.append((user_id, now, effective_on, kind, expense_id, month, delta, balances[user_id]))
+        cur.executemany(
+            """INSERT INTO ledger_entries(user_id, recorded_at, effective_on, kind, expense_id, month,
+                                          delta_bp_cents, balance_after_bp_cents)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?);""",
+            entries
+        )
+
+    @staticmethod
+    def _read_splits(cur: sqlite3.Cursor, expense_id: int) -> Dict[int, int]:
+        rows = cur.execute("SELECT user_id, share_bp FROM expense_splits WHERE expense_id=?;", (expense_id,))
+        return {r["user_id"]: r["share_bp"] for r in rows.fetchall()}
+
+    @staticmethod
+    def _write_splits(cur: sqlite3.Cursor, expense_id: int, split_bp: Dict[int, int]) -> None:
+        cur.execute("DELETE FROM expense_splits WHERE expense_id=?;", (expense_id,))
+        cur.executemany(
+            "INSERT INTO expense_splits(expense_id, user_id, share_bp) VALUES (?, ?, ?);",
+            [(expense_id, user_id, share) for user_id, share in split_bp.items()]
+        )
+
+    @traced
+    def add_expense(self, amount_cents, payer_user_id, category, description, spent_at, split_bp,
+                    idempotency_key=None) -> None:
+        fingerprint = expense_fingerprint(spent_at, amount_cents, payer_user_id, description)
+        with self._transaction() as cur:
+            category_id = self._category_ids(cur, [category])[category]
+            cur.execute(
+                """INSERT INTO expenses(created_at, spent_at, amount_cents, payer_user_id, category_id, description,
+                                        fingerprint, idempotency_key)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(idempotency_key) DO NOTHING;""",
+                (datetime.utcnow().isoformat(), str(spent_at)[:10], amount_cents, payer_user_id,
+                 category_id, description, fingerprint, idempotency_key)
+            )
+            if cur.rowcount:
+                _check_months_open(cur, [str(spent_at)[:7]])
+                expense_id = cur.lastrowid
+                self._write_splits(cur, expense_id, split_bp)
+                self._append_ledger(cur, expense_ledger_deltas(
+                    expense_id, spent_at, amount_cents, payer_user_id, split_bp
+                ))
+
+    @traced
+    def bulk_add_expenses(self, expenses: List[Dict[str, Any]]) -> int:
+        """Inserts many expenses in one transaction with executemany.
+
+        Ids are assigned up front past the AUTOINCREMENT high-water mark
+        (the write lock is held), so the split rows can be batched too.
+        """
+        if not expenses:
+            return 0
+        now = datetime.utcnow().isoformat()
+        with self._transaction() as cur:
+            # The write lock is held, so no other writer can store a key meanwhile.
+            keys = [e["idempotency_key"] for e in expenses if e.get("idempotency_key")]
+            if keys:
+                stored = {r[0] for r in cur.execute(
+                    f"SELECT idempotency_key FROM expenses WHERE idempotency_key IN ({','.join('?' * len(keys))});",
+                    keys
+                ).fetchall()}
+                expenses = [e for e in expenses if e.get("idempotency_key") not in stored]
+                if not expenses:
+                    return 0
+            _check_months_open(cur, {str(e["spent_at"])[:7] for e in expenses})
+            first_id = 1 + cur.execute(
+                """SELECT MAX(COALESCE((SELECT MAX(id) FROM expenses), 0),
+                              COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'expenses'), 0));"""
+            ).fetchone()[0]
+            ids = range(first_id, first_id + len(expenses))
+            category_ids = self._category_ids(cur, {e["category"] for e in expenses})
+            cur.executemany(
+                """INSERT INTO expenses(id, created_at, spent_at, amount_cents, payer_user_id, category_id, description,
+                                        fingerprint, idempotency_key)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+                [
+                    (expense_id, now, str(e["spent_at"])[:10], e["amount_cents"], e["payer_user_id"],
+                     category_ids[e["category"]], e["description"],
+                     expense_fingerprint(e["spent_at"], e["amount_cents"], e["payer_user_id"], e["description"]),
+                     e.get("idempotency_key"))
+                    for expense_id, e in zip(ids, expenses)
+                ]
+            )
+            cur.executemany(
+                "INSERT INTO expense_splits(expense_id, user_id, share_bp) VALUES (?, ?, ?);",
+                [(expense_id, user_id, share)
+                 for expense_id, e in zip(ids, expenses) for user_id, share in e["split_bp"].items()]
+            )
+            self._append_ledger(cur, [
+                delta
+                for expense_id, e in zip(ids, expenses)
+                for delta in expense_ledger_deltas(
+                    expense_id, e["spent_at"], e["amount_cents"], e["payer_user_id"], e["split_bp"]
+                )
+            ])
+        return len(expenses)
+
+    @traced
+    def update_expense(self, expense_id, amount_cents, payer_user_id, category, description, spent_at, split_bp) -> None:
+        fingerprint = expense_fingerprint(spent_at, amount_cents, payer_user_id, description)
+        with self._transaction() as cur:
+            old = cur.execute(
+                "SELECT spent_at, amount_cents, payer_user_id FROM expenses WHERE id=?;", (expense_id,)
+            ).fetchone()
+            if old is None:
+                return
+            _check_months_open(cur, [old["spent_at"][:7], str(spent_at)[:7]])
+            old_split = self._read_splits(cur, expense_id)
+            category_id = self._category_ids(cur, [category])[category]
+            cur.execute(
+                """UPDATE expenses
+                   SET amount_cents=?, payer_user_id=?, category_id=?, description=?, spent_at=?, fingerprint=?
+                   WHERE id=?;""",
+                (amount_cents, payer_user_id, category_id, description, str(spent_at)[:10], fingerprint, expense_id)
+            )
+            self._write_splits(cur, expense_id, split_bp)
+            self._append_ledger(cur, expense_ledger_deltas(
+                expense_id, old["spent_at"], old["amount_cents"], old["payer_user_id"], old_split, -1
+            ) + expense_ledger_deltas(expense_id, spent_at, amount_cents, payer_user_id, split_bp))
+
+    @traced
+    def delete_expense(self, expense_id: int) -> None:
+        with self._transaction() as cur:
+            old = cur.execute(
+                "SELECT spent_at, amount_cents, payer_user_id FROM expenses WHERE id=?;", (expense_id,)
+            ).fetchone()
+            if old is None:
+                return
+            _check_months_open(cur, [old["spent_at"][:7]])
+            split = self._read_splits(cur, expense_id)
+            cur.execute("DELETE FROM expenses WHERE id=?;", (expense_id,))
+            self._append_ledger(cur, expense_ledger_deltas(
+                expense_id, old["spent_at"], old["amount_cents"], old["payer_user_id"], split, -1
+            ))
+
+    @traced
+    def find_duplicates(self, fingerprints: List[str]) -> Dict[str, int]:
+        if not fingerprints:
+            return {}
+        unique = list(set(fingerprints))
+        rows = self._query(
+            f"""SELECT fingerprint, COUNT(*) AS n FROM expenses
+                WHERE fingerprint IN ({",".join("?" * len(unique))}) GROUP BY fingerprint;""",
+            unique
+        )
+        return {r["fingerprint"]: r["n"] for r in rows}
+
+    @traced
+    def list_expenses_month(self, month_yyyy_mm: str) -> List[Expense]:
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        if snapshot is not None:
+            return snapshot["expenses"]
+        return [_expense_from_row(r) for r in self._query(_LIST_EXPENSES_MONTH_SQL, _month_range(month_yyyy_mm))]
+
+    @traced
+    def list_expenses_page(self, month_yyyy_mm, page_size=EXPENSES_PAGE_SIZE, after=None) -> ExpensePage:
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        if snapshot is not None:
+            return _snapshot_page(snapshot["expenses"], page_size, after)
+        return self._live_expenses_page(month_yyyy_mm, page_size, after)
+
+    def _live_expenses_page(self, month_yyyy_mm: str, page_size: int, after: Optional[Tuple[str, int]]) -> ExpensePage:
+        params: Dict[str, Any] = {**_month_range(month_yyyy_mm), "limit": page_size + 1}
+        after_sql = ""
+        if after is not None:
+            after_sql = "AND (e.spent_at, e.id) < (:after_date, :after_id)"
+            params["after_date"], params["after_id"] = after[0], after[1]
+        rows = [_expense_from_row(r) for r in self._query(
+            f"""SELECT {_EXPENSE_COLUMNS} FROM expenses e JOIN categories c ON c.id = e.category_id
+                WHERE e.spent_at >= :start AND e.spent_at < :end {after_sql}
+                ORDER BY e.spent_at DESC, e.id DESC
+                LIMIT :limit;""",
+            params
+        )]
+        # One extra row tells whether another page exists.
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]["spent_at"], rows[-1]["id"]) if has_more else None
+        return {"rows": rows, "next_cursor": next_cursor}
+
+    # --- totals and reports ---
+
+    @traced
+    def get_month_totals(self, month_yyyy_mm: str, user_a_id: int, user_b_id: int) -> MonthTotals:
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        if snapshot is not None:
+            return _month_totals_from_balances(snapshot["balances"], user_a_id, user_b_id)
+        r = self._query(
+            """SELECT COUNT(*) AS expense_count,
+                      COALESCE(SUM(e.amount_cents), 0) AS total_cents,
+                      COALESCE(SUM(CASE WHEN e.payer_user_id = :a THEN e.amount_cents END), 0) AS paid_a_cents,
+                      COALESCE(SUM(CASE WHEN e.payer_user_id = :b THEN e.amount_cents END), 0) AS paid_b_cents,
+                      COALESCE(SUM(e.amount_cents * (SELECT share_bp FROM expense_splits
+                                                     WHERE expense_id = e.id AND user_id = :a)), 0) AS quota_a_bp,
+                      COALESCE(SUM(e.amount_cents * (SELECT share_bp FROM expense_splits
+                                                     WHERE expense_id = e.id AND user_id = :b)), 0) AS quota_b_bp
+               FROM expenses e
+               WHERE e.spent_at >= :start AND e.spent_at < :end;""",
+            {**_month_range(month_yyyy_mm), "a": user_a_id, "b": user_b_id}
+        )[0]
+        return {
+            "expense_count": r["expense_count"],
+            "total_cents": r["total_cents"],
+            "paid_a_cents": r["paid_a_cents"],
+            "paid_b_cents": r["paid_b_cents"],
+            "quota_a_cents": _round_bp(r["quota_a_bp"]),
+            "quota_b_cents": _round_bp(r["quota_b_bp"]),
+        }
+
+    @traced
+    def get_month_balances(self, month_yyyy_mm: str) -> MonthBalances:
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        if snapshot is not None:
+            return snapshot["balances"]
+        return _month_balances(self._query(_MONTH_BALANCES_SQL, _month_range(month_yyyy_mm)))
+
+    @traced
+    def load_month_view(self, month_yyyy_mm, page_size=EXPENSES_PAGE_SIZE, after=None) -> MonthView:
+        # Nothing caches the snapshot here: look it up once, not once per read.
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        return {
+            "users": self.get_users(),
+            "categories": self.get_categories(),
+            "balances": (snapshot["balances"] if snapshot
+                         else _month_balances(self._query(_MONTH_BALANCES_SQL, _month_range(month_yyyy_mm)))),
+            "page": (_snapshot_page(snapshot["expenses"], page_size, after) if snapshot
+                     else self._live_expenses_page(month_yyyy_mm, page_size, after)),
+            "settlements": self.get_settlements(month_yyyy_mm),
+            "closed_at": snapshot["closed_at"] if snapshot else None,
+        }
+
+    @traced
+    def get_range_report(self, start_month: str, end_month: str) -> RangeReport:
+        rows = self._query(_RANGE_REPORT_SQL, {
+            "start": _month_range(start_month)["start"],
+            "end": _month_range(end_month)["end"],
+            "start_month": start_month,
+            "end_month": end_month,
+        })
+        return _range_report_from_rows(start_month, end_month, rows)
+
+    # --- settlements ---
+
+    @traced
+    def record_settlements(self, month: str, transfers: List[Tuple[int, int, int]]) -> None:
+        now = datetime.utcnow().isoformat()
+        with self._transaction() as cur:
+            replaced = [tuple(r) for r in cur.execute(
+                "SELECT from_user_id, to_user_id, amount_cents FROM settlements WHERE month=?;", (month,)
+            ).fetchall()]
+            cur.execute("DELETE FROM settlements WHERE month=?;", (month,))
+            cur.executemany(
+                """INSERT INTO settlements(month, from_user_id, to_user_id, amount_cents, paid_at)
+                   VALUES (?, ?, ?, ?, ?);""",
+                [(month, from_id, to_id, cents, now) for from_id, to_id, cents in transfers]
+            )
+            self._append_ledger(cur, settlement_ledger_deltas(month, replaced, now[:10], -1)
+                                + settlement_ledger_deltas(month, transfers, now[:10]))
+            _save_month_snapshot(cur, month, now)
+
+    @traced
+    def get_settlements(self, month: str) -> List[Settlement]:
+        return [
+            {
+                "month": r["month"],
+                "from_user_id": r["from_user_id"],
+                "to_user_id": r["to_user_id"],
+                "amount": r["amount_cents"] / 100.0,
+                "paid_at": r["paid_at"],
+            }
+            for r in self._query(
+                "SELECT month, from_user_id, to_user_id, amount_cents, paid_at FROM settlements WHERE month=? ORDER BY id;",
+                (month,)
+            )
+        ]
+
+    @traced
+    def get_month_snapshot(self, month: str) -> Optional[MonthSnapshot]:
+        rows = self._query("SELECT month, closed_at, balances, expenses FROM month_snapshots WHERE month=?;", (month,))
+        if not rows:
+            return None
+        r = rows[0]
+        return _month_snapshot_from_json(r["month"], r["closed_at"], json.loads(r["balances"]), json.loads(r["expenses"]))
+
+    # --- ledger ---
+
+    @traced
+    def get_balances(self, as_of: Optional[datetime] = None) -> Dict[int, int]:
+        # Stored as naive UTC isoformat, like every other timestamp of the file.
+        if as_of is None:
+            moment = datetime.utcnow().isoformat()
+        else:
+            moment = (as_of.astimezone(timezone.utc).replace(tzinfo=None) if as_of.tzinfo else as_of).isoformat()
+        rows = self._query(
+            f"SELECT u.id, ({_LEDGER_BALANCE_SQL}) AS balance FROM users u ORDER BY u.id;", {"as_of": moment}
+        )
+        return {r["id"]: _round_bp(r["balance"] or 0) for r in rows}
+
+    @traced
+    def rebuild_ledger(self) -> int:
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM ledger_entries;")
+            _replay_ledger(cur)
+            return cur.rowcount
+
+    # --- export ---
+
+    def stream_expenses(self, user_ids, start_date=None, end_date=None, categories=None,
+                        batch_size=EXPORT_BATCH_SIZE) -> Iterator[List[Tuple]]:
+        where = ""
+        params: List[Any] = []
+        if start_date:
+            where += " AND e.spent_at >= ?"
+            params.append(str(start_date)[:10])
+        if end_date:
+            where += " AND e.spent_at <= ?"
+            params.append(str(end_date)[:10])
+        if categories:
+            where += f" AND c.name IN ({','.join('?' * len(categories))})"
+            params.extend(categories)
+        # A plain cursor: sqlite3 steps through the result as it is fetched,
+        # so fetchmany keeps one batch in memory.
+        cur = self._connection().cursor()
+        try:
+            cur.execute(
+                f"""SELECT e.id, e.spent_at, e.amount_cents, e.payer_user_id, c.name AS category,
+                           COALESCE(e.description, '') AS description,
+                           (SELECT json_group_object(CAST(s.user_id AS TEXT), s.share_bp)
+                            FROM expense_splits s WHERE s.expense_id = e.id) AS split
+                    FROM expenses e JOIN categories c ON c.id = e.category_id
+                    WHERE 1 {where}
+                    ORDER BY e.spent_at, e.id;""",
+                params
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = []
+                for r in rows:
+                    split = json.loads(r["split"] or "{}")
+                    batch.append((r["id"], r["spent_at"], r["amount_cents"], r["payer_user_id"], r["category"],
+                                  r["description"], [split.get(str(u)) for u in user_ids]))
+                yield batch
+        finally:
+            cur.close()
@@ -0,0 +1,365 @@
+"""
+Storage backends behind one interface.
+
+The app talks to a Storage object instead of importing src.database
+directly, so the same pages run on hosted Postgres (PostgresStorage, the
+pooled/cached functions of src.database) or on an embedded SQLite file
+(src.sqlite_storage.SQLiteStorage) for single-household deployments.
+Postgres holds any number of households; calls work on the current one
+(src.tenancy).
+
+The backend is picked from the environment:
+
+    STORAGE_BACKEND=postgres   (default) uses DATABASE_URL
+    STORAGE_BACKEND=sqlite     uses SQLITE_PATH (default casa_split.db)
+    DATABASE_URL=sqlite:///path/to/file.db   also selects SQLite
+
+    python -m src.storage      # applies pending migrations of the backend
+
+src.storage_conformance runs the same behaviour checks against every backend.
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from calendar import monthrange
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from src import database, database_async, migrations
+from src.database import (
+    Household,
+    User,
+    Expense,
+    ExpensePage,
+    MonthBalances,
+    MonthSnapshot,
+    MonthTotals,
+    MonthView,
+    RangeReport,
+    Settlement,
+    EXPENSES_PAGE_SIZE,
+    EXPORT_BATCH_SIZE,
+    _snapshot_page,
+)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "casa_split.db")
+
+class Storage(ABC):
+    """Everything the app reads and writes. Amounts are integer cents and
+    splits map user id to basis points (10000 = 100%)."""
+
+    name = ""
+    # Whether add_household works; otherwise only HOUSEHOLD_ID's household exists.
+    multi_household = False
+
+    @abstractmethod
+    def migrate(self) -> List[int]:
+        """Applies pending schema migrations; returns the versions applied."""
+
+    @abstractmethod
+    def bootstrap(self, user_a_name: str = "Thiago", user_b_name: str = "Marina") -> None:
+        """Migrates and seeds default users/categories, once per process."""
+
+    @abstractmethod
+    def get_household(self, slug: str) -> Optional[Household]:
+        """The household whose URL carries `slug`, or None."""
+
+    @abstractmethod
+    def add_household(self, name: str, member_names: List[str]) -> Household:
+        """Creates a household with its members and the default categories."""
+
+    @abstractmethod
+    def list_households(self) -> List[Household]:
+        """Every household, oldest first; empty when there is only HOUSEHOLD_ID's."""
+
+    @abstractmethod
+    def get_users(self) -> List[User]: ...
+
+    @abstractmethod
+    def add_user(self, name: str) -> None:
+        """Adds a member to the household."""
+
+    @abstractmethod
+    def get_categories(self) -> List[str]: ...
+
+    @abstractmethod
+    def upsert_default_categories(self) -> None: ...
+
+    @abstractmethod
+    def add_category(self, name: str) -> None: ...
+
+    @abstractmethod
+    def update_category(self, old_name: str, new_name: str) -> None:
+        """Renames a category, including on the expenses that use it."""
+
+    @abstractmethod
+    def delete_category(self, name: str) -> None:
+        """Takes a category off the list; expenses that use it keep it."""
+
+    @abstractmethod
+    def add_expense(
+        self,
+        amount_cents: int,
+        payer_user_id: int,
+        category: str,
+        description: str,
+        spent_at: str,
+        split_bp: Dict[int, int],
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        """Adds one expense; a repeated `idempotency_key` is ignored."""
+
+    @abstractmethod
+    def bulk_add_expenses(self, expenses: List[Dict[str, Any]]) -> int:
+        """Inserts many expenses in one transaction; returns how many.
+
+        Items whose optional "idempotency_key" is already stored are skipped.
+        """
+
+    @abstractmethod
+    def update_expense(
+        self,
+        expense_id: int,
+        amount_cents: int,
+        payer_user_id: int,
+        category: str,
+        description: str,
+        spent_at: str,
+        split_bp: Dict[int, int]
+    ) -> None: ...
+
+    @abstractmethod
+    def delete_expense(self, expense_id: int) -> None: ...
+
+    @abstractmethod
+    def find_duplicates(self, fingerprints: List[str]) -> Dict[str, int]:
+        """Counts existing expenses per fingerprint (only those that exist)."""
+
+    @abstractmethod
+    def list_expenses_month(self, month_yyyy_mm: str) -> List[Expense]: ...
+
+    @abstractmethod
+    def list_expenses_page(
+        self,
+        month_yyyy_mm: str,
+        page_size: int = EXPENSES_PAGE_SIZE,
+        after: Optional[Tuple[str, int]] = None
+    ) -> ExpensePage: ...
+
+    @abstractmethod
+    def get_month_totals(self, month_yyyy_mm: str, user_a_id: int, user_b_id: int) -> MonthTotals:
+        """Two users' totals; get_month_balances covers every member."""
+
+    @abstractmethod
+    def get_month_balances(self, month_yyyy_mm: str) -> MonthBalances: ...
+
+    @abstractmethod
+    def get_range_report(self, start_month: str, end_month: str) -> RangeReport: ...
+
+    @abstractmethod
+    def record_settlements(self, month: str, transfers: List[Tuple[int, int, int]]) -> None:
+        """Records the month's (from_user_id, to_user_id, amount_cents)
+        transfers, replacing the ones recorded before, and closes the month:
+        its balances and expenses are frozen in a snapshot that its reads
+        return from then on, and expense writes to it raise MonthClosedError."""
+
+    @abstractmethod
+    def get_month_snapshot(self, month: str) -> Optional[MonthSnapshot]:
+        """The frozen copy of a closed month; None while it is open."""
+
+    @abstractmethod
+    def get_settlements(self, month: str) -> List[Settlement]:
+        """The month's transfers in the order they were recorded."""
+
+    @abstractmethod
+    def get_balances(self, as_of: Optional[datetime] = None) -> Dict[int, int]:
+        """Every member's running balance in cents across all months (paid -
+        quota + transfers sent - received), read from the ledger; with
+        `as_of` (UTC), as the ledger stood at that moment."""
+
+    @abstractmethod
+    def rebuild_ledger(self) -> int:
+        """Replays the ledger from the expenses and settlements; returns the
+        number of entries written."""
+
+    @abstractmethod
+    def stream_expenses(
+        self,
+        user_ids: List[int],
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        categories: Optional[List[str]] = None,
+        batch_size: int = EXPORT_BATCH_SIZE
+    ) -> Iterator[List[Tuple]]:
+        """Expenses oldest first in batches of (id, spent_at, amount_cents,
+        payer_user_id, category, description, shares) tuples, shares aligned
+        with `user_ids`; holds one batch in memory at a time (see src.export)."""
+
+    def load_expense_columns(
+        self,
+        start_month: str,
+        end_month: str,
+        user_ids: List[int],
+        batch_size: int = EXPORT_BATCH_SIZE
+    ):
+        """The expenses of a month range (inclusive) as columnar.ExpenseColumns,
+        for multi-year analytics. Built from stream_expenses one batch at a
+        time, so only one batch of tuples is in memory besides the arrays."""
+        from src.columnar import ExpenseColumns
+        year, month = int(end_month[:4]), int(end_month[5:7])
+        end_date = f"{end_month}-{monthrange(year, month)[1]:02d}"
+        parts = [ExpenseColumns.from_stream(batch, user_ids)
+                 for batch in self.stream_expenses(user_ids, f"{start_month}-01", end_date, batch_size=batch_size)]
+        return ExpenseColumns.concatenate(parts, user_ids)
+
+    def load_month_view(
+        self,
+        month_yyyy_mm: str,
+        page_size: int = EXPENSES_PAGE_SIZE,
+        after: Optional[Tuple[str, int]] = None
+    ) -> MonthView:
+        """Everything "Resumo do mês" shows. Backends with a network hop
+        override this to run the reads concurrently."""
+        snapshot = self.get_month_snapshot(month_yyyy_mm)
+        return {
+            "users": self.get_users(),
+            "categories": self.get_categories(),
+            "balances": snapshot["balances"] if snapshot else self.get_month_balances(month_yyyy_mm),
+            "page": (_snapshot_page(snapshot["expenses"], page_size, after) if snapshot
+                     else self.list_expenses_page(month_yyyy_mm, page_size, after)),
+            "settlements": self.get_settlements(month_yyyy_mm),
+            "closed_at": snapshot["closed_at"] if snapshot else None,
+        }
+
+class PostgresStorage(Storage):
+    """The pooled, cached Postgres functions of src.database."""
+
+    name = "postgres"
+    multi_household = True
+
+    def migrate(self) -> List[int]:
+        return migrations.migrate()
+
+    def bootstrap(self, user_a_name: str = "Thiago", user_b_name: str = "Marina") -> None:
+        migrations.bootstrap(user_a_name, user_b_name)
+
+    def get_household(self, slug: str) -> Optional[Household]:
+        return database.get_household(slug)
+
+    def add_household(self, name: str, member_names: List[str]) -> Household:
+        return database.add_household(name, member_names)
+
+    def list_households(self) -> List[Household]:
+        return database.list_households()
+
+    def get_users(self) -> List[User]:
+        return database.get_users()
+
+    def add_user(self, name: str) -> None:
+        database.add_user(name)
+
+    def get_categories(self) -> List[str]:
+        return database.get_categories()
+
+    def upsert_default_categories(self) -> None:
+        database.upsert_default_categories()
+
+    def add_category(self, name: str) -> None:
+        database.add_category(name)
+
+    def update_category(self, old_name: str, new_name: str) -> None:
+        database.update_category(old_name, new_name)
+
+    def delete_category(self, name: str) -> None:
+        database.delete_category(name)
+
+    def add_expense(self, amount_cents, payer_user_id, category, description, spent_at, split_bp,
+                    idempotency_key=None) -> None:
+        database.add_expense(amount_cents, payer_user_id, category, description, spent_at, split_bp, idempotency_key)
+
+    def bulk_add_expenses(self, expenses: List[Dict[str, Any]]) -> int:
+        return database.bulk_add_expenses(expenses)
+
+    def update_expense(self, expense_id, amount_cents, payer_user_id, category, description, spent_at, split_bp) -> None:
+        database.update_expense(expense_id, amount_cents, payer_user_id, category, description, spent_at, split_bp)
+
+    def delete_expense(self, expense_id: int) -> None:
+        database.delete_expense(expense_id)
+
+    def find_duplicates(self, fingerprints: List[str]) -> Dict[str, int]:
+        return database.find_duplicates(fingerprints)
+
+    def list_expenses_month(self, month_yyyy_mm: str) -> List[Expense]:
+        return database.list_expenses_month(month_yyyy_mm)
+
+    def list_expenses_page(self, month_yyyy_mm, page_size=EXPENSES_PAGE_SIZE, after=None) -> ExpensePage:
+        return database.list_expenses_page(month_yyyy_mm, page_size, after)
+
+    def get_month_totals(self, month_yyyy_mm: str, user_a_id: int, user_b_id: int) -> MonthTotals:
+        return database.get_month_totals(month_yyyy_mm, user_a_id, user_b_id)
+
+    def get_month_balances(self, month_yyyy_mm: str) -> MonthBalances:
+        return database.get_month_balances(month_yyyy_mm)
+
+    def get_range_report(self, start_month: str, end_month: str) -> RangeReport:
+        return database.get_range_report(start_month, end_month)
+
+    def record_settlements(self, month: str, transfers: List[Tuple[int, int, int]]) -> None:
+        database.record_settlements(month, transfers)
+
+    def get_settlements(self, month: str) -> List[Settlement]:
+        return database.get_settlements(month)
+
+    def get_month_snapshot(self, month: str) -> Optional[MonthSnapshot]:
+        return database.get_month_snapshot(month)
+
+    def get_balances(self, as_of: Optional[datetime] = None) -> Dict[int, int]:
+        return database.get_balances(as_of)
+
+    def rebuild_ledger(self) -> int:
+        return database.rebuild_ledger()
+
+    def stream_expenses(self, user_ids, start_date=None, end_date=None, categories=None,
+                        batch_size=EXPORT_BATCH_SIZE) -> Iterator[List[Tuple]]:
+        return database.stream_expenses(user_ids, start_date, end_date, categories, batch_size)
+
+    def load_month_view(self, month_yyyy_mm, page_size=EXPENSES_PAGE_SIZE, after=None) -> MonthView:
+        # The reads run concurrently on the async pool (see src.database_async).
+        return database_async.load_month_view_sync(month_yyyy_mm, page_size, after)
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+def storage_from_env() -> Storage:
+    """Builds the backend selected by STORAGE_BACKEND / DATABASE_URL."""
+    url = os.getenv("DATABASE_URL", "")
+    backend = STORAGE_BACKEND or ("sqlite" if url.startswith("sqlite:") else "postgres")
+    if backend == "sqlite":
+        from src.sqlite_storage import SQLiteStorage
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteStorage(url[len("sqlite:///"):] if url.startswith("sqlite:///") else SQLITE_PATH)
+    if backend == "postgres":
+        return PostgresStorage()
+    raise RuntimeError(f"STORAGE_BACKEND desconhecido: {backend!r} (use 'postgres' ou 'sqlite').")
+
+def get_storage() -> Storage:
+    """Returns the process-wide storage backend."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = storage_from_env()
+    return _storage
+
+def use_storage(storage: Storage) -> None:
+    """Replaces the process-wide backend (tools that drive the app against a
+    scratch database, see src.query_budget)."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+if __name__ == "__main__":
+    # Run ahead of the app (see start.sh) so deploys apply DDL before serving.
+    storage = get_storage()
+    done = storage.migrate()
+    print(f"[{storage.name}] Migrações aplicadas: {done}" if done else f"[{storage.name}] Esquema já está atualizado.")
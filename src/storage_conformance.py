@@ -0,0 +1,449 @@
+"""
+Behaviour checks every Storage backend must pass.
+
+Each check drives the public Storage interface only and compares the
+results with what src.database documents (integer cents, basis-point
+splits, newest-first keyset pages, duplicate flags, settlements in the
+range report). Run it against a scratch database: the checks write data.
+
+    python -m src.storage_conformance sqlite     # temporary file, always safe
+    CONFORMANCE_DATABASE_URL=postgresql://.../casa_split_test \\
+        python -m src.storage_conformance postgres
+
+The Postgres run truncates the tables of CONFORMANCE_DATABASE_URL before
+starting, so it never uses the app's DATABASE_URL.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from typing import Any, Callable, Dict, List, Tuple
+from src.logic import compute_month_summary, household_summary, month_balances_from_expenses, summary_from_cents
+
+# Backends are imported lazily; the Postgres run points DATABASE_URL at
+# CONFORMANCE_DATABASE_URL before the pool opens (see _postgres_storage).
+Check = Callable[[Any], None]
+
+class ConformanceError(AssertionError):
+    pass
+
+def _expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise ConformanceError(message)
+
+def _split(storage, a_bp: int = 5000) -> Dict[int, int]:
+    a, b = storage.get_users()
+    return {a["id"]: a_bp, b["id"]: 10000 - a_bp}
+
+def check_bootstrap(storage) -> None:
+    users = storage.get_users()
+    _expect([u["name"] for u in users] == ["Thiago", "Marina"], f"usuários padrão: {users}")
+    storage.bootstrap()
+    _expect(len(storage.get_users()) == 2, "bootstrap repetido não pode duplicar usuários")
+    _expect(storage.migrate() == [], "migrate() com esquema atualizado deve ser vazio")
+    _expect({"Outro", "Mercado", "Contas", "Transporte", "Casa", "Pets"} <= set(storage.get_categories()),
+            "categorias padrão ausentes")
+
+def check_expense_roundtrip(storage) -> None:
+    a, b = storage.get_users()
+    storage.add_expense(12345, a["id"], "Mercado", "Feira", "2031-01-10", _split(storage, 7000))
+    rows = storage.list_expenses_month("2031-01")
+    _expect(len(rows) == 1, f"esperado 1 gasto em 2031-01, veio {len(rows)}")
+    e = rows[0]
+    _expect(
+        (e["spent_at"], e["amount_cents"], e["amount"], e["payer_user_id"], e["category"], e["description"])
+        == ("2031-01-10", 12345, 123.45, a["id"], "Mercado", "Feira"),
+        f"campos do gasto: {e}"
+    )
+    _expect(e["split_bp"] == {a["id"]: 7000, b["id"]: 3000}, f"split_bp: {e['split_bp']}")
+    _expect(e["is_duplicate"] is False, "gasto único marcado como duplicado")
+
+    storage.update_expense(e["id"], 20000, b["id"], "Casa", "Conserto", "2031-02-03", _split(storage, 2500))
+    _expect(storage.list_expenses_month("2031-01") == [], "edição deve mover o gasto de mês")
+    moved = storage.list_expenses_month("2031-02")
+    _expect(len(moved) == 1 and moved[0]["id"] == e["id"], "gasto editado deve manter o id")
+    _expect(
+        (moved[0]["amount_cents"], moved[0]["payer_user_id"], moved[0]["category"], moved[0]["split_bp"])
+        == (20000, b["id"], "Casa", {a["id"]: 2500, b["id"]: 7500}),
+        f"gasto editado: {moved[0]}"
+    )
+    storage.delete_expense(e["id"])
+    _expect(storage.list_expenses_month("2031-02") == [], "gasto apagado ainda listado")
+    _expect(storage.get_month_totals("2031-02", a["id"], b["id"])["expense_count"] == 0,
+            "totais devem esquecer o gasto apagado")
+
+def check_duplicates(storage) -> None:
+    from src.database import expense_fingerprint
+    a, _ = storage.get_users()
+    fp = expense_fingerprint("2031-03-05", 999, a["id"], "Padaria  Pão")
+    _expect(storage.find_duplicates([fp]) == {}, "fingerprint inexistente não pode ter contagem")
+    storage.add_expense(999, a["id"], "Mercado", "Padaria  Pão", "2031-03-05", _split(storage))
+    storage.add_expense(999, a["id"], "Mercado", "padaria pão", "2031-03-05", _split(storage))
+    _expect(storage.find_duplicates([fp, fp, "x"]) == {fp: 2}, "find_duplicates deve contar os dois gastos")
+    _expect(all(e["is_duplicate"] for e in storage.list_expenses_month("2031-03")), "ambos devem vir marcados")
+
+def check_pagination(storage) -> None:
+    a, b = storage.get_users()
+    storage.bulk_add_expenses([
+        {"spent_at": f"2031-04-{1 + i % 28:02d}", "amount_cents": 100 + i, "payer_user_id": (a, b)[i % 2]["id"],
+         "category": "Outro", "description": f"Gasto {i}", "split_bp": _split(storage)}
+        for i in range(25)
+    ])
+    full = [e["id"] for e in storage.list_expenses_month("2031-04")]
+    _expect(len(full) == 25, f"bulk_add_expenses deve inserir 25, listou {len(full)}")
+    paged: List[int] = []
+    after = None
+    pages = 0
+    while True:
+        page = storage.list_expenses_page("2031-04", 10, after)
+        paged += [e["id"] for e in page["rows"]]
+        pages += 1
+        after = page["next_cursor"]
+        if after is None:
+            break
+    _expect(pages == 3, f"25 gastos em páginas de 10 = 3 páginas, vieram {pages}")
+    _expect(paged == full, "páginas devem seguir a ordem da listagem do mês, sem repetir nem pular")
+
+def check_month_totals(storage) -> None:
+    a, b = storage.get_users()
+    storage.add_expense(3333, a["id"], "Contas", "Luz", "2031-05-02", _split(storage, 5000))
+    storage.add_expense(1001, b["id"], "Mercado", "Feira", "2031-05-09", _split(storage, 3000))
+    storage.add_expense(7, b["id"], "Outro", "Bala", "2031-05-20", _split(storage, 10000))
+    totals = storage.get_month_totals("2031-05", a["id"], b["id"])
+    _expect(totals["expense_count"] == 3, f"expense_count: {totals}")
+    # Rounded once per month: A 1666.5 + 300.3 + 7 = 1973.8 -> 1974, B 1666.5 + 700.7 = 2367.2 -> 2367.
+    _expect((totals["quota_a_cents"], totals["quota_b_cents"]) == (1974, 2367), f"cotas arredondadas: {totals}")
+    # The SQL aggregate and the Python reference must give the same summary, to the cent.
+    from_sql = summary_from_cents(totals, a, b)
+    reference = compute_month_summary(storage.list_expenses_month("2031-05"), a, b)
+    _expect(from_sql == reference, f"resumo SQL {from_sql} vs Python {reference}")
+    _expect(storage.get_month_totals("2031-11", a["id"], b["id"])["total_cents"] == 0, "mês vazio deve zerar")
+
+    # A user missing from the split owes nothing of it, in every path.
+    storage.add_expense(900, a["id"], "Outro", "Só A", "2031-10-01", {a["id"]: 10000})
+    totals = storage.get_month_totals("2031-10", a["id"], b["id"])
+    _expect((totals["quota_a_cents"], totals["quota_b_cents"]) == (900, 0), f"pessoa fora do split: {totals}")
+    expenses = storage.list_expenses_month("2031-10")
+    _expect(summary_from_cents(totals, a, b) == compute_month_summary(expenses, a, b),
+            "pessoa fora do split: resumo SQL x Python")
+    from src.columnar import ExpenseColumns, summarize
+    quota = summarize(ExpenseColumns.from_expenses(expenses, [a["id"], b["id"]]))["quota_cents"]
+    _expect(quota == {a["id"]: 900, b["id"]: 0}, f"pessoa fora do split (colunar): {quota}")
+
+    # The columnar loader groups to the same months as the SQL report.
+    from src.columnar import group_totals
+    grouped = group_totals(storage.load_expense_columns("2031-01", "2031-12", [a["id"], b["id"]], batch_size=2))
+    columnar = {key[0]: (int(total), {a["id"]: int(q[0]), b["id"]: int(q[1])})
+                for key, total, q in zip(grouped["keys"], grouped["total_cents"], grouped["quota_cents"])}
+    report = {m["month"]: (m["total_cents"], {u: m["quota_cents"].get(u, 0) for u in (a["id"], b["id"])})
+              for m in storage.get_range_report("2031-01", "2031-12")["months"] if m["expense_count"]}
+    _expect(columnar == report, f"colunar {columnar} vs relatório {report}")
+
+def check_settlements_and_report(storage) -> None:
+    a, b = storage.get_users()
+    _expect(storage.get_settlements("2031-05") == [], "mês sem fechamento deve retornar lista vazia")
+    storage.record_settlements("2031-05", [(b["id"], a["id"], 500)])
+    s = storage.get_settlements("2031-05")
+    _expect(len(s) == 1 and (s[0]["from_user_id"], s[0]["to_user_id"], s[0]["amount"]) == (b["id"], a["id"], 5.0)
+            and s[0]["paid_at"], f"fechamento: {s}")
+    storage.record_settlements("2031-05", [(b["id"], a["id"], 600)])
+    _expect([x["amount"] for x in storage.get_settlements("2031-05")] == [6.0], "novo fechamento substitui o do mês")
+
+    report = storage.get_range_report("2031-04", "2031-06")
+    _expect([m["month"] for m in report["months"]] == ["2031-04", "2031-05", "2031-06"], "meses do relatório")
+    for m in report["months"]:
+        totals = storage.get_month_totals(m["month"], a["id"], b["id"])
+        _expect(m["total_cents"] == totals["total_cents"] and m["expense_count"] == totals["expense_count"],
+                f"relatório x totais em {m['month']}")
+        _expect(m["paid_cents"].get(a["id"], 0) == totals["paid_a_cents"], f"pago A em {m['month']}")
+    may = report["months"][1]
+    _expect(may["settled_cents"] == {b["id"]: 600, a["id"]: -600}, f"settled_cents: {may['settled_cents']}")
+    _expect(report["months"][2]["carry_cents"] == may["carry_cents"], "mês vazio mantém o saldo acumulado")
+    _expect(sum(report["category_totals"].values()) == sum(m["total_cents"] for m in report["months"]),
+            "categorias devem somar o total")
+
+    # Half a cent rounds away from zero in the report too, like the month's balances.
+    storage.add_expense(1001, a["id"], "Outro", "Meio centavo", "2032-01-05", _split(storage))
+    quota = storage.get_range_report("2032-01", "2032-01")["months"][0]["quota_cents"]
+    _expect(quota == storage.get_month_balances("2032-01")["quota_cents"] == {a["id"]: 501, b["id"]: 501},
+            f"cotas do relatório: {quota}")
+
+def check_categories(storage) -> None:
+    a, _ = storage.get_users()
+    storage.add_category("Viagem")
+    storage.add_category("Viagem")
+    _expect(storage.get_categories().count("Viagem") == 1, "add_category deve ignorar repetidas")
+    storage.add_expense(5000, a["id"], "Viagem", "Hotel", "2031-07-01", _split(storage))
+    storage.update_category("Viagem", "Férias")
+    cats = storage.get_categories()
+    _expect("Férias" in cats and "Viagem" not in cats, f"renomear categoria: {cats}")
+    _expect([e["category"] for e in storage.list_expenses_month("2031-07")] == ["Férias"],
+            "renomear deve atualizar os gastos")
+    _expect(set(storage.get_range_report("2031-07", "2031-07")["category_totals"]) == {"Férias"},
+            "relatório deve usar o nome novo")
+    storage.delete_category("Férias")
+    _expect("Férias" not in storage.get_categories(), "categoria apagada ainda listada")
+    _expect(storage.list_expenses_month("2031-07")[0]["category"] == "Férias", "gastos mantêm o nome")
+    storage.add_category("Férias")
+    _expect("Férias" in storage.get_categories(), "adicionar de novo deve restaurar a categoria apagada")
+
+    # A name nobody added is kept on the expense but doesn't join the list.
+    storage.add_expense(700, a["id"], "Presente", "Aniversário", "2031-07-02", _split(storage))
+    _expect("Presente" not in storage.get_categories(), "categoria só do gasto não deve entrar na lista")
+    _expect(sorted(e["category"] for e in storage.list_expenses_month("2031-07")) == ["Férias", "Presente"],
+            "gasto deve manter a categoria digitada")
+
+def check_month_view(storage) -> None:
+    a, b = storage.get_users()
+    view = storage.load_month_view("2031-04", 10, None)
+    _expect(view["balances"] == storage.get_month_balances("2031-04"), "view.balances")
+    _expect(view["page"] == storage.list_expenses_page("2031-04", 10, None), "view.page")
+    _expect(view["settlements"] == storage.get_settlements("2031-04"), "view.settlements")
+    _expect(view["categories"] == storage.get_categories() and view["users"] == storage.get_users(), "view")
+
+def check_idempotency_keys(storage) -> None:
+    a, b = storage.get_users()
+    storage.add_expense(1200, a["id"], "Mercado", "Pão", "2031-08-01", _split(storage), idempotency_key="k-1")
+    storage.add_expense(1200, a["id"], "Mercado", "Pão", "2031-08-01", _split(storage), idempotency_key="k-1")
+    batch = [
+        {"spent_at": "2031-08-02", "amount_cents": 300 + i, "payer_user_id": b["id"], "category": "Outro",
+         "description": f"Fila {i}", "split_bp": _split(storage), "idempotency_key": f"k-{i}"}
+        for i in range(1, 4)
+    ]
+    _expect(storage.bulk_add_expenses(batch) == 2, "bulk_add_expenses deve pular a chave já gravada")
+    _expect(storage.bulk_add_expenses(batch) == 0, "lote reenviado não deve gravar nada")
+    _expect(len(storage.list_expenses_month("2031-08")) == 3, "chave repetida não pode duplicar o gasto")
+    _expect(storage.get_month_totals("2031-08", a["id"], b["id"])["total_cents"] == 1200 + 302 + 303,
+            "totais devem contar cada chave uma vez")
+
+def check_household(storage) -> None:
+    a, b = storage.get_users()
+    storage.add_user("Carol")
+    storage.add_user("Davi")
+    users = storage.get_users()
+    _expect([u["name"] for u in users[2:]] == ["Carol", "Davi"], f"add_user: {users}")
+    c, d = users[2], users[3]
+    ids = [u["id"] for u in users]
+    storage.add_expense(10000, a["id"], "Casa", "Aluguel", "2031-09-01", {u: 2500 for u in ids})
+    storage.add_expense(3000, c["id"], "Mercado", "Feira", "2031-09-03", {a["id"]: 5000, c["id"]: 5000})
+    storage.add_expense(999, d["id"], "Outro", "Pizza", "2031-09-04", {b["id"]: 3334, c["id"]: 3333, d["id"]: 3333})
+    balances = storage.get_month_balances("2031-09")
+    reference = month_balances_from_expenses(
+        [{**e, "amount_cents": int(round(e["amount"] * 100))} for e in storage.list_expenses_month("2031-09")], ids
+    )
+    _expect(balances["expense_count"] == 3 and balances["total_cents"] == 13999, f"balances: {balances}")
+    for key in ("paid_cents", "quota_cents"):
+        _expect({u: balances[key].get(u, 0) for u in ids} == reference[key], f"{key}: {balances[key]} vs {reference[key]}")
+
+    summary = household_summary(balances, users)
+    transfers = summary["transfers"]
+    _expect(len(transfers) <= len(users) - 1, f"transferências demais: {transfers}")
+    settled = dict.fromkeys(ids, 0)
+    for from_id, to_id, cents in transfers:
+        settled[from_id] += cents
+        settled[to_id] -= cents
+    _expect(all(abs(summary["balance_cents"][u] + settled[u]) <= 1 for u in ids),
+            f"transferências não zeram os saldos: {summary['balance_cents']} / {transfers}")
+    storage.record_settlements("2031-09", transfers)
+    _expect([(s["from_user_id"], s["to_user_id"], int(round(s["amount"] * 100)))
+             for s in storage.get_settlements("2031-09")] == transfers, "fechamento com várias transferências")
+    month = storage.get_range_report("2031-09", "2031-09")["months"][0]
+    _expect(month["settled_cents"] == {u: cents for u, cents in settled.items() if cents},
+            f"relatório soma as transferências: {month['settled_cents']}")
+
+def check_households(storage) -> None:
+    from src.database import expense_fingerprint
+    from src.tenancy import use_household
+    if not storage.multi_household:
+        try:
+            storage.add_household("Outra", ["Ana"])
+        except RuntimeError:
+            pass
+        else:
+            raise ConformanceError("backend de uma casa só não pode criar outra")
+        with use_household(-1):
+            try:
+                storage.get_users()
+            except RuntimeError:
+                return
+        raise ConformanceError("backend de uma casa só não pode atender outra casa")
+
+    a = storage.get_users()[0]
+    theirs = storage.list_expenses_month("2031-04")
+    created = storage.add_household("Casa da Ana", ["Ana", "Bia"])
+    _expect(storage.get_household(created["slug"]) == created, f"get_household: {created}")
+    _expect(storage.get_household("nao-existe") is None, "slug desconhecido deve dar None")
+    with use_household(created["id"]):
+        ana, bia = storage.get_users()
+        _expect((ana["name"], bia["name"]) == ("Ana", "Bia"), "cada casa vê só as suas pessoas")
+        _expect({"Outro", "Mercado", "Contas"} <= set(storage.get_categories()), "casa nova com categorias padrão")
+        _expect(storage.list_expenses_month("2031-04") == [] and storage.list_expenses_page("2031-04")["rows"] == [],
+                "casa nova não pode ver gastos de outra")
+        _expect(storage.get_month_balances("2031-04")["total_cents"] == 0, "saldos não podem somar outra casa")
+        _expect(storage.get_range_report("2031-04", "2031-09")["category_totals"] == {}, "relatório só da casa")
+        _expect(storage.get_settlements("2031-09") == [], "fechamentos só da casa")
+        fp = expense_fingerprint("2031-03-05", 999, a["id"], "Padaria  Pão")
+        _expect(storage.find_duplicates([fp]) == {}, "duplicados não podem vir de outra casa")
+
+        split = {ana["id"]: 5000, bia["id"]: 5000}
+        storage.add_expense(4000, ana["id"], "Mercado", "Feira", "2031-04-02", split, idempotency_key="k-1")
+        _expect(len(storage.list_expenses_month("2031-04")) == 1, "chave de outra casa não pode bloquear o gasto")
+        storage.update_category("Mercado", "Supermercado")
+        storage.update_expense(theirs[0]["id"], 1, ana["id"], "Outro", "x", "2031-04-01", split)
+        storage.delete_expense(theirs[1]["id"])
+
+    _expect(storage.list_expenses_month("2031-04") == theirs, "outra casa não pode editar nem apagar estes gastos")
+    _expect("Mercado" in storage.get_categories() and "Supermercado" not in storage.get_categories(),
+            "renomear categoria vale só na casa")
+    _expect(storage.get_month_balances("2031-04")["total_cents"] == sum(e["amount_cents"] for e in theirs),
+            "saldos não podem somar a outra casa")
+
+def check_ledger(storage) -> None:
+    from datetime import datetime, timezone
+    from src.logic import _round_bp
+    users = storage.get_users()
+    exact = {u["id"]: 0 for u in users}
+    for month in [f"2031-{m:02d}" for m in range(1, 13)] + ["2032-01"]:
+        for e in storage.list_expenses_month(month):
+            exact[e["payer_user_id"]] += e["amount_cents"] * 10000
+            for user_id, bp in e["split_bp"].items():
+                exact[user_id] -= e["amount_cents"] * bp
+        for s in storage.get_settlements(month):
+            cents = int(round(s["amount"] * 100))
+            exact[s["from_user_id"]] += cents * 10000
+            exact[s["to_user_id"]] -= cents * 10000
+    expected = {u: _round_bp(v) for u, v in exact.items()}
+    _expect(storage.get_balances() == expected,
+            f"saldos do livro {storage.get_balances()} != gastos e acertos {expected}")
+
+    before = datetime.now(timezone.utc)
+    a, b = users[0], users[1]
+    storage.add_expense(2500, a["id"], "Outro", "Depois", "2031-12-01", {b["id"]: 10000})
+    _expect(storage.get_balances(as_of=before) == expected, "saldo num instante passado não pode mudar")
+    after = storage.get_balances()
+    _expect((after[a["id"]] - expected[a["id"]], after[b["id"]] - expected[b["id"]]) == (2500, -2500),
+            f"gasto novo deve mover os saldos: {after}")
+    _expect(storage.rebuild_ledger() > 0, "replay deve escrever lançamentos")
+    _expect(storage.get_balances() == after, "replay deve dar os mesmos saldos")
+
+def check_closed_months(storage) -> None:
+    from src.database import MonthClosedError
+    a, b = storage.get_users()[:2]
+    split = {a["id"]: 5000, b["id"]: 5000}
+    # Closed by check_settlements_and_report; 2031-08 is still open.
+    snapshot = storage.get_month_snapshot("2031-05")
+    _expect(snapshot is not None and storage.get_month_snapshot("2031-08") is None, "só meses fechados têm retrato")
+    frozen = storage.list_expenses_month("2031-05")
+    _expect(frozen == snapshot["expenses"] and storage.get_month_balances("2031-05") == snapshot["balances"],
+            "mês fechado deve vir do retrato")
+    open_expense = storage.list_expenses_month("2031-08")[0]
+    writes = [
+        ("add_expense", lambda: storage.add_expense(100, a["id"], "Outro", "Tarde", "2031-05-30", split)),
+        ("bulk_add_expenses", lambda: storage.bulk_add_expenses([
+            {"spent_at": "2031-08-03", "amount_cents": 1, "payer_user_id": a["id"], "category": "Outro",
+             "description": "Aberto", "split_bp": split},
+            {"spent_at": "2031-05-03", "amount_cents": 1, "payer_user_id": a["id"], "category": "Outro",
+             "description": "Fechado", "split_bp": split},
+        ])),
+        ("update_expense (para mês fechado)", lambda: storage.update_expense(
+            open_expense["id"], 1, a["id"], "Outro", "x", "2031-05-04", split)),
+        ("update_expense (de mês fechado)", lambda: storage.update_expense(
+            frozen[0]["id"], 1, a["id"], "Outro", "x", "2031-08-04", split)),
+        ("delete_expense", lambda: storage.delete_expense(frozen[0]["id"])),
+    ]
+    balances = storage.get_balances()
+    for name, write in writes:
+        try:
+            write()
+        except MonthClosedError as e:
+            _expect(e.months == ["2031-05"], f"{name}: {e.months}")
+        else:
+            raise ConformanceError(f"{name} não pode mudar um mês fechado")
+    _expect(storage.list_expenses_month("2031-08")[0] == open_expense and len(storage.list_expenses_month("2031-08")) == 3,
+            "escrita recusada não pode gravar nada")
+    _expect(storage.get_balances() == balances, "escrita recusada não pode entrar no livro")
+
+    storage.update_category("Contas", "Contas da casa")
+    _expect(storage.list_expenses_month("2031-05") == frozen, "renomear categoria não muda o retrato")
+    storage.update_category("Contas da casa", "Contas")
+    storage.record_settlements("2031-05", [(b["id"], a["id"], 600)])
+    _expect(storage.list_expenses_month("2031-05") == frozen, "fechar de novo mantém o mês")
+
+# In order: later checks rely on data written by earlier ones.
+CHECKS: List[Tuple[str, Check]] = [
+    ("bootstrap", check_bootstrap),
+    ("expense roundtrip", check_expense_roundtrip),
+    ("duplicates", check_duplicates),
+    ("pagination", check_pagination),
+    ("month totals", check_month_totals),
+    ("settlements and report", check_settlements_and_report),
+    ("categories", check_categories),
+    ("month view", check_month_view),
+    ("idempotency keys", check_idempotency_keys),
+    # Last: adds members, and the checks above assume two.
+    ("household", check_household),
+    ("households", check_households),
+    ("ledger", check_ledger),
+    ("closed months", check_closed_months),
+]
+
+def run_checks(storage) -> List[str]:
+    """Bootstraps `storage` and runs every check; returns the failures."""
+    storage.bootstrap()
+    failures: List[str] = []
+    for name, check in CHECKS:
+        try:
+            check(storage)
+        except Exception as e:
+            failures.append(f"{name}: {type(e).__name__}: {e}")
+            print(f"[{storage.name}] FALHOU {name}: {e}")
+        else:
+            print(f"[{storage.name}] ok     {name}")
+    return failures
+
+def _sqlite_storage(url_env: str):
+    from src.sqlite_storage import SQLiteStorage
+    return SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="casa-split-"), "scratch.db"))
+
+def _postgres_storage(url_env: str):
+    url = os.getenv(url_env, "")
+    if not url:
+        raise SystemExit(f"Defina {url_env} com um banco descartável para rodar em Postgres.")
+    # src.pool reads DATABASE_URL when the pool opens; if something opened it
+    # before this point, it may be the app's database: never truncate that.
+    os.environ["DATABASE_URL"] = url
+    from src.database import get_connection
+    from src.migrations import migrate
+    from src.pool import get_pool
+    from src.storage import PostgresStorage
+    from src.tenancy import DEFAULT_HOUSEHOLD_ID
+    if get_pool().conninfo != url:
+        raise SystemExit(f"O pool de conexões já aponta para outro banco; {url_env} não foi esvaziado.")
+    migrate()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """TRUNCATE expenses, expense_splits, settlements, categories, users,
+                   month_summaries, month_user_summaries, ledger_entries, user_balances, month_snapshots
+                   RESTART IDENTITY CASCADE;"""
+            )
+            cur.execute("DELETE FROM households WHERE id <> %s;", (DEFAULT_HOUSEHOLD_ID,))
+        conn.commit()
+    return PostgresStorage()
+
+BACKENDS = {"sqlite": _sqlite_storage, "postgres": _postgres_storage}
+
+def scratch_storage(backend: str, url_env: str = "CONFORMANCE_DATABASE_URL"):
+    """An empty storage of the given backend: a temporary SQLite file, or the
+    Postgres database named by `url_env`, truncated. Also used by bench/."""
+    return BACKENDS[backend](url_env)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica que os backends de armazenamento se comportam igual.")
+    parser.add_argument("backends", nargs="*", choices=sorted(BACKENDS), default=["sqlite"])
+    args = parser.parse_args()
+    failed = 0
+    for backend in args.backends:
+        failed += len(run_checks(scratch_storage(backend)))
+    print("OK: todos os backends conformes." if not failed else f"{failed} verificação(ões) falharam.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,39 @@
+"""
+The household (tenant) the current code works for.
+
+One Postgres deployment serves many households: every table carries a
+household_id, every statement of src.database filters on it and every
+cache key starts with it. The id lives in a context variable, so each
+Streamlit session, worker thread or asyncio task (src.database_async
+copies the caller's context) reads and writes its own household's rows
+without passing the id through every call.
+
+HOUSEHOLD_ID picks the household used when nothing else was set: the
+one created by the migration that introduced households, or the only one
+of a SQLite file.
+"""
+import contextvars
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+DEFAULT_HOUSEHOLD_ID = int(os.getenv("HOUSEHOLD_ID", "1"))
+
+_current: contextvars.ContextVar[int] = contextvars.ContextVar("household", default=DEFAULT_HOUSEHOLD_ID)
+
+def current_household() -> int:
+    """Id of the household the statements of this thread/task are scoped to."""
+    return _current.get()
+
+def set_household(household_id: int) -> None:
+    """Scopes this thread/task to `household_id` (the app does it on every rerun)."""
+    _current.set(household_id)
+
+@contextmanager
+def use_household(household_id: int) -> Iterator[None]:
+    """Scopes the block to `household_id`, restoring the previous one after."""
+    token = _current.set(household_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
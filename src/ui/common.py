@@ -1,6 +1,7 @@
 import streamlit as st
 from datetime import datetime, timedelta
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from src.logic import equal_split, split_from_weights
 
 def last_n_months(n: int) -> List[str]:
     """Returns a list of the last n months in YYYY-MM format."""
@@ -15,6 +16,36 @@ def last_n_months(n: int) -> List[str]:
         months.append(target_month_date.strftime("%Y-%m"))
     return sorted(list(set(months)), reverse=True)
 
+def columns_for(items: List[Any], per_row: int = 3) -> Iterator[Tuple[Any, Any]]:
+    """Lays items out in rows of `per_row` columns; yields (column, item)."""
+    for start in range(0, len(items), per_row):
+        for col, item in zip(st.columns(per_row), items[start:start + per_row]):
+            yield col, item
+
+def split_editor(users: List[Dict[str, Any]], key: str, initial_bp: Optional[Dict[int, int]] = None) -> Dict[int, int]:
+    """Split widgets: equal parts by default, or one weight per person.
+
+    Weights are relative (2, 1, 1 is 50/25/25); returns the split in basis
+    points. `initial_bp` pre-fills the weights when editing an expense.
+    """
+    user_ids = [u["id"] for u in users]
+    equal = equal_split(user_ids)
+    is_custom = initial_bp is not None and any(initial_bp.get(u, 0) != bp for u, bp in equal.items())
+    if not st.checkbox("Personalizar divisão (padrão: partes iguais)", value=is_custom, key=f"{key}_custom"):
+        return equal
+    weights = {}
+    for col, u in columns_for(users):
+        default = (initial_bp or equal).get(u["id"], 0) / 100
+        weights[u["id"]] = col.number_input(
+            f"{u['name']} (peso)", min_value=0.0, value=float(default), step=5.0, key=f"{key}_{u['id']}"
+        )
+    if sum(weights.values()) <= 0:
+        st.warning("Dê peso a pelo menos uma pessoa; usando partes iguais.")
+        return equal
+    split = split_from_weights(weights)
+    st.caption(" · ".join(f"{u['name']}: {split[u['id']] / 100:.1f}%" for u in users))
+    return split
+
 def apply_custom_css():
     """Applies custom CSS for a more premium look."""
     st.markdown("""
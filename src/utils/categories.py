@@ -1,5 +1,5 @@
 from typing import List
-from src.database import get_categories, add_category, upsert_default_categories
+from src.storage import get_storage
 
 def get_categorias_padrao() -> List[str]:
     """Returns default categories names (proxied from DB/logic)."""
@@ -7,18 +7,18 @@ def get_categorias_padrao() -> List[str]:
 
 def carregar_categorias() -> List[str]:
     """Loads categories from the database."""
-    return get_categories()
+    return get_storage().get_categories()
 
 def salvar_categorias(categorias: List[str]) -> None:
     """Saves categories (stubbed since we add individually)."""
     # In the new DB approach, we usually add categories one by one.
     # This function is kept for compatibility with the reset button.
     # We could implement a full sync if needed, but for now we'll just ensure defaults.
-    upsert_default_categories()
+    get_storage().upsert_default_categories()
 
 def adicionar_categoria_personalizada(nova_categoria: str) -> bool:
     """Adds a new custom category to the database."""
     if nova_categoria.strip():
-        add_category(nova_categoria.strip())
+        get_storage().add_category(nova_categoria.strip())
         return True
     return False
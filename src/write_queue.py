@@ -0,0 +1,446 @@
+"""
+Write-behind queue for new expenses.
+
+With WRITE_QUEUE=1, "Adicionar gasto" appends the expense to a local
+append-only journal (fsynced) and returns at once; a background thread
+sends the queued expenses to the storage in batches, retrying with
+backoff while the database is slow, asleep or unreachable. Each entry
+carries an idempotency key stored with the expense, so a batch that was
+written but not acknowledged (crash, timeout) is not written twice when it
+is sent again.
+
+The journal is JSON lines: {"op": "add", ...} per queued expense and
+{"op": "done", "keys": [...]} per flushed batch. On start it is replayed,
+so whatever was pending when the process stopped is sent on the next run.
+One process per journal file.
+
+Only expense creation is queued; edits, deletions and settlements still go
+straight to the storage. An expense whose month was closed (Fechamento)
+after it was queued is written as an adjustment dated the flush day. Each
+entry keeps the household it was queued for (src.tenancy) and is written
+under it, whichever session the worker thread serves.
+
+An entry the storage keeps rejecting while it otherwise answers (a bad
+payer, a category that can't be created...) is sent alone and, after
+WRITE_QUEUE_MAX_ATTEMPTS tries, moved out of the queue into a dead letter
+({"op": "dead", ...} in the journal), so it no longer holds back the ones
+behind it. The sidebar lists dead letters to be retried or discarded.
+"""
+import atexit
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, TypedDict
+from src.database import MonthBalances, MonthClosedError, RangeReport
+from src.logic import _round_bp
+from src.tenancy import DEFAULT_HOUSEHOLD_ID, current_household, use_household
+
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE", "0") not in ("0", "false", "False", "")
+WRITE_QUEUE_PATH = os.getenv("WRITE_QUEUE_PATH", "casa_split_queue.jsonl")
+WRITE_QUEUE_BATCH_SIZE = int(os.getenv("WRITE_QUEUE_BATCH_SIZE", "100"))
+# Longest wait between retries while the database keeps failing.
+WRITE_QUEUE_MAX_BACKOFF_S = float(os.getenv("WRITE_QUEUE_MAX_BACKOFF_S", "60"))
+# Failed tries (with the database up) before an entry becomes a dead letter.
+WRITE_QUEUE_MAX_ATTEMPTS = int(os.getenv("WRITE_QUEUE_MAX_ATTEMPTS", "5"))
+
+# Rewrite the journal once it holds this many flushed entries.
+COMPACT_AFTER = 1000
+
+class PendingExpense(TypedDict):
+    key: str
+    queued_at: str
+    household_id: int
+    amount_cents: int
+    payer_user_id: int
+    category: str
+    description: str
+    spent_at: str
+    # user_id -> share in basis points (10000 = 100%)
+    split_bp: Dict[int, int]
+    # Also create `category` (a custom one typed in the form) before the expense.
+    add_category: bool
+
+class DeadLetter(TypedDict):
+    expense: PendingExpense
+    error: str
+    failed_at: str
+
+class WriteQueue:
+    """A journal-backed queue of expenses and the thread that flushes it."""
+
+    def __init__(self, storage, path: str = WRITE_QUEUE_PATH, batch_size: int = WRITE_QUEUE_BATCH_SIZE):
+        self.storage = storage
+        self.path = path
+        self.batch_size = batch_size
+        self.last_error: Optional[str] = None
+        self.last_flush_at: Optional[str] = None
+        self._pending: Dict[str, PendingExpense] = {}
+        self._dead: Dict[str, DeadLetter] = {}
+        # Failed tries per key in this process; a restart gives entries a fresh start.
+        self._attempts: Dict[str, int] = {}
+        self._flushed = 0
+        self._lock = threading.Lock()
+        # Serializes flush() between the worker and explicit callers.
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-append was never acknowledged.
+                    continue
+                if record.get("op") == "add":
+                    entry = record["expense"]
+                    # JSON object keys are strings; user ids are ints everywhere else.
+                    entry["split_bp"] = {int(k): v for k, v in entry["split_bp"].items()}
+                    # Journaled before households existed.
+                    entry.setdefault("household_id", DEFAULT_HOUSEHOLD_ID)
+                    self._pending[entry["key"]] = entry
+                elif record.get("op") == "done":
+                    for key in record["keys"]:
+                        self._flushed += self._pending.pop(key, None) is not None
+                        self._flushed += self._dead.pop(key, None) is not None
+                elif record.get("op") == "dead":
+                    entry = self._pending.pop(record["key"], None)
+                    if entry is not None:
+                        self._dead[record["key"]] = {
+                            "expense": entry, "error": record["error"], "failed_at": record["failed_at"]}
+                elif record.get("op") == "retry":
+                    dead = self._dead.pop(record["key"], None)
+                    if dead is not None:
+                        self._pending[record["key"]] = dead["expense"]
+        self._compact()
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _compact(self) -> None:
+        """Drops flushed entries from the journal (caller holds the lock or is __init__)."""
+        if self._flushed < COMPACT_AFTER and (self._pending or not self._flushed):
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self._pending.values():
+                f.write(json.dumps({"op": "add", "expense": entry}, ensure_ascii=False) + "\n")
+            for key, dead in self._dead.items():
+                f.write(json.dumps({"op": "add", "expense": dead["expense"]}, ensure_ascii=False) + "\n")
+                f.write(json.dumps({"op": "dead", "key": key, "error": dead["error"],
+                                    "failed_at": dead["failed_at"]}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._flushed = 0
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def enqueue_expense(
+        self,
+        amount_cents: int,
+        payer_user_id: int,
+        category: str,
+        description: str,
+        spent_at: str,
+        split_bp: Dict[int, int],
+        add_category: bool = False
+    ) -> str:
+        """Journals one expense and wakes the worker; returns its idempotency key.
+
+        Returns once the entry is on disk, without touching the database.
+        """
+        entry: PendingExpense = {
+            "key": uuid.uuid4().hex,
+            "queued_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "household_id": current_household(),
+            "amount_cents": amount_cents,
+            "payer_user_id": payer_user_id,
+            "category": category,
+            "description": description,
+            "spent_at": str(spent_at)[:10],
+            "split_bp": dict(split_bp),
+            "add_category": add_category,
+        }
+        with self._lock:
+            self._append({"op": "add", "expense": entry})
+            self._pending[entry["key"]] = entry
+        self._wake.set()
+        return entry["key"]
+
+    def pending(self, month: Optional[str] = None) -> List[PendingExpense]:
+        """The current household's queued expenses not yet written, oldest
+        first (only `month`'s if given)."""
+        household = current_household()
+        with self._lock:
+            entries = list(self._pending.values())
+        return [e for e in entries
+                if e["household_id"] == household and (month is None or e["spent_at"][:7] == month)]
+
+    def landing(self, month: Optional[str] = None) -> List[PendingExpense]:
+        """pending(), but as flush will write it: an entry of a closed month is
+        the adjustment dated today, so it never shows inside a frozen month."""
+        entries = self.pending()
+        closed = {m for m in {e["spent_at"][:7] for e in entries} if self.storage.get_month_snapshot(m) is not None}
+        today = date.today().isoformat()
+        entries = [_as_adjustment(e, today) if e["spent_at"][:7] in closed else e for e in entries]
+        return [e for e in entries if month is None or e["spent_at"][:7] == month]
+
+    def dead_letters(self) -> List[DeadLetter]:
+        """The current household's entries the storage kept rejecting, oldest first."""
+        household = current_household()
+        with self._lock:
+            dead = list(self._dead.values())
+        return [d for d in dead if d["expense"]["household_id"] == household]
+
+    def retry_dead(self, key: str) -> None:
+        """Puts a dead letter back at the end of the queue."""
+        with self._lock:
+            dead = self._dead.pop(key, None)
+            if dead is None:
+                return
+            self._append({"op": "retry", "key": key})
+            self._pending[key] = dead["expense"]
+            self._attempts.pop(key, None)
+        self._wake.set()
+
+    def discard_dead(self, key: str) -> None:
+        """Drops a dead letter for good."""
+        with self._lock:
+            if self._dead.pop(key, None) is None:
+                return
+            self._append({"op": "done", "keys": [key]})
+            self._flushed += 1
+            self._compact()
+
+    def flush(self) -> int:
+        """Writes one batch to the storage; returns how many entries it cleared.
+
+        Raises whatever the storage raises; the entries then stay queued.
+        After a failure the oldest entry is sent alone, and once it has failed
+        WRITE_QUEUE_MAX_ATTEMPTS times with the storage still answering it is
+        moved to the dead letters instead (and counts as cleared).
+        """
+        with self._flush_lock:
+            with self._lock:
+                # Oldest household first; a batch never mixes households.
+                entries = list(self._pending.values())
+            if not entries:
+                return 0
+            household = entries[0]["household_id"]
+            batch = [e for e in entries if e["household_id"] == household][:self.batch_size]
+            head = batch[0]["key"]
+            if self._attempts.get(head):
+                # It failed before: alone, so a bad entry can't sink a whole batch.
+                batch = batch[:1]
+            with use_household(household):
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    if len(batch) > 1:
+                        self._attempts[head] = 1
+                        raise
+                    if not self._storage_answers():
+                        # Down or asleep: not the entry's fault; the caller backs off.
+                        raise
+                    self._attempts[head] = self._attempts.get(head, 0) + 1
+                    if self._attempts[head] < WRITE_QUEUE_MAX_ATTEMPTS:
+                        raise
+                    self._bury(batch[0], f"{type(e).__name__}: {e}")
+                    return 1
+            keys = [e["key"] for e in batch]
+            with self._lock:
+                self._append({"op": "done", "keys": keys})
+                for key in keys:
+                    self._pending.pop(key, None)
+                    self._attempts.pop(key, None)
+                self._flushed += len(keys)
+                self._compact()
+            self.last_flush_at = datetime.utcnow().isoformat(timespec="seconds")
+            return len(keys)
+
+    def _write_batch(self, batch: List[PendingExpense]) -> None:
+        for category in sorted({e["category"] for e in batch if e["add_category"]}):
+            self.storage.add_category(category)
+        try:
+            self._write(batch)
+        except MonthClosedError as closed:
+            # Same keys, so an adjustment is still written only once.
+            today = date.today().isoformat()
+            self._write([_as_adjustment(e, today) if e["spent_at"][:7] in closed.months else e for e in batch])
+
+    def _storage_answers(self) -> bool:
+        """Whether the storage serves a plain read, i.e. the failure is the entry's."""
+        try:
+            self.storage.get_users()
+        except Exception:
+            return False
+        return True
+
+    def _bury(self, entry: PendingExpense, error: str) -> None:
+        """Moves an entry from the queue to the dead letters."""
+        dead: DeadLetter = {
+            "expense": entry,
+            "error": error,
+            "failed_at": datetime.utcnow().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self._append({"op": "dead", "key": entry["key"], "error": dead["error"], "failed_at": dead["failed_at"]})
+            self._pending.pop(entry["key"], None)
+            self._attempts.pop(entry["key"], None)
+            self._dead[entry["key"]] = dead
+
+    def _write(self, batch: List[PendingExpense]) -> None:
+        self.storage.bulk_add_expenses([
+            {"spent_at": e["spent_at"], "amount_cents": e["amount_cents"],
+             "payer_user_id": e["payer_user_id"], "category": e["category"],
+             "description": e["description"], "split_bp": e["split_bp"], "idempotency_key": e["key"]}
+            for e in batch
+        ])
+
+    def drain(self) -> int:
+        """Flushes batches until nothing is pending; returns how many were written."""
+        total = 0
+        while True:
+            flushed = self.flush()
+            if not flushed:
+                return total
+            total += flushed
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self.drain()
+                self.last_error = None
+                backoff = 1.0
+                self._wake.wait()
+                self._wake.clear()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                # Sleep, but stop early on stop(); a new entry doesn't reset the backoff.
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, WRITE_QUEUE_MAX_BACKOFF_S)
+
+    def start(self) -> None:
+        """Starts the background flusher (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stops the flusher after a last attempt to drain; what's left stays journaled."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.drain()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+
+def _as_adjustment(entry: PendingExpense, day: str) -> PendingExpense:
+    """`entry` moved to `day`, for a month closed after it was queued."""
+    return {**entry, "spent_at": day, "description": f"Ajuste de {entry['spent_at']}: {entry['description']}"}
+
+_queue: Optional[WriteQueue] = None
+_queue_lock = threading.Lock()
+
+def get_write_queue() -> Optional[WriteQueue]:
+    """The process-wide queue, started on first use; None unless WRITE_QUEUE is set."""
+    global _queue
+    if not WRITE_QUEUE_ENABLED:
+        return None
+    with _queue_lock:
+        if _queue is None:
+            from src.storage import get_storage
+            _queue = WriteQueue(get_storage())
+            _queue.start()
+        return _queue
+
+def _pending_quota_cents(pending: List[PendingExpense]) -> Dict[int, int]:
+    """Each user's share of the queued expenses: cents x bp summed, rounded once."""
+    quota_bp: Dict[int, int] = {}
+    for e in pending:
+        for user_id, bp in e["split_bp"].items():
+            quota_bp[user_id] = quota_bp.get(user_id, 0) + e["amount_cents"] * bp
+    return {user_id: _round_bp(bp) for user_id, bp in quota_bp.items()}
+
+def merge_pending_balances(balances: MonthBalances, pending: List[PendingExpense]) -> MonthBalances:
+    """`balances` plus the queued expenses, for pages that show not-yet-written entries."""
+    paid = dict(balances["paid_cents"])
+    quota = dict(balances["quota_cents"])
+    for e in pending:
+        paid[e["payer_user_id"]] = paid.get(e["payer_user_id"], 0) + e["amount_cents"]
+    for user_id, cents in _pending_quota_cents(pending).items():
+        quota[user_id] = quota.get(user_id, 0) + cents
+    return {
+        "expense_count": balances["expense_count"] + len(pending),
+        "total_cents": balances["total_cents"] + sum(e["amount_cents"] for e in pending),
+        "paid_cents": paid,
+        "quota_cents": quota,
+    }
+
+def merge_pending_ledger(balances: Dict[int, int], pending: List[PendingExpense]) -> Dict[int, int]:
+    """Running balances (Storage.get_balances) plus the queued expenses."""
+    merged = dict(balances)
+    for e in pending:
+        merged[e["payer_user_id"]] = merged.get(e["payer_user_id"], 0) + e["amount_cents"]
+    for user_id, cents in _pending_quota_cents(pending).items():
+        merged[user_id] = merged.get(user_id, 0) - cents
+    return merged
+
+def merge_pending_report(report: RangeReport, pending: List[PendingExpense]) -> RangeReport:
+    """`report` plus the queued expenses of its months, balances and carry-over redone."""
+    months = {m["month"]: {**m, "paid_cents": dict(m["paid_cents"]), "quota_cents": dict(m["quota_cents"])}
+              for m in report["months"]}
+    category_by_month = {c: dict(v) for c, v in report["category_by_month"].items()}
+    pending_by_month: Dict[str, List[PendingExpense]] = {}
+    for e in pending:
+        m = months.get(e["spent_at"][:7])
+        if m is None:
+            continue
+        m["expense_count"] += 1
+        m["total_cents"] += e["amount_cents"]
+        m["paid_cents"][e["payer_user_id"]] = m["paid_cents"].get(e["payer_user_id"], 0) + e["amount_cents"]
+        pending_by_month.setdefault(m["month"], []).append(e)
+        by_month = category_by_month.setdefault(e["category"], {})
+        by_month[m["month"]] = by_month.get(m["month"], 0) + e["amount_cents"]
+    for month, month_pending in pending_by_month.items():
+        quota = months[month]["quota_cents"]
+        for user_id, cents in _pending_quota_cents(month_pending).items():
+            quota[user_id] = quota.get(user_id, 0) + cents
+
+    carry: Dict[int, int] = {}
+    for m in months.values():
+        m["balance_cents"] = {}
+        for user_id in set(m["paid_cents"]) | set(m["quota_cents"]) | set(m["settled_cents"]):
+            balance = m["paid_cents"].get(user_id, 0) - m["quota_cents"].get(user_id, 0)
+            m["balance_cents"][user_id] = balance
+            carry[user_id] = carry.get(user_id, 0) + balance + m["settled_cents"].get(user_id, 0)
+        m["carry_cents"] = dict(carry)
+    return {
+        **report,
+        "months": list(months.values()),
+        "category_totals": {c: sum(v.values()) for c, v in category_by_month.items()},
+        "category_by_month": category_by_month,
+    }
+
+if __name__ == "__main__":
+    # Sends whatever is queued now, e.g. before moving the journal elsewhere.
+    from src.storage import get_storage
+    queue = WriteQueue(get_storage())
+    print(f"{len(queue._pending)} gastos na fila em {queue.path}")
+    print(f"{queue.drain()} gastos gravados")
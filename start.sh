@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -e
 
+# Aplica migrações pendentes antes de servir requisições
+python -m src.storage
+
 # Render fornece PORT; streamlit precisa ouvir em 0.0.0.0
 streamlit run app.py --server.port "$PORT" --server.address 0.0.0.0
 